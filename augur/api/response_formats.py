@@ -0,0 +1,191 @@
+"""This module defines the formats and compression of the metric responses of the api.
+
+Arrow and parquet responses need the optional pyarrow package, and brotli compression needs the optional brotli package.
+"""
+import gzip
+import io
+import json
+from functools import lru_cache
+from typing import Optional, Union
+
+import pandas as pd
+from flask import request, Response, has_request_context
+
+# formats a metric can be serialized to and their mimetypes
+RESPONSE_MIMETYPES = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# orients of json metric responses
+JSON_ORIENTS = ("records", "split", "columnar", "index", "columns", "values", "table")
+
+# responses smaller than this many bytes are not compressed
+MIN_COMPRESSED_RESPONSE_SIZE = 1024
+
+# the fast levels are used, since the responses are compressed for every request
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+
+
+@lru_cache(maxsize=None)
+def pyarrow_available() -> bool:
+    """Determine if the optional pyarrow package is installed so arrow and parquet responses can be made.
+
+    Note:
+        The result is cached, since this is checked for every metric request
+
+    Returns:
+        True if pyarrow can be imported
+    """
+    try:
+        import pyarrow  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        return False
+
+    return True
+
+
+@lru_cache(maxsize=None)
+def brotli_available() -> bool:
+    """Determine if the optional brotli package is installed so responses can be compressed with it.
+
+    Note:
+        The result is cached, since this is checked for every compressed response
+
+    Returns:
+        True if brotli can be imported
+    """
+    try:
+        import brotli  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        return False
+
+    return True
+
+
+def get_response_format(requested_format: Optional[str] = None) -> Optional[str]:
+    """Determine the format of a metric response from the format query parameter or the Accept header.
+
+    Args:
+        requested_format: value of the format query parameter
+
+    Returns:
+        "json", "arrow" or "parquet", or None if the requested format is not available
+    """
+    available_formats = ["json"]
+    if pyarrow_available():
+        available_formats += ["arrow", "parquet"]
+
+    if requested_format:
+        return requested_format if requested_format in available_formats else None
+
+    if not has_request_context():
+        return "json"
+
+    # json is first, so it is used when the client accepts anything
+    mimetype = request.accept_mimetypes.best_match([RESPONSE_MIMETYPES[name] for name in available_formats])
+
+    for name in available_formats:
+        if RESPONSE_MIMETYPES[name] == mimetype:
+            return name
+
+    return "json"
+
+
+def serialize_dataframe(data: pd.DataFrame, response_format: str = "json", orient: str = "records") -> Union[str, bytes]:
+    """Serialize the dataframe of a metric.
+
+    Args:
+        data: the dataframe
+        response_format: "json", "arrow" or "parquet"
+        orient: layout of json responses. It is one of the pandas orients, or columnar for an object of column arrays
+
+    Returns:
+        json as a string, or arrow ipc stream and parquet data as bytes
+    """
+    if response_format == "arrow":
+        import pyarrow  # pylint: disable=import-outside-toplevel
+
+        table = pyarrow.Table.from_pandas(data, preserve_index=False)
+        sink = pyarrow.BufferOutputStream()
+
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+
+        return sink.getvalue().to_pybytes()
+
+    if response_format == "parquet":
+        buffer = io.BytesIO()
+        data.to_parquet(buffer, engine="pyarrow", index=False)
+
+        return buffer.getvalue()
+
+    # each column is one array, so the column names are not repeated for every row like records
+    if orient == "columnar":
+        columns = [f"{json.dumps(str(column))}:{data[column].to_json(orient='values', date_format='iso', date_unit='ms')}" for column in data.columns]
+        return "{" + ",".join(columns) + "}"
+
+    return data.to_json(orient=orient, date_format='iso', date_unit='ms')
+
+
+def create_metric_response(body: Union[str, bytes], response_format: str = "json") -> Response:
+    """Create the response of a metric, which is compressed if the client accepts it.
+
+    Args:
+        body: the serialized metric
+        response_format: the format the metric was requested in
+
+    Returns:
+        the response
+    """
+    # metrics that are not dataframes are always json
+    mimetype = RESPONSE_MIMETYPES[response_format] if isinstance(body, bytes) else RESPONSE_MIMETYPES["json"]
+
+    response = Response(response=body,
+                        status=200,
+                        mimetype=mimetype)
+    response.vary.add("Accept")
+
+    return compress_response(response)
+
+
+def compress_response(response: Response) -> Response:
+    """Compress the body of a response with brotli or gzip, whichever is preferred by the client.
+
+    Note:
+        Small bodies are not compressed, since the headers cost more than is saved
+    """
+    response.vary.add("Accept-Encoding")
+
+    if response.status_code != 200 or response.direct_passthrough or "Content-Encoding" in response.headers:
+        return response
+
+    body = response.get_data()
+    if len(body) < MIN_COMPRESSED_RESPONSE_SIZE:
+        return response
+
+    accept_encodings = request.accept_encodings
+
+    if brotli_available() and accept_encodings["br"] and accept_encodings["br"] >= accept_encodings["gzip"]:
+        import brotli  # pylint: disable=import-outside-toplevel
+
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+        response.headers["Content-Encoding"] = "br"
+
+    elif accept_encodings["gzip"]:
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+        response.headers["Content-Encoding"] = "gzip"
+
+    return response
+
+
+def unavailable_format_response() -> Response:
+    """Response to a request for a format that is unknown, or that needs a package which is not installed."""
+
+    formats = ", ".join(name for name in RESPONSE_MIMETYPES if get_response_format(name))
+
+    return Response(response=json.dumps({"error": f"format must be one of {formats}"}),
+                    status=406,
+                    mimetype="application/json")
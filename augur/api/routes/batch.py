@@ -5,91 +5,178 @@ Creates routes for the manager
 
 import logging
 import time
+import base64
 import requests
 import sqlalchemy as s
 from sqlalchemy import exc
-from flask import request, Response
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, List, Optional
+from flask import request, Response, abort
 from augur.api.util import metric_metadata
 import json
-from ..server import app
+from ..server import app, engine
 
 from augur.api.routes import AUGUR_API_VERSION
 
 logger = logging.getLogger(__name__)
 
+# max number of sub-requests of a batch that run at the same time.
+# They are also limited to the size of the connection pool, so a batch does not take the overflow connections
+BATCH_MAX_WORKERS = 8
 
-@app.route('/{}/batch'.format(AUGUR_API_VERSION), methods=['GET', 'POST'])
-def batch():
-    """
-    Execute multiple requests, submitted as a batch.
-    :statuscode 207: Multi status
+
+def parse_batch_requests(batch_requests) -> Optional[List[dict]]:
+    """Validate the sub-requests of a batch before any of them run.
+
+    Note:
+        Bodies that are not strings (a json object for example) are serialized to json, 
+        so every sub-request can be used as a key when identical ones are merged
+
+    Args:
+        batch_requests: the parsed json of the batch
+
+    Returns:
+        the sub-requests, or None if the batch is not a list of objects with a string method and path
     """
+    if not isinstance(batch_requests, list):
+        return None
 
-    if request.method == 'GET':
-        """this will return sensible defaults in the future"""
-        return app.make_response('{"status": "501", "response": "Defaults for batch requests not implemented. Please POST a JSON array of requests to this endpoint for now."}')
+    parsed_requests = []
+    for req in batch_requests:
+
+        if not isinstance(req, dict) or not isinstance(req.get('method'), str) or not isinstance(req.get('path'), str):
+            return None
+
+        body = req.get('body', None)
+        if body is not None and not isinstance(body, str):
+            body = json.dumps(body)
+
+        parsed_requests.append({"method": req['method'], "path": req['path'], "body": body})
+
+    return parsed_requests
+
+
+def run_batch_request(method: str, path: str, body: Optional[str] = None) -> dict:
+    """Run a sub-request of a batch in its own request context.
+
+    Args:
+        method: http method of the sub-request
+        path: path and query of the sub-request
+        body: body of the sub-request
+
+    Returns:
+        dict with the path, status, response and duration of the sub-request
+    """
+    start = time.perf_counter()
 
     try:
-        requests = json.loads(request.data.decode('utf-8'))
-    except ValueError as e:
-        request.abort(400)
 
-    responses = []
+        logger.debug('batch-internal-loop: %s %s' % (method, path))
 
-    for index, req in enumerate(requests):
+        # the context has its own flask.g and database session, so sub-requests can run in other threads
+        with app.test_request_context(path,
+                                        method=method,
+                                        data=body):
+            try:
+                # Pre process Request
+                rv = app.preprocess_request()
 
+                if rv is None:
+                    # Main Dispatch
+                    rv = app.dispatch_request()
 
-        method = req['method']
-        path = req['path']
-        body = req.get('body', None)
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+
+            response = app.make_response(rv)
 
+            # Post process Request
+            response = app.process_response(response)
+
+            data = response.get_data()
+
+        # Response is a Flask response object.
+        # If your endpoints return JSON object,
+        # the response would be the JSON string.
         try:
+            result = {"path": path, "status": response.status_code, "response": str(data, 'utf8')}
+        except UnicodeDecodeError:
+            # arrow and parquet responses are binary
+            result = {"path": path, "status": response.status_code, "response": base64.b64encode(data).decode(), "encoding": "base64"}
+
+    except Exception as e:
+
+        result = {
+            "path": path,
+            "status": 500,
+            "response": str(e)
+        }
 
-            logger.debug('batch-internal-loop: %s %s' % (method, path))
+    result["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
 
-            with app.server.app.context():
-                with app.test_request_context(path,
-                                                method=method,
-                                                data=body):
-                    try:
-                        # Can modify flask.g here without affecting
-                        # flask.g of the root request for the batch
+    return result
 
-                        # Pre process Request
-                        rv = app.preprocess_request()
 
-                        if rv is None:
-                            # Main Dispatch
-                            rv = app.dispatch_request()
+def stream_batch_responses(batch_requests: List[dict]) -> Iterator[str]:
+    """Run the sub-requests of a batch concurrently and stream the json array of their responses as they complete.
 
-                    except Exception as e:
-                        rv = app.handle_user_exception(e)
+    Note:
+        Identical sub-requests are only run once. Responses are in the order they complete, 
+        so each one has the index of its sub-request
+    """
+    indexes_by_request = {}
+    for index, req in enumerate(batch_requests):
+        key = (req['method'].upper(), req['path'], req.get('body', None))
+        indexes_by_request.setdefault(key, []).append(index)
+
+    max_workers = max(1, min(BATCH_MAX_WORKERS, engine.pool.size(), len(indexes_by_request)))
 
-                    response = app.make_response(rv)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
 
-                    # Post process Request
-                    response = app.process_response(response)
+    try:
+        futures = {executor.submit(run_batch_request, method, path, body): indexes
+                   for (method, path, body), indexes in indexes_by_request.items()}
 
-            # Response is a Flask response object.
-            # _read_response(response) reads response.response
-            # and returns a string. If your endpoints return JSON object,
-            # this string would be the response as a JSON string.
-            responses.append({
-                "path": path,
-                "status": response.status_code,
-                "response": str(response.get_data(), 'utf8'),
-            })
+        yield "["
 
-        except Exception as e:
+        first = True
+        for future in as_completed(futures):
 
-            responses.append({
-                "path": path,
-                "status": 500,
-                "response": str(e)
-            })
+            result = future.result()
 
+            for index in futures[future]:
+                yield ("" if first else ",") + json.dumps(dict(result, index=index))
+                first = False
 
-    return Response(response=json.dumps(responses),
+        yield "]"
+
+    finally:
+        # the client can disconnect before the batch is done, so the sub-requests that did not start are dropped
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+@app.route('/{}/batch'.format(AUGUR_API_VERSION), methods=['GET', 'POST'])
+def batch():
+    """
+    Execute multiple requests, submitted as a batch.
+    :statuscode 207: Multi status
+    """
+
+    if request.method == 'GET':
+        """this will return sensible defaults in the future"""
+        return app.make_response('{"status": "501", "response": "Defaults for batch requests not implemented. Please POST a JSON array of requests to this endpoint for now."}')
+
+    try:
+        requests = json.loads(request.data.decode('utf-8'))
+    except ValueError as e:
+        abort(400)
+
+    # the responses are streamed after the 207 is sent, so the sub-requests are validated first
+    requests = parse_batch_requests(requests)
+    if requests is None:
+        abort(400)
+
+    return Response(response=stream_batch_responses(requests),
                     status=207,
                     mimetype="application/json")
 
@@ -114,42 +201,21 @@ def batch_metadata():
     try:
         requests = json.loads(request.data.decode('utf-8'))
     except ValueError as e:
-        request.abort(400)
+        abort(400)
+
+    requests = parse_batch_requests(requests)
+    if requests is None:
+        abort(400)
 
     responses = []
 
     for index, req in enumerate(requests):
         method = req['method']
         path = req['path']
-        body = req.get('body', None)
+        body = req['body']
 
-        try:
-            logger.info('batch endpoint: ' + path)
-            with app.server.app.context():
-                with app.test_request_context(path,
-                                                method=method,
-                                                data=body):
-                    try:
-                        rv = app.preprocess_request()
-                        if rv is None:
-                            rv = app.dispatch_request()
-                    except Exception as e:
-                        rv = app.handle_user_exception(e)
-                    response = app.make_response(rv)
-                    response = app.process_response(response)
-
-            responses.append({
-                "path": path,
-                "status": response.status_code,
-                "response": str(response.get_data(), 'utf8'),
-            })
-
-        except Exception as e:
-            responses.append({
-                "path": path,
-                "status": 500,
-                "response": str(e)
-            })
+        logger.info('batch endpoint: ' + path)
+        responses.append(run_batch_request(method, path, body))
 
     return Response(response=json.dumps(responses),
                     status=207,
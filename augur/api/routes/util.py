@@ -1,6 +1,6 @@
 #SPDX-License-Identifier: MIT
 from augur.api.routes import AUGUR_API_VERSION
-from ..server import app, engine
+from ..server import app, engine, conditional_on_collection
 import base64
 import sqlalchemy as s
 import pandas as pd
@@ -14,6 +14,7 @@ from augur.application.config import AugurConfig
 logger = AugurLogger("augur").get_logger()
 
 @app.route('/{}/repo-groups'.format(AUGUR_API_VERSION))
+@conditional_on_collection
 def get_all_repo_groups(): #TODO: make this name automatic - wrapper?
     repoGroupsSQL = s.sql.text("""
         SELECT *
@@ -29,6 +30,7 @@ def get_all_repo_groups(): #TODO: make this name automatic - wrapper?
                     mimetype="application/json")
 
 @app.route('/{}/repos'.format(AUGUR_API_VERSION))
+@conditional_on_collection
 def get_all_repos():
 
     get_all_repos_sql = s.sql.text("""
@@ -109,6 +111,7 @@ def get_repos_in_repo_group(repo_group_id):
                     mimetype="application/json")
 
 @app.route('/{}/repos/<repo_id>'.format(AUGUR_API_VERSION))
+@conditional_on_collection
 def get_repo_by_id(repo_id: int) -> Response:
     repo_by_id_SQL = s.sql.text("""
         SELECT
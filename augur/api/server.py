@@ -10,27 +10,34 @@ import os
 import base64
 import logging
 import importlib
+import hashlib
+import datetime
 import graphene
+import sqlalchemy as s
 
-from typing import Optional, List, Any, Tuple
+from typing import Optional, List, Any, Tuple, Union
+from functools import wraps
 
 from pathlib import Path
 
-from flask import Flask, request, Response, redirect, jsonify
+from flask import Flask, request, Response, redirect, jsonify, has_request_context, make_response
+from werkzeug.http import is_resource_modified
 from flask_cors import CORS
 import pandas as pd
-from beaker.util import parse_cache_config_options
-from beaker.cache import CacheManager, Cache
-from sqlalchemy import create_engine
-from sqlalchemy.pool import StaticPool
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session
+from sqlalchemy.pool import NullPool
 from flask_graphql import GraphQLView
 from graphene_sqlalchemy import SQLAlchemyObjectType
 
 
 from augur.application.logs import AugurLogger
-from augur.application.config import AugurConfig
+from augur.application.config import AugurConfig, default_config
 from augur.application.db.session import DatabaseSession
-from augur.application.db.engine import get_database_string, create_database_engine
+from augur.application.db.engine import get_database_string, create_database_engine, CheckoutTimedQueuePool
+from augur.tasks.init.redis_connection import redis_connection
+from augur.tasks.util.metric_cache import MetricCache
+from augur.api.response_formats import JSON_ORIENTS, get_response_format, serialize_dataframe, create_metric_response, compress_response, unavailable_format_response
 from metadata import __version__ as augur_code_version
 from augur.application.db.models import Repo, Issue, PullRequest, Message, PullRequestReview, Commit, IssueAssignee, PullRequestAssignee, PullRequestCommit, PullRequestFile, Contributor, IssueLabel, PullRequestLabel, ContributorsAlias, Release, ClientApplication
 
@@ -40,7 +47,6 @@ AUGUR_API_VERSION = "api/unstable"
 
 show_metadata = False
 
-
 def get_file_id(path: str) -> str:
     """Gets the file id of a given path.
 
@@ -121,7 +127,7 @@ def get_metric_files() -> List[str]:
     
 # NOTE: Paramater on=None removed, since it is not used in the function Aug 18, 2022 - Andrew Brain
 def route_transform(func: Any, args: Any=None, kwargs: dict=None, repo_url_base: str=None, orient: str ='records',
-    group_by: str=None, aggregate: str='sum', resample=None, date_col: str='date') -> str:
+    group_by: str=None, aggregate: str='sum', resample=None, date_col: str='date', response_format: str='json') -> Union[str, bytes]:
     """Call a metric function and apply data transformations.
 
     Note:
@@ -133,12 +139,13 @@ def route_transform(func: Any, args: Any=None, kwargs: dict=None, repo_url_base:
         args:
         kwargs:
         repo_url_base:
-        orient: 
+        orient: layout of json dataframes, which is a pandas orient or columnar
         group_byf
         on
         aggregate:
         resample:
         date_col:
+        response_format: "json", "arrow" or "parquet". Metrics that are not dataframes are always json
 
     Returns:
         The result of calling the function and applying the data transformations
@@ -180,8 +187,8 @@ def route_transform(func: Any, args: Any=None, kwargs: dict=None, repo_url_base:
                 data = data.resample(resample).aggregate(aggregate)
                 data['date'] = data.index
             
-            # converts pandas dataframe to json
-            result = data.to_json(orient=orient, date_format='iso', date_unit='ms')
+            # converts pandas dataframe to json, or the requested format
+            result = serialize_dataframe(data, response_format, orient)
         else:
             # trys to convert dict to json
             try:
@@ -198,25 +205,124 @@ def route_transform(func: Any, args: Any=None, kwargs: dict=None, repo_url_base:
 def flaskify(function: Any) -> Any:
     """Simplifies API endpoints that just accept owner and repo, transforms them and spits them out.
     """
-    if cache_manager:
-        def cache_generated_function(*args, **kwargs):
-            def heavy_lifting():
-                return route_transform(function, args, kwargs, **request.args.to_dict())
-            body = server_cache.get(key=str(request.url), createfunc=heavy_lifting)
-            return Response(response=body,
-                            status=200,
-                            mimetype="application/json")
-        cache_generated_function.__name__ = function.__name__
-        logger.info(cache_generated_function.__name__)
-        return cache_generated_function
-
-    def generated_function(*args, **kwargs):
-        kwargs.update(request.args.to_dict())
-        return Response(response=route_transform(function, args, kwargs, **request.args.to_dict()),
-                        status=200,
-                        mimetype="application/json")
-    generated_function.__name__ = function.__name__
-    return generated_function
+    def cache_generated_function(*args, **kwargs):
+        transform_args = request.args.to_dict()
+        response_format = get_response_format(transform_args.pop('format', None))
+        if response_format is None:
+            return unavailable_format_response()
+        def heavy_lifting():
+            return route_transform(function, args, kwargs, response_format=response_format, **transform_args)
+        params = dict(kwargs, format=response_format, **transform_args)
+        body = metric_cache.get_or_create(function.__name__, params, heavy_lifting)
+        return create_metric_response(body, response_format)
+    cache_generated_function.__name__ = function.__name__
+    cache_generated_function.endpoint_class = "metric"
+    return cache_generated_function
+
+def get_collection_validator(params: dict) -> Optional[dict]:
+    """Get when the repos of a request were last collected or the materialized views and facade caches were refreshed, 
+    which changes whenever their data does.
+
+    Args:
+        params: the url parameters of the request. The repos are the repo of the repo_id, 
+            the repos of the repo_group_id or all repos if neither is set
+
+    Returns:
+        dict with the collection state of the repos and when they were last collected, 
+        or None if they have not been collected
+    """
+    last_collected = "GREATEST(core_data_last_collected, secondary_data_last_collected, facade_data_last_collected, ml_data_last_collected)"
+
+    try:
+        if params.get("repo_id") is not None:
+            scope_id = int(params["repo_id"])
+            validator_sql = s.sql.text(f"""
+                SELECT {last_collected} AS last_collected, 1 AS repo_count, 0 AS repo_group_count
+                FROM collection_status
+                WHERE repo_id = :scope_id
+            """).bindparams(scope_id=scope_id)
+
+        elif params.get("repo_group_id") is not None:
+            scope_id = int(params["repo_group_id"])
+            validator_sql = s.sql.text(f"""
+                SELECT MAX({last_collected}) AS last_collected, COUNT(*) AS repo_count, 1 AS repo_group_count
+                FROM collection_status JOIN repo ON repo.repo_id = collection_status.repo_id
+                WHERE repo.repo_group_id = :scope_id
+            """).bindparams(scope_id=scope_id)
+
+        else:
+            validator_sql = s.sql.text(f"""
+                SELECT MAX({last_collected}) AS last_collected,
+                    (SELECT COUNT(*) FROM repo) AS repo_count,
+                    (SELECT COUNT(*) FROM repo_groups) AS repo_group_count
+                FROM collection_status
+            """)
+    except ValueError:
+        return None
+
+    with engine.connect() as conn:
+        result = conn.execute(validator_sql).mappings().first()
+
+    # data is still being added to repos that were never collected, so they are always sent in full
+    if not result or result["last_collected"] is None:
+        return None
+
+    # collection_status times are the local time of the collection workers
+    last_modified = result["last_collected"].astimezone(datetime.timezone.utc).replace(microsecond=0)
+
+    # endpoints like /repos read the materialized views and facade caches, which change when they are refreshed and not when a repo is collected
+    refresh_generation, refreshed_at = metric_cache.get_refresh_state()
+    if refreshed_at is not None:
+        last_modified = max(last_modified, datetime.datetime.fromtimestamp(refreshed_at, datetime.timezone.utc))
+
+    return {
+        "state": f"{last_modified.isoformat()}|{result['repo_count']}|{result['repo_group_count']}|{refresh_generation}",
+        "last_modified": last_modified.isoformat(),
+    }
+
+
+def conditional_on_collection(view_function: Any) -> Any:
+    """Make an endpoint answer with 304 Not Modified when its repos were not collected since the client got the response.
+
+    Note:
+        The ETag is derived from the last collected times in collection_status, the refresh generation of the metric cache, 
+        and the request's url and accepted formats.
+        The validators are cached in redis, so a 304 is answered without running any sql
+    """
+    @wraps(view_function)
+    def conditional_view_function(*args, **kwargs):
+
+        try:
+            validator = metric_cache.get_or_create_validator(kwargs, lambda: get_collection_validator(kwargs))
+        except Exception as e:
+            logger.error(f"Could not get the collection validator of {request.path}. Error: {e}")
+            validator = None
+
+        if validator is None:
+            return view_function(*args, **kwargs)
+
+        representation = "|".join([validator["state"], request.full_path,
+                                   request.headers.get("Accept", ""), request.headers.get("Accept-Encoding", "")])
+        etag = hashlib.sha1(representation.encode()).hexdigest()
+        last_modified = datetime.datetime.fromisoformat(validator["last_modified"])
+
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = Response(status=304)
+        else:
+            response = make_response(view_function(*args, **kwargs))
+
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # clients keep the response, but check that it is still current before they use it
+        response.cache_control.no_cache = True
+
+        return response
+
+    return conditional_view_function
+
 
 def routify(func: Any, endpoint_type: str) -> Any:
     """Wraps a metric function allowing it to be mapped to a route,
@@ -234,6 +340,18 @@ def routify(func: Any, endpoint_type: str) -> Any:
         # sets the kwargs as the query paramaters or the arguments sent in the headers 
         kwargs.update(request.args.to_dict()) 
 
+        # the format and orient of the response are not arguments of the metric
+        response_format = get_response_format(kwargs.pop('format', None))
+        orient = kwargs.pop('orient', None) or 'records'
+
+        if response_format is None:
+            return unavailable_format_response()
+
+        if orient not in JSON_ORIENTS:
+            return Response(response=json.dumps({"error": f"orient must be one of {', '.join(JSON_ORIENTS)}"}),
+                            status=400,
+                            mimetype="application/json")
+
         # if repo_group_id is not specified, it sets it to 1 which is the default repo group
         if 'repo_group_id' not in kwargs and func.metadata["type"] != "toss":
             kwargs['repo_group_id'] = 1
@@ -242,19 +360,23 @@ def routify(func: Any, endpoint_type: str) -> Any:
         # this function call takes the arguments specified when the endpoint is pinged
         # and calls the actual function in the metrics folder and then returns the result
         # NOTE: This also converts the data into json if the function returns a pandas dataframe or dict
-        data =  route_transform(func, args, kwargs)
+        def heavy_lifting():
+            return route_transform(func, args, kwargs, orient=orient, response_format=response_format)
+
+        # identical requests are answered from the metric cache until the repo is collected again or the ttl expires
+        cache_params = dict(kwargs, format=response_format, orient=orient)
+        data = metric_cache.get_or_create(func.metadata['endpoint'], cache_params, heavy_lifting, ttl=func.metadata.get('cache_ttl'))
 
 
         # this is where the Response is created for all the metrics 
-        return Response(response=data,
-                        status=200,
-                        mimetype="application/json")
+        return create_metric_response(data, response_format)
 
     # this sets the name of the endpoint function
     # so that the repo_endpoint, repo_group_endpoint, and deprecated_repo_endpoint
     # don't create endpoint funcitons with the same name
     endpoint_function.__name__ = f"{endpoint_type}_" + func.__name__
-    return endpoint_function
+    endpoint_function.endpoint_class = "metric"
+    return conditional_on_collection(endpoint_function)
 
     
 def add_standard_metric(function: Any, endpoint: str) -> None:
@@ -291,47 +413,112 @@ def add_toss_metric(function: Any, endpoint: str) -> None:
     repo_endpoint = f'/{app.augur_api_version}/repos/<repo_id>/{endpoint}'
     app.route(repo_endpoint)(routify(function, 'repo'))
 
-def create_cache_manager() -> CacheManager:
-    """Create cache for endpoints?
-    
+def get_server_setting(config, setting_name: str) -> Any:
+    """Get a setting of the Server section, or its default if the config is from before the setting was added."""
+
+    value = config.get_value("Server", setting_name)
+    if value is None:
+        return default_config["Server"][setting_name]
+
+    return value
+
+
+def get_endpoint_class() -> str:
+    """Get the class of the endpoint that is handling the current request.
+
     Returns:
-        manager of the cache
+        "metric", "graphql" or "default" when there is no request or the endpoint is not classified
     """
+    if not has_request_context():
+        return "default"
 
-    cache_config = {
-    'cache.type': 'file',
-    'cache.data_dir': 'runtime/cache/',
-    'cache.lock_dir': 'runtime/cache/'
-}
+    view_function = app.view_functions.get(request.endpoint)
 
-    if not os.path.exists(cache_config['cache.data_dir']):
-        os.makedirs(cache_config['cache.data_dir'])
-    if not os.path.exists(cache_config['cache.lock_dir']):
-        os.makedirs(cache_config['cache.lock_dir'])
-    cache_parsed = parse_cache_config_options(cache_config)
-    cache = CacheManager(**cache_parsed)
+    return getattr(view_function, "endpoint_class", "default")
 
-    return cache
 
-def get_server_cache(config, cache_manager) -> Cache:
-    """Create the server cache, set expiration, and clear
-    
+def create_api_engine(url: str):
+    """Create the engine of the api, which has a connection pool for each gunicorn worker process.
+
+    Note:
+        The statement timeout of a connection is set to the timeout of the endpoint class
+        when it is checked out, and only when it changed since the connection was last used
+
     Returns:
-        server cache
+        sqlalchemy database engine
     """
+    # the pool and timeout settings are in the database, so they are read before the pool is created
+    config_engine = create_database_engine(url, poolclass=NullPool)
+    with DatabaseSession(logger, config_engine) as session:
+
+        config = AugurConfig(logger, session)
+
+        pool_size = int(get_server_setting(config, "connection_pool_size"))
+        max_overflow = int(get_server_setting(config, "connection_pool_max_overflow"))
+        pool_timeout = int(get_server_setting(config, "connection_pool_timeout"))
+
+        # timeouts are in seconds, and 0 means no timeout
+        statement_timeouts = {
+            "default": int(get_server_setting(config, "statement_timeout")),
+            "metric": int(get_server_setting(config, "metric_statement_timeout")),
+            "graphql": int(get_server_setting(config, "graphql_statement_timeout")),
+        }
+
+    config_engine.dispose()
 
-    expire = int(config.get_value('Server', 'cache_expire'))
-    server_cache = cache_manager.get_cache('server', expire=expire)
-    server_cache.clear()
+    logger.info(f"Creating api connection pool with {pool_size} connections and {max_overflow} overflow connections")
 
-    return server_cache
+    api_engine = create_database_engine(url, poolclass=CheckoutTimedQueuePool, pool_size=pool_size,
+                                        max_overflow=max_overflow, pool_timeout=pool_timeout, pool_pre_ping=True)
+
+    @event.listens_for(api_engine, "checkout")
+    def set_statement_timeout(dbapi_connection, connection_record, connection_proxy):
+
+        statement_timeout = statement_timeouts.get(get_endpoint_class(), statement_timeouts["default"])
+
+        if connection_record.info.get("statement_timeout") == statement_timeout:
+            return
+
+        # autocommit makes the setting last for the session instead of being rolled back with the transaction
+        existing_autocommit = dbapi_connection.autocommit
+        dbapi_connection.autocommit = True
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"SET SESSION statement_timeout = {statement_timeout * 1000}")
+        cursor.close()
+        dbapi_connection.autocommit = existing_autocommit
+
+        connection_record.info["statement_timeout"] = statement_timeout
+
+    return api_engine
+
+
+class RequestScopedSession():
+    """Database session that gives each request its own DatabaseSession.
+
+    Note:
+        Attributes are looked up on the DatabaseSession of the current thread, so it is used like a DatabaseSession.
+        The session is removed when the request ends, which returns its connection to the pool
+    """
+
+    def __init__(self, logger, engine):
+
+        self.registry = scoped_session(lambda: DatabaseSession(logger, engine))
+
+    def __getattr__(self, name):
+
+        return getattr(self.registry(), name)
+
+    def remove(self) -> None:
+
+        self.registry.remove()
 
 
 logger = AugurLogger("server").get_logger()
 url = get_database_string()
-engine = create_database_engine(url, poolclass=StaticPool)
-db_session = DatabaseSession(logger, engine)
+engine = create_api_engine(url)
+db_session = RequestScopedSession(logger, engine)
 augur_config = AugurConfig(logger, db_session)
+metric_cache = MetricCache(redis_connection, default_ttl=int(get_server_setting(augur_config, "cache_expire")))
 
 
 def get_connection(table, cursor_field_name, connection_class, after, limit, extra_condition=False):
@@ -706,6 +893,22 @@ def status():
                     status=200,
                     mimetype="application/json")
 
+@app.route(f'/{app.augur_api_version}/status/database')
+def database_status():
+    """
+    Connection pool usage and checkout wait times of this server process
+    """
+    return Response(response=json.dumps(engine.pool.checkout_stats()),
+                    status=200,
+                    mimetype="application/json")
+
+@app.teardown_appcontext
+def remove_request_session(exception=None):
+    """
+    Returns the connection of the request's database session to the pool
+    """
+    db_session.remove()
+
 schema = graphene.Schema(query=Query)
 
 class AuthenticatedGraphQLView(GraphQLView):
@@ -723,7 +926,9 @@ class AuthenticatedGraphQLView(GraphQLView):
 
 schema = graphene.Schema(query=Query)
 
-app.add_url_rule(f'/{app.augur_api_version}/graphql', view_func=AuthenticatedGraphQLView.as_view('graphql', schema=schema, graphiql=True))
+graphql_view = AuthenticatedGraphQLView.as_view('graphql', schema=schema, graphiql=True)
+graphql_view.endpoint_class = "graphql"
+app.add_url_rule(f'/{app.augur_api_version}/graphql', view_func=graphql_view)
 
 from .routes import *
 
@@ -732,8 +937,5 @@ from .view.augur_view import *
 from .view.routes import *
 from .view.api import *
 
-cache_manager = create_cache_manager()
-server_cache = get_server_cache(augur_config, cache_manager)
-
 
 
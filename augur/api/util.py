@@ -59,6 +59,9 @@ metric_metadata = []
 def register_metric(metadata=None, **kwargs):
     """
     Register a function as being a metric
+
+    A cache_ttl keyword sets the seconds the metric's responses are cached for,
+    instead of the cache_expire setting of the server
     """
     if metadata is None:
         metadata = {}
@@ -350,7 +350,8 @@ def repo_reset(augur_app):
     """
     augur_app.database.execute(s.sql.text("""
         UPDATE augur_operations.collection_status 
-        SET core_status='Pending',core_task_id = NULL, core_data_last_collected = NULL;
+        SET core_status='Pending',core_task_id = NULL, core_data_last_collected = NULL,
+        issue_last_collected = NULL, pr_last_collected = NULL, message_last_collected = NULL, event_last_collected = NULL;
 
         UPDATE augur_operations.collection_status 
         SET secondary_status='Pending',secondary_task_id = NULL, secondary_data_last_collected = NULL;
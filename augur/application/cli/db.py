@@ -460,6 +460,34 @@ def check_pgpass_credentials(config):
             print("Credentials found in $HOME/.pgpass")
 
 
+@cli.command("reset-incremental-collection")
+@click.option("--repo-git", default=None, help="Only reset this repo. All repos are reset if it is not passed")
+@test_db_connection
+def reset_incremental_collection(repo_git):
+    """Force the next core collection to re-download the full history of issues, prs, messages and events"""
+    from augur.application.db.models import CollectionStatus
+
+    with DatabaseSession(logger) as session:
+
+        update_query = (
+            update(CollectionStatus)
+            .values(issue_last_collected=None, pr_last_collected=None, message_last_collected=None, event_last_collected=None)
+        )
+
+        if repo_git:
+            repo = Repo.get_by_repo_git(session, repo_git)
+            if not repo:
+                print(f"Could not find repo with git url: {repo_git}")
+                return
+
+            update_query = update_query.where(CollectionStatus.repo_id == repo.repo_id)
+
+        result = session.execute(update_query)
+        session.commit()
+
+    print(f"Reset incremental collection for {result.rowcount} repos")
+
+
 #NOTE: For some reason when I try to add function decorators to this function 
 #click thinks it's an argument and tries to parse it but it errors since a function 
 #isn't an iterable. 
@@ -0,0 +1,32 @@
+#SPDX-License-Identifier: MIT
+"""
+Augur library commands for facade
+"""
+import click
+import logging
+
+from augur.application.cli import test_connection, test_db_connection
+
+logger = logging.getLogger(__name__)
+
+@click.group('facade', short_help='Commands for managing facade data')
+def cli():
+    pass
+
+@cli.command("rebuild-caches")
+@test_connection
+@test_db_connection
+def rebuild_caches():
+    """Rebuild the dm_repo_* and dm_repo_group_* caches and the unknown affiliation cache of every repo group from the commits table.
+
+    Facade refreshes the caches of analyzed repos incrementally, so this is only needed when they are out of sync.
+    """
+    from augur.tasks.git.util.facade_worker.facade_worker.config import FacadeSession
+    from augur.tasks.git.util.facade_worker.facade_worker.rebuildcache import invalidate_caches, rebuild_unknown_affiliation_and_web_caches
+
+    with FacadeSession(logger) as session:
+
+        invalidate_caches(session)
+        rebuild_unknown_affiliation_and_web_caches(session)
+
+    logger.info("Rebuilt facade caches")
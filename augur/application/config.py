@@ -40,6 +40,7 @@ default_config = {
             #TODO: a lot of these are deprecated.
             "Facade": {
                 "check_updates": 1,
+                "clone_concurrency": 4,
                 "create_xlsx_summary_files": 1,
                 "delete_marked_repos": 0,
                 "fix_affiliations": 1,
@@ -47,6 +48,7 @@ default_config = {
                 "limited_run": 0,
                 "multithreaded": 1,
                 "nuke_stored_affiliations": 0,
+                "partial_clone": 0,
                 "pull_repos": 1,
                 "rebuild_caches": 1,
                 "run_analysis": 1,
@@ -60,7 +62,13 @@ default_config = {
                 "timeout": 6000,
                 "ssl": False,
                 "ssl_cert_file": None, 
-                "ssl_key_file": None 
+                "ssl_key_file": None,
+                "connection_pool_size": 5,
+                "connection_pool_max_overflow": 10,
+                "connection_pool_timeout": 30,
+                "statement_timeout": 0,
+                "metric_statement_timeout": 300,
+                "graphql_statement_timeout": 30
             },
             "Logging": {
                 "logs_directory": "",
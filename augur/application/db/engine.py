@@ -6,10 +6,13 @@ import logging
 import inspect
 import re
 import subprocess
+import threading
+import time
 
 from sqlalchemy import create_engine, event
 from sqlalchemy.engine.base import Engine
-from sqlalchemy.pool import NullPool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
 from augur.application.db.util import catch_operational_error
 
 
@@ -114,6 +117,80 @@ def create_database_engine(url, **kwargs):
 
     return engine
 
+class CheckoutTimedQueuePool(QueuePool):
+    """Connection pool that keeps track of how long checkouts wait for a connection.
+
+    Note:
+        A checkout only waits when every connection of the pool and its overflow is in use,
+        so the wait times show whether the pool is too small for the load
+    """
+
+    # checkouts that wait longer than this are logged
+    slow_checkout_seconds = 1.0
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._checkout_timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _do_get(self):
+
+        start = time.monotonic()
+
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self._record_checkout(time.monotonic() - start, timed_out=True)
+            raise
+
+        self._record_checkout(time.monotonic() - start)
+
+        return connection
+
+    def _record_checkout(self, wait: float, timed_out: bool = False) -> None:
+
+        with self._stats_lock:
+            self._checkouts += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+
+            if timed_out:
+                self._checkout_timeouts += 1
+
+        if wait >= self.slow_checkout_seconds:
+            logging.getLogger(__name__).warning(f"Waited {wait:.2f} seconds for a database connection. {self.status()}")
+
+    def checkout_stats(self) -> dict:
+        """Get the checkout wait times and the current usage of the pool.
+
+        Returns:
+            dict of the checkout counts, wait times in seconds and connection counts
+        """
+        with self._stats_lock:
+            checkouts = self._checkouts
+            stats = {
+                "checkouts": checkouts,
+                "checkout_timeouts": self._checkout_timeouts,
+                "total_wait_seconds": round(self._total_wait, 6),
+                "average_wait_seconds": round(self._total_wait / checkouts, 6) if checkouts else 0.0,
+                "max_wait_seconds": round(self._max_wait, 6),
+            }
+
+        stats.update({
+            "pool_size": self.size(),
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": self.overflow(),
+        })
+
+        return stats
+
+
 class DatabaseEngine():
 
     def __init__(self, **kwargs):
@@ -1,5 +1,5 @@
 # encoding: utf-8
-from sqlalchemy import BigInteger, SmallInteger, Column, Index, Integer, String, Table, text, UniqueConstraint, Boolean, ForeignKey, update, CheckConstraint
+from sqlalchemy import BigInteger, SmallInteger, Column, Index, Integer, String, Table, text, UniqueConstraint, Boolean, ForeignKey, update, CheckConstraint, or_
 from sqlalchemy.dialects.postgresql import TIMESTAMP
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 from sqlalchemy.exc import IntegrityError
@@ -1205,10 +1205,18 @@ class CollectionStatus(Base):
     secondary_task_id = Column(String)
     event_last_collected = Column(TIMESTAMP)
 
+    # high water marks of the incremental github collection. When they are NULL the full history is collected
+    issue_last_collected = Column(TIMESTAMP)
+    pr_last_collected = Column(TIMESTAMP)
+    message_last_collected = Column(TIMESTAMP)
+
     facade_status = Column(String,nullable=False, server_default=text("'Pending'"))
     facade_data_last_collected = Column(TIMESTAMP)
     facade_task_id = Column(String)
 
+    # HEAD of the repo the last time facade analyzed it. When it is NULL the full history is analyzed
+    facade_last_analyzed_sha = Column(String)
+
     ml_status = Column(String,nullable=False, server_default=text("'Pending'"))
     ml_data_last_collected = Column(TIMESTAMP)
     ml_task_id = Column(String)
@@ -1273,3 +1281,47 @@ class CollectionStatus(Base):
             return False
 
         return True
+
+    @staticmethod
+    def get_last_collected(session, repo_id, column_name):
+        """Get the high water mark of the incremental collection of an entity.
+
+        Args:
+            session: database session
+            repo_id: id of the repo
+            column_name: the *_last_collected column of the entity
+
+        Returns:
+            The datetime collection is known to be complete through, or None if the full history needs to be collected
+        """
+        column = getattr(CollectionStatus, column_name)
+
+        return session.query(column).filter(CollectionStatus.repo_id == repo_id).scalar()
+
+    @staticmethod
+    def update_last_collected(session, repo_id, column_name, last_collected):
+        """Move the high water mark of the incremental collection of an entity forward.
+
+        Note:
+            The mark is never moved backwards so a run that collected nothing new keeps the old one
+
+        Args:
+            session: database session
+            repo_id: id of the repo
+            column_name: the *_last_collected column of the entity
+            last_collected: datetime collection is complete through, the start of the run or the newest created_at of records that never change
+        """
+        if last_collected is None:
+            return
+
+        column = getattr(CollectionStatus, column_name)
+
+        query = (
+            update(CollectionStatus)
+            .where(CollectionStatus.repo_id == repo_id)
+            .where(or_(column == None, column < last_collected))
+            .values({column_name: last_collected})
+        )
+
+        session.execute(query)
+        session.commit()
@@ -1,12 +1,18 @@
 import os
+import io
 import re
 import time
 import sys
+import json
 import random
 import logging
+import datetime
+import threading
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.types import JSON
 
 from typing import Optional, List, Union
 from psycopg2.errors import DeadlockDetected
@@ -47,6 +53,86 @@ def remove_null_characters_from_list_of_dicts(data_list, fields):
 
     return data_list
 
+# number of times an insert is tried before giving up when it keeps deadlocking
+DEADLOCK_RETRY_ATTEMPTS = 10
+
+# the wait before retrying a deadlocked insert doubles every attempt, from the base up to the max
+DEADLOCK_BASE_BACKOFF = 0.25
+DEADLOCK_MAX_BACKOFF = 8
+
+# inserts with at least this many rows are loaded with COPY instead of one multi row INSERT statement
+COPY_INSERT_THRESHOLD = 1000
+
+# max size of the COPY data that is sent in one transaction
+COPY_CHUNK_BYTES = 32 * 1024 * 1024
+
+def escape_copy_text(string):
+
+    return string.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def format_copy_value(value, is_json=False):
+    """Format a value for the text format of postgres COPY.
+
+    Args:
+        value: the value of a column
+        is_json: whether the column is a json column, so the value has to be json encoded
+
+    Returns:
+        The escaped value or \\N for null
+    """
+    if value is None:
+        return "\\N"
+
+    if is_json:
+        return escape_copy_text(json.dumps(value))
+
+    if isinstance(value, bool):
+        return "t" if value else "f"
+
+    if isinstance(value, (dict, list)):
+        return escape_copy_text(json.dumps(value))
+
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+
+    return escape_copy_text(str(value))
+
+def format_copy_row(row, columns, json_columns):
+
+    return "\t".join(format_copy_value(row.get(column), column in json_columns) for column in columns) + "\n"
+
+def sort_by_natural_keys(data, natural_keys):
+
+    if not natural_keys:
+        return data
+
+    # the values are compared as strings so nulls and mixed types can be sorted. 
+    # The order only has to be the same in every worker, it does not have to match postgres
+    return sorted(data, key=lambda row: tuple(str(row.get(key)) for key in natural_keys))
+
+def get_deadlock_backoff(attempt):
+
+    # the jitter stops the workers that deadlocked with each other from retrying at the same time
+    return min(DEADLOCK_MAX_BACKOFF, DEADLOCK_BASE_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1)
+
+_insert_metrics_lock = threading.Lock()
+_insert_metrics = {}
+
+def increment_insert_metric(table_name, metric):
+
+    with _insert_metrics_lock:
+        table_metrics = _insert_metrics.setdefault(table_name, {"deadlocks": 0, "retries": 0, "failures": 0})
+        table_metrics[metric] += 1
+
+def get_insert_metrics():
+    """Get the deadlock counters of the inserts of this process.
+
+    Returns:
+        Dict of table name to the number of deadlocks, retries and inserts that failed after every retry
+    """
+    with _insert_metrics_lock:
+        return {table_name: dict(metrics) for table_name, metrics in _insert_metrics.items()}
+
 class DatabaseSession(Session):
 
     def __init__(self, logger, engine=None, from_msg=None, **kwargs):
@@ -98,7 +184,7 @@ class DatabaseSession(Session):
             result = connection.execute(sql_text)
         return [dict(row) for row in result.mappings()]
 
-    def insert_data(self, data: Union[List[dict], dict], table, natural_keys: List[str], return_columns: Optional[List[str]] = None, string_fields: Optional[List[str]] = None, on_conflict_update:bool = True) -> Optional[List[dict]]:
+    def insert_data(self, data: Union[List[dict], dict], table, natural_keys: List[str], return_columns: Optional[List[str]] = None, string_fields: Optional[List[str]] = None, on_conflict_update:bool = True, use_copy: bool = True, advisory_lock: bool = False) -> Optional[List[dict]]:
 
         if isinstance(data, list) is False:
             
@@ -127,6 +213,14 @@ class DatabaseSession(Session):
         if string_fields and isinstance(string_fields, list):
             data = remove_null_characters_from_list_of_dicts(data, string_fields)
 
+        # rows are upserted in the order of their natural keys, 
+        # so concurrent upserts of the same rows lock them in the same order instead of deadlocking
+        data = sort_by_natural_keys(data, natural_keys)
+
+        # large inserts spend most of their time compiling the statement and binding parameters, so they are copied instead
+        if use_copy and len(data) >= COPY_INSERT_THRESHOLD:
+            return self.copy_insert_data(data, table, natural_keys, return_columns, on_conflict_update, advisory_lock)
+
         # creates list of arguments to tell sqlalchemy what columns to return after the data is inserted
         returning_args = []
         if return_columns:
@@ -163,97 +257,32 @@ class DatabaseSession(Session):
 
 
         # print(str(stmnt.compile(dialect=postgresql.dialect())))
-        attempts = 0
-        # creates list from 1 to 10
-        sleep_time_list = list(range(1,11))
-        deadlock_detected = False
-
-
-        # if there is no data to return then it executes the insert then returns nothing
-        if not return_columns:
-
-            while attempts < 10:
-                try:
-                    #begin keyword is needed for sqlalchemy 2.x
-                    #this is because autocommit support was removed in 2.0
-                    with self.engine.begin() as connection:
-                        connection.execute(stmnt)
-                        break
-                except OperationalError as e:
-                    # print(str(e).split("Process")[1].split(";")[0])
-                    if isinstance(e.orig, DeadlockDetected):
-                        deadlock_detected = True
-                        sleep_time = random.choice(sleep_time_list)
-                        self.logger.debug(f"Deadlock detected on {table.__table__} table...trying again in {round(sleep_time)} seconds: transaction size: {len(data)}")
-                        time.sleep(sleep_time)
-
-                        attempts += 1
-                        continue
-                    
-                    raise e
-
-                except Exception as e:
-                    #self.logger.info(e)
-                    if len(data) == 1:
-                        raise e
-                   
-                    time.sleep(3)
-                    first_half = data[:len(data)//2]
-                    second_half = data[len(data)//2:]
-
-                    self.insert_data(first_half, table, natural_keys, return_columns, string_fields, on_conflict_update)
-                    self.insert_data(second_half,table, natural_keys, return_columns, string_fields, on_conflict_update)
-
-            else:
-                self.logger.error("Unable to insert data in 10 attempts")
-                return None
-
-            if deadlock_detected is True:
-                self.logger.error("Made it through even though Deadlock was detected")
-                    
-            return "success"
-        
+        try:
+            return_data = self._execute_insert(stmnt, table, len(data), bool(return_columns), advisory_lock)
 
-        # othewise it gets the requested return columns and returns them as a list of dicts
-        while attempts < 10:
-            try:
-                with self.engine.begin() as connection:
-                    return_data_tuples = connection.execute(stmnt)
-                    break
-            except OperationalError as e:
-                if isinstance(e.orig, DeadlockDetected):
-                    sleep_time = random.choice(sleep_time_list)
-                    self.logger.debug(f"Deadlock detected on {table.__table__} table...trying again in {round(sleep_time)} seconds: transaction size: {len(data)}")
-                    time.sleep(sleep_time)
+        except Exception as e:
+            # operational errors like a lost connection are not caused by the rows, so bisecting would not help
+            if len(data) == 1 or isinstance(e, OperationalError):
+                raise e
 
-                    attempts += 1
-                    continue   
+            # split the data in halves until the rows that cannot be inserted are isolated
+            first_half = data[:len(data)//2]
+            second_half = data[len(data)//2:]
 
-                raise e
+            first_return_data = self.insert_data(first_half, table, natural_keys, return_columns, string_fields, on_conflict_update, use_copy, advisory_lock)
+            second_return_data = self.insert_data(second_half, table, natural_keys, return_columns, string_fields, on_conflict_update, use_copy, advisory_lock)
 
-            except Exception as e:
-                if len(data) == 1:
-                    raise e
-                
-                time.sleep(3)
-                first_half = data[:len(data)//2]
-                second_half = data[len(data)//2:]
+            if not return_columns:
+                return "success"
 
-                self.insert_data(first_half, table, natural_keys, return_columns, string_fields, on_conflict_update)
-                self.insert_data(second_half, table, natural_keys, return_columns, string_fields, on_conflict_update)
+            return (first_return_data or []) + (second_return_data or [])
 
-        else:
-            self.logger.error("Unable to insert and return data in 10 attempts")
+        if return_data is None:
             return None
 
-        if deadlock_detected is True:
-            self.logger.error("Made it through even though Deadlock was detected")
-
-        return_data = [dict(row) for row in return_data_tuples.mappings()]
-        
-        #no longer working in sqlalchemy 2.x
-        #for data_tuple in return_data_tuples:
-        #    return_data.append(dict(data_tuple))
+        # if there is no data to return then it executes the insert then returns nothing
+        if not return_columns:
+            return "success"
 
         # using on confilict do nothing does not return the 
         # present values so this does gets the return values
@@ -283,3 +312,178 @@ class DatabaseSession(Session):
 
 
         return return_data
+
+
+    def _execute_insert(self, stmnt, table, data_len: int, fetch_return_data: bool, advisory_lock: bool) -> Optional[List[dict]]:
+        """Execute an insert statement, retrying it with a backoff when it deadlocks.
+
+        Args:
+            stmnt: the insert statement
+            table: the table that is inserted into
+            data_len: number of rows that are inserted, for logging
+            fetch_return_data: whether the statement returns rows
+            advisory_lock: whether to hold the advisory lock of the table while inserting
+
+        Returns:
+            The returned rows as dicts (empty if fetch_return_data is False), or None if the insert deadlocked every attempt
+        """
+        table_name = table.__tablename__
+
+        for attempt in range(DEADLOCK_RETRY_ATTEMPTS):
+
+            if attempt > 0:
+                increment_insert_metric(table_name, "retries")
+
+            try:
+                #begin keyword is needed for sqlalchemy 2.x
+                #this is because autocommit support was removed in 2.0
+                with self.engine.begin() as connection:
+
+                    if advisory_lock:
+                        self._lock_table_for_insert(connection, table)
+
+                    result = connection.execute(stmnt)
+
+                    if not fetch_return_data:
+                        return []
+
+                    return [dict(row) for row in result.mappings()]
+
+            except OperationalError as e:
+                if not isinstance(e.orig, DeadlockDetected):
+                    raise e
+
+                increment_insert_metric(table_name, "deadlocks")
+
+                sleep_time = get_deadlock_backoff(attempt)
+                self.logger.debug(f"Deadlock detected on {table.__table__} table...trying again in {round(sleep_time, 2)} seconds: transaction size: {data_len}")
+                time.sleep(sleep_time)
+
+        increment_insert_metric(table_name, "failures")
+        self.logger.error(f"Unable to insert data into the {table.__table__} table in {DEADLOCK_RETRY_ATTEMPTS} attempts. Insert metrics: {get_insert_metrics().get(table_name)}")
+
+        return None
+
+    @staticmethod
+    def _lock_table_for_insert(connection, table) -> None:
+        """Take the transaction level advisory lock of a table, so only one worker writes to it at a time.
+
+        Note:
+            This is off by default, because every write to the table is serialized until the transaction ends. 
+            The rows are already upserted in the order of their natural keys, which is enough to stop most deadlocks
+        """
+        connection.execute(text("SELECT pg_advisory_xact_lock(hashtext(:lock_name))"), {"lock_name": f"augur_insert_{table.__tablename__}"})
+
+    def copy_insert_data(self, data: List[dict], table, natural_keys: List[str], return_columns: Optional[List[str]] = None, on_conflict_update: bool = True, advisory_lock: bool = False) -> Optional[Union[List[dict], str]]:
+        """Upsert a large list of dicts by copying it into a staging table.
+
+        The rows are sent to a temporary table with COPY, then moved into the table with one
+        INSERT ... SELECT ... ON CONFLICT statement per chunk of COPY_CHUNK_BYTES.
+        A chunk that fails is inserted with the INSERT statement of insert_data instead.
+
+        Note:
+            The data is expected to be deduplicated and cleaned by insert_data
+
+        Returns:
+            The return_columns of every row, or "success" if no return_columns were given
+        """
+        columns = list(data[0].keys())
+        json_columns = {column.name for column in table.__table__.columns if isinstance(column.type, JSON)}
+
+        return_data = []
+
+        chunk = []
+        chunk_lines = []
+        chunk_size = 0
+        for row in data:
+
+            line = format_copy_row(row, columns, json_columns)
+
+            chunk.append(row)
+            chunk_lines.append(line)
+            chunk_size += len(line)
+
+            if chunk_size >= COPY_CHUNK_BYTES:
+                return_data += self._copy_insert_chunk(chunk, "".join(chunk_lines), columns, table, natural_keys, return_columns, on_conflict_update, advisory_lock)
+                chunk = []
+                chunk_lines = []
+                chunk_size = 0
+
+        if chunk:
+            return_data += self._copy_insert_chunk(chunk, "".join(chunk_lines), columns, table, natural_keys, return_columns, on_conflict_update, advisory_lock)
+
+        if not return_columns:
+            return "success"
+
+        return return_data
+
+    def _copy_insert_chunk(self, chunk: List[dict], copy_data: str, columns: List[str], table, natural_keys: List[str], return_columns: Optional[List[str]], on_conflict_update: bool, advisory_lock: bool) -> List[dict]:
+
+        preparer = self.engine.dialect.identifier_preparer
+
+        target_table = preparer.format_table(table.__table__)
+        staging_table = preparer.quote(f"copy_staging_{table.__tablename__}")
+        column_list = ", ".join(preparer.quote(column) for column in columns)
+        natural_key_list = ", ".join(preparer.quote(key) for key in natural_keys)
+
+        # only the copied columns are created, so the defaults of the table (like sequences) are not used by the staging table
+        create_staging_sql = f"CREATE TEMP TABLE {staging_table} ON COMMIT DROP AS SELECT {column_list} FROM {target_table} WITH NO DATA"
+        copy_sql = f"COPY {staging_table} ({column_list}) FROM STDIN"
+
+        # the rows are inserted in the order of their natural keys, so concurrent upserts lock them in the same order
+        insert_sql = f"INSERT INTO {target_table} ({column_list}) SELECT {column_list} FROM {staging_table} ORDER BY {natural_key_list} ON CONFLICT ({natural_key_list})"
+        if on_conflict_update:
+            update_list = ", ".join(f"{preparer.quote(column)} = EXCLUDED.{preparer.quote(column)}" for column in columns)
+            insert_sql += f" DO UPDATE SET {update_list}"
+        else:
+            insert_sql += " DO NOTHING"
+
+        select_sql = None
+        if return_columns:
+            return_column_list = ", ".join(preparer.quote(column) for column in return_columns)
+
+            if on_conflict_update:
+                insert_sql += f" RETURNING {return_column_list}"
+            else:
+                # rows that were already present are not returned by DO NOTHING, so they are selected by joining on the natural keys
+                target_return_column_list = ", ".join(f"target.{preparer.quote(column)}" for column in return_columns)
+                join_conditions = " AND ".join(f"target.{preparer.quote(key)} = staging.{preparer.quote(key)}" for key in natural_keys)
+                select_sql = f"SELECT {target_return_column_list} FROM {target_table} AS target JOIN {staging_table} AS staging ON {join_conditions}"
+
+        # the return columns are typed so they are converted like they are by insert_data (uuids for example)
+        typed_return_columns = [getattr(table, column) for column in return_columns] if return_columns else []
+
+        try:
+            with self.engine.begin() as connection:
+
+                if advisory_lock:
+                    self._lock_table_for_insert(connection, table)
+
+                cursor = connection.connection.cursor()
+                cursor.execute(create_staging_sql)
+                cursor.copy_expert(copy_sql, io.StringIO(copy_data))
+
+                if select_sql:
+                    connection.execute(text(insert_sql))
+                    result = connection.execute(text(select_sql).columns(*typed_return_columns))
+                elif return_columns:
+                    result = connection.execute(text(insert_sql).columns(*typed_return_columns))
+                else:
+                    connection.execute(text(insert_sql))
+                    return []
+
+                return [dict(row) for row in result.mappings()]
+
+        except Exception as e:
+            # the copy is done on the psycopg2 cursor, so its errors are not wrapped by sqlalchemy
+            if isinstance(e, DeadlockDetected) or (isinstance(e, OperationalError) and isinstance(e.orig, DeadlockDetected)):
+                increment_insert_metric(table.__tablename__, "deadlocks")
+
+            self.logger.warning(f"Unable to copy {len(chunk)} rows into the {table.__tablename__} table. Inserting them without COPY. Error: {e}")
+
+        return_data = self.insert_data(chunk, table, natural_keys, return_columns, on_conflict_update=on_conflict_update, use_copy=False, advisory_lock=advisory_lock)
+
+        if not return_columns or return_data is None:
+            return []
+
+        return return_data
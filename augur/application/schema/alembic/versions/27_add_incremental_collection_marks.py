@@ -0,0 +1,30 @@
+"""Add per entity high water marks to collection status for incremental collection
+
+Revision ID: 27
+Revises: 26
+Create Date: 2026-10-18 10:12:41.204311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '27'
+down_revision = '26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # event_last_collected already exists on the table
+    op.add_column('collection_status', sa.Column('issue_last_collected', postgresql.TIMESTAMP()), schema='augur_operations')
+    op.add_column('collection_status', sa.Column('pr_last_collected', postgresql.TIMESTAMP()), schema='augur_operations')
+    op.add_column('collection_status', sa.Column('message_last_collected', postgresql.TIMESTAMP()), schema='augur_operations')
+
+
+def downgrade():
+    op.drop_column('collection_status', 'issue_last_collected', schema='augur_operations')
+    op.drop_column('collection_status', 'pr_last_collected', schema='augur_operations')
+    op.drop_column('collection_status', 'message_last_collected', schema='augur_operations')
@@ -0,0 +1,24 @@
+"""Add the last analyzed HEAD of each repo to collection status for incremental facade analysis
+
+Revision ID: 28
+Revises: 27
+Create Date: 2026-10-18 14:36:08.517920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '28'
+down_revision = '27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('collection_status', sa.Column('facade_last_analyzed_sha', sa.String()), schema='augur_operations')
+
+
+def downgrade():
+    op.drop_column('collection_status', 'facade_last_analyzed_sha', schema='augur_operations')
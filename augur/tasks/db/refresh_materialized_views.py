@@ -7,6 +7,7 @@ from celery import group, chain, chord, signature
 from augur.tasks.init.celery_app import celery_app as celery
 from augur.application.db.session import DatabaseSession
 from augur.application.logs import AugurLogger
+from augur.tasks.util.metric_cache import invalidate_all_metric_cache
 
 
 @celery.task
@@ -180,7 +181,5 @@ def refresh_materialized_views():
         logger.info(f"error is {e}")
         pass 
 
-
-
-
-
+    # the cached metric responses are read from these views, so they are stale once the views are refreshed
+    invalidate_all_metric_cache()
@@ -15,6 +15,7 @@ import getopt
 import xlsxwriter
 import configparser
 import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from celery import group, chain, chord, signature
 from celery.utils.log import get_task_logger
@@ -25,9 +26,10 @@ import sqlalchemy as s
 
 from sqlalchemy import or_, and_, update, insert
 
-from augur.tasks.git.util.facade_worker.facade_worker.utilitymethods import update_repo_log, trim_commits, store_working_author, trim_author
-from augur.tasks.git.util.facade_worker.facade_worker.utilitymethods import get_absolute_repo_path, get_parent_commits_set, get_existing_commits_set
-from augur.tasks.git.util.facade_worker.facade_worker.analyzecommit import analyze_commit
+from augur.tasks.git.util.facade_worker.facade_worker.utilitymethods import update_repo_log, trim_commits, store_working_author, trim_author, store_working_commits, remove_working_commits
+from augur.tasks.git.util.facade_worker.facade_worker.utilitymethods import get_absolute_repo_path, get_parent_commits_set, get_existing_commits_set, get_missing_commits_set
+from augur.tasks.git.util.facade_worker.facade_worker.utilitymethods import get_head_commit, is_ancestor_commit, get_last_analyzed_commit, update_last_analyzed_commit
+from augur.tasks.git.util.facade_worker.facade_worker.analyzecommit import analyze_commits
 from augur.tasks.git.util.facade_worker.facade_worker.utilitymethods import get_facade_weight_time_factor, get_repo_commit_count, update_facade_scheduling_fields, get_facade_weight_with_commit_count, facade_bulk_insert_commits
 
 from augur.tasks.github.facade_github.tasks import *
@@ -55,6 +57,9 @@ from augur.tasks.github.util.github_task_session import *
 
 from augur.application.logs import TaskLogConfig
 
+# min number of missing commits each shard of a repo's analysis gets, so small repos are analyzed by one task
+FACADE_MIN_COMMITS_PER_SHARD = 5000
+
 #define an error callback for chains in facade collection so facade doesn't make the program crash
 #if it does.
 @celery.task
@@ -163,38 +168,52 @@ def trim_commits_post_analysis_facade_task(repo_git):
         #Get the huge list of commits to process.
         absoulte_path = get_absolute_repo_path(session.repo_base_directory, repo.repo_id, repo.repo_path,repo.repo_name)
         repo_loc = (f"{absoulte_path}/.git")
-        # Grab the parents of HEAD
+        head_commit = get_head_commit(repo_loc)
+        last_analyzed_commit = get_last_analyzed_commit(session, repo_id)
 
-        parent_commits = get_parent_commits_set(repo_loc, start_date)
+        if head_commit and last_analyzed_commit and is_ancestor_commit(repo_loc, last_analyzed_commit, head_commit):
 
-        # Grab the existing commits from the database
-        existing_commits = get_existing_commits_set(session, repo_id)
+            # HEAD only moved forward since the last analysis, so none of the
+            # analyzed commits left the history and there is nothing to trim
+            session.log_activity('Debug',f"Repo {repo_id} has no commits to trim since {last_analyzed_commit}")
 
-        # Find missing commits and add them
+        else:
+            # Grab the parents of HEAD
 
-        missing_commits = parent_commits - existing_commits
+            parent_commits = get_parent_commits_set(repo_loc, start_date)
 
-        session.log_activity('Debug',f"Commits missing from repo {repo_id}: {len(missing_commits)}")
-        
-        # Find commits which are out of the analysis range
+            # Grab the existing commits from the database
+            existing_commits = get_existing_commits_set(session, repo_id)
 
-        trimmed_commits = existing_commits - parent_commits
+            # Find missing commits and add them
 
-        update_analysis_log(repo_id,'Data collection complete')
+            missing_commits = parent_commits - existing_commits
 
-        update_analysis_log(repo_id,'Beginning to trim commits')
+            session.log_activity('Debug',f"Commits missing from repo {repo_id}: {len(missing_commits)}")
+            
+            # Find commits which are out of the analysis range
 
-        session.log_activity('Debug',f"Commits to be trimmed from repo {repo_id}: {len(trimmed_commits)}")
+            trimmed_commits = existing_commits - parent_commits
 
+            update_analysis_log(repo_id,'Data collection complete')
 
+            update_analysis_log(repo_id,'Beginning to trim commits')
+
+            session.log_activity('Debug',f"Commits to be trimmed from repo {repo_id}: {len(trimmed_commits)}")
 
-        #for commit in trimmed_commits:
-        trim_commits(session,repo_id,trimmed_commits)
-        
 
-        update_analysis_log(repo_id,'Commit trimming complete')
+
+            #for commit in trimmed_commits:
+            trim_commits(session,repo_id,trimmed_commits)
+            
+
+            update_analysis_log(repo_id,'Commit trimming complete')
 
         update_analysis_log(repo_id,'Complete')
+
+        # The next analysis only has to look at the commits after this one
+        if head_commit:
+            update_last_analyzed_commit(session, repo_id, head_commit)
     
 
 
@@ -216,10 +235,75 @@ def facade_start_contrib_analysis_task():
         session.log_activity('Info', 'Updating Contributors with commits')
 
 
+def insert_commit_batch(session, repo_id, commits, commit_records):
+    """Insert the records of a batch of analyzed commits.
+
+    The commits are stashed in working_commits until their records are inserted, so
+    an interrupted insert is trimmed by trim_commits_facade_task. The batches that were
+    inserted are in the commits table, so the next analysis only redoes the interrupted batch.
+    """
+
+    if not commits:
+        return
+
+    store_working_commits(session, repo_id, commits)
+
+    if commit_records:
+        facade_bulk_insert_commits(session, commit_records)
+
+    remove_working_commits(session, repo_id, commits)
+
+
+def analyze_commit_queue(session, repo_id, repo_loc, queue):
+    """Analyze a list of commits and insert their records in batches of about 1000 records.
+
+    Raises an error when git log does not return every commit in the queue, so the facade chain
+    stops before trim_commits_post_analysis_facade_task stores HEAD as the last analyzed commit.
+    """
+
+    logger = session.logger
+
+    pendingCommitRecordsToInsert = []
+    pendingCommits = []
+    analyzedCommits = set()
+
+    quarterQueue = int(len(queue) / 4)
+
+    if quarterQueue == 0:
+        quarterQueue = 1 # prevent division by zero with integer math
+
+    #The whole queue is analyzed by a single git log that is parsed as it is read
+    for count, (commit, commitRecords) in enumerate(analyze_commits(session, repo_id, repo_loc, queue)):
+
+        #Log progress when another quarter of the queue has been processed
+        if (count + 1) % quarterQueue == 0:
+            logger.info(f"Progress through current analysis queue is {(count / len(queue)) * 100}%")
+
+        #logger.debug(commitRecord)
+        pendingCommits.append(commit)
+        pendingCommitRecordsToInsert.extend(commitRecords)
+        analyzedCommits.add(commit)
+
+        if len(pendingCommitRecordsToInsert) >= 1000:
+            insert_commit_batch(session, repo_id, pendingCommits, pendingCommitRecordsToInsert)
+            pendingCommits = []
+            pendingCommitRecordsToInsert = []
+
+    insert_commit_batch(session, repo_id, pendingCommits, pendingCommitRecordsToInsert)
+
+    missingCommits = set(queue) - analyzedCommits
+    if missingCommits:
+        raise RuntimeError(f"git log did not return {len(missingCommits)} of the {len(queue)} queued commits of repo {repo_id}")
+
+
 #enable celery multithreading
-@celery.task(base=AugurFacadeRepoCollectionTask)
-def analyze_commits_in_parallel(repo_git, multithreaded: bool)-> None:
+@celery.task(base=AugurFacadeRepoCollectionTask, bind=True)
+def analyze_commits_in_parallel(self, repo_git, multithreaded: bool)-> None:
     """Take a large list of commit data to analyze and store in the database. Meant to be run in parallel with other instances of this task.
+
+    When multithreaded is set and the repo has a large amount of missing commits, they are split into shards
+    by hash and this task is replaced by a group of analyze_commit_shard_facade_task. The rest of the
+    facade chain, starting with trim_commits_post_analysis_facade_task, runs once every shard is done.
     """
 
     #create new session for celery thread.
@@ -239,15 +323,19 @@ def analyze_commits_in_parallel(repo_git, multithreaded: bool)-> None:
         #Get the huge list of commits to process.
         absoulte_path = get_absolute_repo_path(session.repo_base_directory, repo.repo_id, repo.repo_path, repo.repo_name)
         repo_loc = (f"{absoulte_path}/.git")
-        # Grab the parents of HEAD
+        head_commit = get_head_commit(repo_loc)
+        last_analyzed_commit = get_last_analyzed_commit(session, repo_id)
 
-        parent_commits = get_parent_commits_set(repo_loc, start_date)
+        if head_commit and head_commit == last_analyzed_commit:
+            logger.info(f"Repo {repo_id} has not changed since it was last analyzed")
+            return
 
-        # Grab the existing commits from the database
-        existing_commits = get_existing_commits_set(session, repo_id)
+        # Only the commits after the last analyzed HEAD can be missing if HEAD only moved forward from it
+        since_commit = None
+        if head_commit and last_analyzed_commit and is_ancestor_commit(repo_loc, last_analyzed_commit, head_commit):
+            since_commit = last_analyzed_commit
 
-        # Find missing commits and add them
-        missing_commits = parent_commits - existing_commits
+        missing_commits = get_missing_commits_set(session, repo_id, repo_loc, start_date, since_commit)
 
         session.log_activity('Debug',f"Commits missing from repo {repo_id}: {len(missing_commits)}")
 
@@ -258,46 +346,50 @@ def analyze_commits_in_parallel(repo_git, multithreaded: bool)-> None:
         
         queue = list(missing_commits)
 
+        shard_count = min(multiprocessing.cpu_count(), len(queue) // FACADE_MIN_COMMITS_PER_SHARD)
+
+        if multithreaded and shard_count > 1:
+
+            logger.info(f"Splitting the {len(queue)} missing commits of repo {repo_id} into {shard_count} shards")
+
+            # the shards find their own commits, so the hashes are not sent through the broker
+            shard_tasks = group(analyze_commit_shard_facade_task.si(repo_git, since_commit, shard, shard_count) for shard in range(shard_count))
+
+            return self.replace(shard_tasks)
+
         logger.info(f"Got to analysis!")
-        absoulte_path = get_absolute_repo_path(session.repo_base_directory, repo.repo_id, repo.repo_path,repo.repo_name)
-        repo_loc = (f"{absoulte_path}/.git")
 
-        pendingCommitRecordsToInsert = []
+        analyze_commit_queue(session, repo_id, repo_loc, queue)
+    
+    logger.info("Analysis complete")
+    return
+
 
-        for count, commitTuple in enumerate(queue):
-            quarterQueue = int(len(queue) / 4)
+@celery.task(base=AugurFacadeRepoCollectionTask)
+def analyze_commit_shard_facade_task(repo_git, since_commit, shard, shard_count)-> None:
+    """Analyze a shard of the missing commits of a repo, that analyze_commits_in_parallel split up.
 
-            if quarterQueue == 0:
-                quarterQueue = 1 # prevent division by zero with integer math
+    The missing commits are found the same way analyze_commits_in_parallel found them and the ones
+    get_commit_shard gives to this shard are analyzed.
+    """
 
-            #Log progress when another quarter of the queue has been processed
-            if (count + 1) % quarterQueue == 0:
-                logger.info(f"Progress through current analysis queue is {(count / len(queue)) * 100}%")
+    logger = logging.getLogger(analyze_commit_shard_facade_task.__name__)
+    with FacadeSession(logger) as session:
 
+        repo = session.query(Repo).filter(Repo.repo_git == repo_git).one()
 
-            #logger.info(f"Got to analysis!")
-            commitRecords = analyze_commit(session, repo_id, repo_loc, commitTuple)
-            #logger.debug(commitRecord)
-            if len(commitRecords):
-                pendingCommitRecordsToInsert.extend(commitRecords)
-                if len(pendingCommitRecordsToInsert) >= 1000:
-                    facade_bulk_insert_commits(session,pendingCommitRecordsToInsert)
-                    pendingCommitRecordsToInsert = []
+        start_date = session.get_setting('start_date')
 
-        
-        facade_bulk_insert_commits(session,pendingCommitRecordsToInsert)
+        absoulte_path = get_absolute_repo_path(session.repo_base_directory, repo.repo_id, repo.repo_path, repo.repo_name)
+        repo_loc = (f"{absoulte_path}/.git")
 
-        
+        commits = list(get_missing_commits_set(session, repo.repo_id, repo_loc, start_date, since_commit, shard, shard_count))
 
+        logger.info(f"Analyzing shard {shard + 1} of {shard_count} with {len(commits)} commits for repo {repo.repo_id}")
 
-        # Remove the working commit.
-        remove_commit = s.sql.text("""DELETE FROM working_commits 
-        	WHERE repos_id = :repo_id AND working_commit IN :hashes
-        	""").bindparams(repo_id=repo_id,hashes=tuple(queue))
-        session.execute_sql(remove_commit)  
-    
-    logger.info("Analysis complete")
-    return
+        analyze_commit_queue(session, repo.repo_id, repo_loc, commits)
+
+    logger.info("Shard analysis complete")
 
 @celery.task
 def nuke_affiliations_facade_task():
@@ -314,14 +406,6 @@ def fill_empty_affiliations_facade_task():
     with FacadeSession(logger) as session:
         fill_empty_affiliations(session)
 
-@celery.task
-def invalidate_caches_facade_task():
-
-    logger = logging.getLogger(invalidate_caches_facade_task.__name__)
-
-    with FacadeSession(logger) as session:
-        invalidate_caches(session)
-
 @celery.task
 def rebuild_unknown_affiliation_and_web_caches_facade_task():
 
@@ -351,41 +435,70 @@ def clone_repos():
 
         # process up to 1000 repos at a time
         repo_git_identifiers = get_collection_status_repo_git_from_filter(session, is_pending, 999999)
-        for repo_git in repo_git_identifiers:
-            # set repo to intializing
-            repo = session.query(Repo).filter(Repo.repo_git == repo_git).one()
-            repoStatus = repo.collection_status[0]
-            setattr(repoStatus,"facade_status", CollectionState.INITIALIZING.value)
-            session.commit()
 
-            # clone repo
-            try:
-                git_repo_initialize(session, repo_git)
-                session.commit()
-
-                # get the commit count
-                commit_count = get_repo_commit_count(session, repo_git)
-                facade_weight = get_facade_weight_with_commit_count(session, repo_git, commit_count)
-
-                update_facade_scheduling_fields(session, repo_git, facade_weight, commit_count)
-
-                # set repo to update
-                setattr(repoStatus,"facade_status", CollectionState.UPDATE.value)
-                session.commit()
-            except GitCloneError:
-                # continue to next repo, since we can't calculate 
-                # commit_count or weight without the repo cloned
-                setattr(repoStatus,"facade_status", CollectionState.FAILED_CLONE.value)
-                session.commit()
-            except Exception as e:
-                logger.error(f"Ran into unexpected issue when cloning repositories \n Error: {e}")
-                # set repo to error
-                setattr(repoStatus,"facade_status", CollectionState.ERROR.value)
-                session.commit()
+        clone_concurrency = max(1, int(session.clone_concurrency))
+
+        # each clone is mostly waiting on git, so the clones run in threads that have their own session
+        with ThreadPoolExecutor(max_workers=clone_concurrency) as executor:
+            clone_metrics = [metrics for metrics in executor.map(clone_repo, repo_git_identifiers) if metrics]
+
+        if clone_metrics:
+            total_duration = sum(metrics["duration"] for metrics in clone_metrics)
+            total_bytes = sum(metrics["fetched_bytes"] or 0 for metrics in clone_metrics)
+
+            logger.info(f"Cloned {len(clone_metrics)} repos with up to {clone_concurrency} at a time. "
+                        f"Clones took {total_duration:.1f} seconds and fetched {total_bytes} bytes in total")
 
         clone_repos.si().apply_async(countdown=60*5)
 
 
+def clone_repo(repo_git):
+    """Clone a pending repo and set its facade status.
+
+    Returns:
+        the clone duration and fetched bytes if the repo was cloned
+    """
+
+    logger = logging.getLogger(clone_repos.__name__)
+
+    clone_metrics = None
+
+    with FacadeSession(logger) as session:
+
+        # set repo to intializing
+        repo = session.query(Repo).filter(Repo.repo_git == repo_git).one()
+        repoStatus = repo.collection_status[0]
+        setattr(repoStatus,"facade_status", CollectionState.INITIALIZING.value)
+        session.commit()
+
+        # clone repo
+        try:
+            clone_metrics = git_repo_initialize(session, repo_git)
+            session.commit()
+
+            # get the commit count
+            commit_count = get_repo_commit_count(session, repo_git)
+            facade_weight = get_facade_weight_with_commit_count(session, repo_git, commit_count)
+
+            update_facade_scheduling_fields(session, repo_git, facade_weight, commit_count)
+
+            # set repo to update
+            setattr(repoStatus,"facade_status", CollectionState.UPDATE.value)
+            session.commit()
+        except GitCloneError:
+            # continue to next repo, since we can't calculate 
+            # commit_count or weight without the repo cloned
+            setattr(repoStatus,"facade_status", CollectionState.FAILED_CLONE.value)
+            session.commit()
+        except Exception as e:
+            logger.error(f"Ran into unexpected issue when cloning repositories \n Error: {e}")
+            # set repo to error
+            setattr(repoStatus,"facade_status", CollectionState.ERROR.value)
+            session.commit()
+
+    return clone_metrics
+
+
 
 
 #@celery.task
@@ -587,7 +700,9 @@ def generate_non_repo_domain_facade_tasks(logger):
             # This method is also a major performance bottleneck with little value.
 
         if force_invalidate_caches:
-            facade_sequence.append(invalidate_caches_facade_task.si().on_error(facade_error_handler.s()))#invalidate_caches(session.cfg)
+            logger.info("Invalidating caches on every run is deprecated. Run augur facade rebuild-caches for a full rebuild.")
+            # deprecated because the caches of analyzed repos are now refreshed incrementally,
+            # and invalidating them made every run rebuild all of them from the full commits table.
 
         if not limited_run or (limited_run and rebuild_caches):
             facade_sequence.append(rebuild_unknown_affiliation_and_web_caches_facade_task.si().on_error(facade_error_handler.s()))#rebuild_unknown_affiliation_and_web_caches(session.cfg)
@@ -0,0 +1,142 @@
+#SPDX-License-Identifier: MIT
+"""Defines the cache of contributors_aliases that facade uses to find the canonical email of a commit author.
+
+Looking up the alias of the author and committer of every file of every commit
+was two queries per record, so the active aliases are loaded in one query instead.
+The cache is reloaded when contributors_aliases changes.
+"""
+import time
+from collections import OrderedDict
+
+import sqlalchemy as s
+
+# max number of aliases held in memory. If there are more aliases than this,
+# they are looked up one email at a time and the most recent lookups are kept
+ALIAS_CACHE_MAX_SIZE = 500000
+
+# seconds between checks for changes to contributors_aliases
+ALIAS_CACHE_REFRESH_SECONDS = 300
+
+
+class ContributorAliasCache:
+    """Maps alias emails to their canonical email.
+
+    Attributes:
+        session: database session used to load the aliases
+        max_size: max number of emails held in memory
+        refresh_interval: seconds between checks for changes to contributors_aliases
+    """
+
+    def __init__(self, session, max_size: int = ALIAS_CACHE_MAX_SIZE, refresh_interval: float = ALIAS_CACHE_REFRESH_SECONDS):
+
+        self.session = session
+        self.max_size = max_size
+        self.refresh_interval = refresh_interval
+
+        self.aliases = OrderedDict()
+        self.fully_loaded = False
+        self.signature = None
+        self.last_checked = None
+
+    def get_canonical_email(self, email: str) -> str:
+        """Get the canonical email of an email.
+
+        Returns:
+            The canonical email, or the email itself if it is not an active alias
+        """
+        if self.last_checked is None or time.monotonic() - self.last_checked >= self.refresh_interval:
+            self.refresh()
+
+        if email in self.aliases:
+
+            if not self.fully_loaded:
+                self.aliases.move_to_end(email)
+
+            return self.aliases[email]
+
+        if self.fully_loaded:
+            return email
+
+        canonical_email = self._fetch_canonical_email(email)
+
+        self.aliases[email] = canonical_email
+        if len(self.aliases) > self.max_size:
+            self.aliases.popitem(last=False)
+
+        return canonical_email
+
+    def refresh(self) -> None:
+        """Reload the aliases if contributors_aliases changed since they were loaded."""
+
+        self.last_checked = time.monotonic()
+
+        signature = self._get_aliases_signature()
+        if self.signature is not None and signature == self.signature:
+            return
+
+        self.signature = signature
+        self.aliases = OrderedDict()
+        self.fully_loaded = False
+
+        alias_count = signature[0] if signature else 0
+        if alias_count > self.max_size:
+            self.session.logger.info(f"There are {alias_count} contributor aliases, which is more than the alias cache holds. Looking them up by email")
+            return
+
+        fetch_aliases = s.sql.text("""SELECT alias_email, canonical_email
+            FROM contributors_aliases
+            WHERE cntrb_active = 1""")
+
+        for alias in self.session.fetchall_data_from_sql_text(fetch_aliases):
+
+            # the first alias is used when an email has more than one, like the single email lookup does
+            self.aliases.setdefault(alias['alias_email'], alias['canonical_email'])
+
+        self.fully_loaded = True
+
+    def invalidate(self) -> None:
+        """Drop the cached aliases, so they are reloaded on the next lookup."""
+
+        self.aliases = OrderedDict()
+        self.fully_loaded = False
+        self.signature = None
+        self.last_checked = None
+
+    def _get_aliases_signature(self):
+
+        # any insert, delete or update of the aliases changes the count or the newest modification
+        get_signature = s.sql.text("""SELECT COUNT(*) AS alias_count, MAX(cntrb_last_modified) AS last_modified
+            FROM contributors_aliases
+            WHERE cntrb_active = 1""")
+
+        result = self.session.fetchall_data_from_sql_text(get_signature)
+        if not result:
+            return None
+
+        return (result[0]['alias_count'], result[0]['last_modified'])
+
+    def _fetch_canonical_email(self, email: str) -> str:
+
+        fetch_canonical = s.sql.text("""SELECT canonical_email
+            FROM contributors_aliases
+            WHERE alias_email=:alias_email
+            AND cntrb_active = 1""").bindparams(alias_email=email)
+
+        canonical = self.session.fetchall_data_from_sql_text(fetch_canonical)
+
+        if canonical:
+            return canonical[0]['canonical_email']
+
+        return email
+
+
+def get_alias_cache(session) -> ContributorAliasCache:
+    """Get the alias cache of a session, so every lookup of a task shares it."""
+
+    alias_cache = getattr(session, "alias_cache", None)
+
+    if alias_cache is None:
+        alias_cache = ContributorAliasCache(session)
+        session.alias_cache = alias_cache
+
+    return alias_cache
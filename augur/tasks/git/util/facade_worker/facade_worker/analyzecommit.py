@@ -39,157 +39,124 @@ import configparser
 import traceback 
 import sqlalchemy as s
 from sqlalchemy.exc import IntegrityError, DataError
+from .aliascache import get_alias_cache
+
+# The format of the commit header of the git log. The hash marks where each commit starts
+# when the log of many commits is parsed at once.
+GIT_LOG_FORMAT = ("--pretty=format:"
+	"commit_hash: %H%n"
+	"author_name: %an%nauthor_email: %ae%nauthor_date:%ai%n"
+	"committer_name: %cn%ncommitter_email: %ce%ncommitter_date: %ci%n"
+	"parents: %p%nEndPatch")
+
+### Local helper functions ###
+
+def check_swapped_emails(session,name,email):
+
+# Sometimes people mix up their name and email in their git settings
+
+	if name.find('@') >= 0 and email.find('@') == -1:
+		session.logger.debug(f"Found swapped email/name: {email}/{name}")
+		return email,name
+	else:
+		return name,email
+
+def strip_extra_amp(session,email):
+
+# Some repos have multiple ampersands, which really messes up domain pattern
+# matching. This extra info is not used, so we discard it.
+
+	if email.count('@') > 1:
+		session.logger.debug(f"Found extra @: {email}")
+		return email[:email.find('@',email.find('@')+1)]
+	else:
+		return email
+
+def discover_alias(session,email):
+
+# Match aliases with their canonical email. The aliases are cached for the
+# whole task, so this does not query the database for every file of every commit.
+
+	return get_alias_cache(session).get_canonical_email(email)
+
+def generate_commit_record(session,repos_id,commit,filename,
+	author_name,author_email,author_date,author_timestamp,
+	committer_name,committer_email,committer_date,committer_timestamp,
+	added,removed, whitespace):
+
+# Fix some common issues in git commit logs and store data.
+
+	# Sometimes git is misconfigured and name/email get swapped
+	author_name, author_email = check_swapped_emails(session,author_name,author_email)
+	committer_name,committer_email = check_swapped_emails(session,committer_name,committer_email)
+
+	# Some systems append extra info after a second @
+	author_email = strip_extra_amp(session,author_email)
+	committer_email = strip_extra_amp(session,committer_email)
+
+	#replace incomprehensible dates with epoch.
+	#2021-10-11 11:57:46 -0500
+	placeholder_date = "1970-01-01 00:00:15 -0500"
+
+	#session.logger.info(f"Timestamp: {author_timestamp}")
+	commit_record = {
+		'repo_id' : repos_id,
+		'cmt_commit_hash' : str(commit),
+		'cmt_filename' : filename,
+		'cmt_author_name' : str(author_name),
+		'cmt_author_raw_email' : author_email,
+		'cmt_author_email' : discover_alias(session,author_email),
+		'cmt_author_date' : author_date,
+		'cmt_author_timestamp' : author_timestamp if len(author_timestamp.replace(" ", "")) != 0 else placeholder_date,
+		'cmt_committer_name' : committer_name,
+		'cmt_committer_raw_email' : committer_email,
+		'cmt_committer_email' : discover_alias(session,committer_email),
+		'cmt_committer_date' : committer_date if len(committer_date.replace(" ", "")) != 0 else placeholder_date,
+		'cmt_committer_timestamp' : committer_timestamp if len(committer_timestamp.replace(" ","")) != 0 else placeholder_date,
+		'cmt_added' : added,
+		'cmt_removed' : removed,
+		'cmt_whitespace' : whitespace,
+		'cmt_date_attempted' : committer_date if len(committer_date.replace(" ","")) != 0 else placeholder_date,
+		'tool_source' : "Facade",
+		'tool_version' : "0.42",
+		'data_source' : "git"
+	}
+
+	return commit_record
+
+def parse_git_log(session, repo_id, lines):
+
+# This function parses the output of git log in the GIT_LOG_FORMAT, counting the
+# additions, removals, and whitespace changes of every file. The lines are read
+# one at a time, so the log of a whole repo never has to be held in memory.
+# Yields the hash of each commit with the list of its commit records.
+
+	commit = None
+
+	for line in lines:
+		if len(line) > 0:
 
-def analyze_commit(session, repo_id, repo_loc, commit):
-
-# This function analyzes a given commit, counting the additions, removals, and
-# whitespace changes. It collects all of the metadata about the commit, and
-# stashes it in the database.  A new database connection is opened each time in
-# case we are running in multithreaded mode, since MySQL cursors are not
-# currently threadsafe.
-
-
-# If GitHub: 
-# 	1. Get list of contributors (paginate) from platform
-# 	2. Check to see if contributors already exist in DB based on login
-# 	3. Insert into contributors table if they did not already exist
-# 	4. If there is an email returned, check if its a canonical or an alias (Phase 2)
-
-# elif GitLab: 
-# 	1. Get list of contributors (paginate) from platform
-# 	2. Check to see if contributors already exist based on login
-# 	3. Insert into contributors table if they did not already exist
-# 	4. If there is an email returned, check if its a canonical or an alias (Phase 2)
-
-# elif ... 
-
-
-	### Local helper functions ###
-
-	def check_swapped_emails(name,email):
-
-	# Sometimes people mix up their name and email in their git settings
-
-		if name.find('@') >= 0 and email.find('@') == -1:
-			session.logger.debug(f"Found swapped email/name: {email}/{name}")
-			return email,name
-		else:
-			return name,email
-
-	def strip_extra_amp(email):
-
-	# Some repos have multiple ampersands, which really messes up domain pattern
-	# matching. This extra info is not used, so we discard it.
-
-		if email.count('@') > 1:
-			session.logger.debug(f"Found extra @: {email}")
-			return email[:email.find('@',email.find('@')+1)]
-		else:
-			return email
-
-	def discover_alias(email):
-
-	# Match aliases with their canonical email
-		fetch_canonical = s.sql.text("""SELECT canonical_email
-			FROM contributors_aliases
-			WHERE alias_email=:alias_email 
-			AND cntrb_active = 1""").bindparams(alias_email=email)
-
-		canonical = session.fetchall_data_from_sql_text(fetch_canonical)#list(cursor_people_local)
-
-		if canonical:
-			for email in canonical:
-				return email['canonical_email']
-		else:
-			return email
-
-	def generate_commit_record(repos_id,commit,filename,
-		author_name,author_email,author_date,author_timestamp,
-		committer_name,committer_email,committer_date,committer_timestamp,
-		added,removed, whitespace):
-
-	# Fix some common issues in git commit logs and store data.
-
-		# Sometimes git is misconfigured and name/email get swapped
-		author_name, author_email = check_swapped_emails(author_name,author_email)
-		committer_name,committer_email = check_swapped_emails(committer_name,committer_email)
-
-		# Some systems append extra info after a second @
-		author_email = strip_extra_amp(author_email)
-		committer_email = strip_extra_amp(committer_email)
-
-		#replace incomprehensible dates with epoch.
-		#2021-10-11 11:57:46 -0500
-		placeholder_date = "1970-01-01 00:00:15 -0500"
-
-		#session.logger.info(f"Timestamp: {author_timestamp}")
-		commit_record = {
-			'repo_id' : repos_id,
-			'cmt_commit_hash' : str(commit),
-			'cmt_filename' : filename,
-			'cmt_author_name' : str(author_name),
-			'cmt_author_raw_email' : author_email,
-			'cmt_author_email' : discover_alias(author_email),
-			'cmt_author_date' : author_date,
-			'cmt_author_timestamp' : author_timestamp if len(author_timestamp.replace(" ", "")) != 0 else placeholder_date,
-			'cmt_committer_name' : committer_name,
-			'cmt_committer_raw_email' : committer_email,
-			'cmt_committer_email' : discover_alias(committer_email),
-			'cmt_committer_date' : committer_date if len(committer_date.replace(" ", "")) != 0 else placeholder_date,
-			'cmt_committer_timestamp' : committer_timestamp if len(committer_timestamp.replace(" ","")) != 0 else placeholder_date,
-			'cmt_added' : added,
-			'cmt_removed' : removed,
-			'cmt_whitespace' : whitespace,
-			'cmt_date_attempted' : committer_date if len(committer_date.replace(" ","")) != 0 else placeholder_date,
-			'tool_source' : "Facade",
-			'tool_version' : "0.42",
-			'data_source' : "git"
-		}
-
-		return commit_record
-
-
-### The real function starts here ###
-
-	header = True
-	filename = ''
-	filename = ''
-	added = 0
-	removed = 0
-	whitespace = 0
-
-	recordsToInsert = []
-
-	# Go get the contributors (committers) for this repo here: 
-	# curl https://api.github.com/repos/chaoss/augur/contributors
-	# Load the contributors
-
-
-	# Read the git log
-
-	git_log = subprocess.Popen(["git --git-dir %s log -p -M %s -n1 "
-		"--pretty=format:'"
-		"author_name: %%an%%nauthor_email: %%ae%%nauthor_date:%%ai%%n"
-		"committer_name: %%cn%%ncommitter_email: %%ce%%ncommitter_date: %%ci%%n"
-		"parents: %%p%%nEndPatch' "
-		% (repo_loc,commit)], stdout=subprocess.PIPE, shell=True)
+			if line.find('commit_hash: ') == 0:
 
-	## 
+				# Store the last stats of the previous commit
+				if commit is not None:
+					recordsToInsert.append(generate_commit_record(session,repo_id,commit,filename,
+						author_name,author_email,author_date,author_timestamp,
+						committer_name,committer_email,committer_date,committer_timestamp,
+						added,removed,whitespace))
 
-	# Stash the commit we're going to analyze so we can back it out if something
-	# goes wrong later.
-	store_working_commit = s.sql.text("""INSERT INTO working_commits
-		(repos_id,working_commit) VALUES (:repo_id,:commit)
-		""").bindparams(repo_id=repo_id,commit=commit)
+					yield commit, recordsToInsert
 
-	#cursor_local.execute(store_working_commit, (repo_id,commit))
-	#db_local.commit()
-	session.execute_sql(store_working_commit)
+				commit = line[13:]
 
-	#session.log_activity('Debug',f"Stored working commit and analyzing : {commit}")
+				header = True
+				filename = ''
+				added = 0
+				removed = 0
+				whitespace = 0
 
-	for line in git_log.stdout.read().decode("utf-8",errors="ignore").split(os.linesep):
-		if len(line) > 0:
+				recordsToInsert = []
+				continue
 
 			if line.find('author_name:') == 0:
 				author_name = line[13:]
@@ -258,7 +225,7 @@ def analyze_commit(session, repo_id, repo_loc, commit):
 
 				if not header:
 
-					recordsToInsert.append(generate_commit_record(repo_id,commit,filename,
+					recordsToInsert.append(generate_commit_record(session,repo_id,commit,filename,
 						author_name,author_email,author_date,author_timestamp,
 						committer_name,committer_email,committer_date,committer_timestamp,
 						added,removed,whitespace))
@@ -317,10 +284,95 @@ def analyze_commit(session, repo_id, repo_loc, commit):
 					whitespaceCheck.append(line[1:].strip())
 
 	# Store the last stats from the git log
-	recordsToInsert.append(generate_commit_record(repo_id,commit,filename,
-		author_name,author_email,author_date,author_timestamp,
-		committer_name,committer_email,committer_date,committer_timestamp,
-		added,removed,whitespace))
+	if commit is not None:
+		recordsToInsert.append(generate_commit_record(session,repo_id,commit,filename,
+			author_name,author_email,author_date,author_timestamp,
+			committer_name,committer_email,committer_date,committer_timestamp,
+			added,removed,whitespace))
+
+		yield commit, recordsToInsert
+
+def read_git_log_lines(stream):
+
+# Decode the lines of a git log as they are read. Lines are only split on
+# newlines, like the log used to be split on os.linesep.
+
+	for line in stream:
+		yield line.decode("utf-8",errors="ignore").rstrip('\n')
+
+def analyze_commits(session, repo_id, repo_loc, commits):
+
+# This function analyzes a list of commits with a single git log, instead of
+# starting a git process for each commit. The hashes are passed on stdin and
+# git reads all of them before it writes any output, so stdin can be written
+# before stdout is read. Yields the hash of each commit with its commit records.
+# Raises CalledProcessError when git log fails, since its output is then incomplete.
+
+	git_log = subprocess.Popen(["git", "--git-dir", repo_loc, "log", "--no-walk=unsorted",
+		"--stdin", "-p", "-M", GIT_LOG_FORMAT], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+	try:
+		git_log.stdin.write("".join(f"{commit}\n" for commit in commits).encode())
+		git_log.stdin.close()
+
+		yield from parse_git_log(session, repo_id, read_git_log_lines(git_log.stdout))
+
+		if git_log.wait() != 0:
+			raise subprocess.CalledProcessError(git_log.returncode, git_log.args)
+
+	finally:
+		git_log.stdout.close()
+		if git_log.poll() is None:
+			git_log.kill()
+		git_log.wait()
+
+def analyze_commit(session, repo_id, repo_loc, commit):
+
+# This function analyzes a given commit, counting the additions, removals, and
+# whitespace changes. It collects all of the metadata about the commit, and
+# stashes it in the database.  A new database connection is opened each time in
+# case we are running in multithreaded mode, since MySQL cursors are not
+# currently threadsafe.
+
+
+# If GitHub: 
+# 	1. Get list of contributors (paginate) from platform
+# 	2. Check to see if contributors already exist in DB based on login
+# 	3. Insert into contributors table if they did not already exist
+# 	4. If there is an email returned, check if its a canonical or an alias (Phase 2)
+
+# elif GitLab: 
+# 	1. Get list of contributors (paginate) from platform
+# 	2. Check to see if contributors already exist based on login
+# 	3. Insert into contributors table if they did not already exist
+# 	4. If there is an email returned, check if its a canonical or an alias (Phase 2)
+
+# elif ... 
+
+	# Read the git log
+
+	git_log = subprocess.Popen(["git", "--git-dir", repo_loc, "log", "-p", "-M", commit, "-n1",
+		GIT_LOG_FORMAT], stdout=subprocess.PIPE)
+
+	## 
+
+	# Stash the commit we're going to analyze so we can back it out if something
+	# goes wrong later.
+	store_working_commit = s.sql.text("""INSERT INTO working_commits
+		(repos_id,working_commit) VALUES (:repo_id,:commit)
+		""").bindparams(repo_id=repo_id,commit=commit)
+
+	#cursor_local.execute(store_working_commit, (repo_id,commit))
+	#db_local.commit()
+	session.execute_sql(store_working_commit)
+
+	#session.log_activity('Debug',f"Stored working commit and analyzing : {commit}")
+
+	recordsToInsert = []
+
+	for _, commitRecords in parse_git_log(session, repo_id, read_git_log_lines(git_log.stdout)):
+		recordsToInsert.extend(commitRecords)
 
+	git_log.wait()
 
 	return recordsToInsert
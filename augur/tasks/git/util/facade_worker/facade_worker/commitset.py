@@ -0,0 +1,68 @@
+#SPDX-License-Identifier: MIT
+"""Defines the compact set of commit hashes that facade diffs against the parents of HEAD.
+
+A commit hash is held as its 20 raw bytes instead of a 40 character string,
+which is 53 instead of 89 bytes per hash, about 40% less memory for repos with millions of commits.
+"""
+from typing import Iterable, Iterator, Set
+
+
+class CommitHashSet:
+    """Set of commit hashes that are stored as bytes.
+
+    Hashes are added and looked up as hex strings, and iterating the set yields hex strings.
+    Subtracting it from a set of hashes, or a set of hashes from it, returns a regular set of hex strings.
+
+    Note:
+        Hashes are yielded in lowercase like git writes them, so a hash that is added in uppercase 
+        is still found by a lookup, but does not equal the uppercase string in a regular set
+    """
+
+    def __init__(self, commits: Iterable[str] = ()):
+
+        self.hashes = set()
+
+        for commit in commits:
+            self.add(commit)
+
+    def add(self, commit: str) -> None:
+
+        self.hashes.add(self._to_bytes(commit))
+
+    def __contains__(self, commit: str) -> bool:
+
+        return self._to_bytes(commit) in self.hashes
+
+    def __len__(self) -> int:
+
+        return len(self.hashes)
+
+    def __iter__(self) -> Iterator[str]:
+
+        for commit in self.hashes:
+            yield self._to_hex(commit)
+
+    def __sub__(self, other) -> Set[str]:
+
+        return {commit for commit in self if commit not in other}
+
+    def __rsub__(self, other) -> Set[str]:
+
+        return {commit for commit in other if commit not in self}
+
+    @staticmethod
+    def _to_bytes(commit: str):
+
+        try:
+            return bytes.fromhex(commit)
+        except ValueError:
+            # not a hex hash, so it is kept as text, which never equals the bytes of a hash
+            return commit
+
+    @staticmethod
+    def _to_hex(commit) -> str:
+
+        if isinstance(commit, bytes):
+            return commit.hex()
+
+        return commit
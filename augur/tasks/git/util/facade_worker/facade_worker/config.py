@@ -109,6 +109,8 @@ class FacadeSession(GithubTaskSession):
         rebuild_caches (int): toggles whether to rebuild unknown affiliation and web caches
         multithreaded (int): toggles whether to allow the facade task to execute subtasks in parallel
         create_xlsx_summary_files (int): toggles whether to create excel summary files
+        clone_concurrency (int): max number of repos that clone_repos clones at the same time
+        partial_clone (int): toggles whether repos are cloned without the file contents of past commits. Ignored when run_analysis is on, as the analysis reads every past commit
     """
     def __init__(self,logger: Logger):
 
@@ -135,6 +137,8 @@ class FacadeSession(GithubTaskSession):
         self.rebuild_caches = worker_options["rebuild_caches"]
         self.multithreaded = worker_options["multithreaded"]
         self.create_xlsx_summary_files = worker_options["create_xlsx_summary_files"]
+        self.clone_concurrency = worker_options.get("clone_concurrency", 4)
+        self.partial_clone = worker_options.get("partial_clone", 0)
 
         self.tool_source = "Facade"
         self.data_source = "Git Log"
@@ -38,6 +38,24 @@ import xlsxwriter
 import configparser
 import sqlalchemy as s
 from .utilitymethods import update_repo_log, trim_commits, store_working_author, trim_author
+from .aliascache import get_alias_cache
+from augur.tasks.util.metric_cache import invalidate_all_metric_cache
+
+# number of repos whose commits are updated in each transaction when affiliations are filled
+AFFILIATION_REPO_BATCH_SIZE = 25
+
+# the periods of the dm_repo_* and dm_repo_group_* caches, with the columns that identify a period
+CACHE_PERIODS = {
+    'weekly': ('week', 'year'),
+    'monthly': ('month', 'year'),
+    'annual': ('year',),
+}
+
+# analysis_log status of a repo whose caches were refreshed. Its date is the analysis that was refreshed
+CACHE_REFRESHED_STATUS = 'Caches refreshed'
+
+# analysis_log status whose date is the newest data_collection_date of the commits that were cached for a repo
+CACHE_WATERMARK_STATUS = 'Caches refreshed through'
 # if platform.python_implementation() == 'PyPy':
 #   import pymysql
 # else:
@@ -64,222 +82,28 @@ def nuke_affiliations(session):
 
 def fill_empty_affiliations(session):
 
-     
-
 # When a record is added, it has no affiliation data. Also, when an affiliation
-# mapping is changed via the UI, affiliation data will be set to NULL. This
-# function finds any records with NULL affiliation data and fills them.
-
-### Local helper functions ###
-    def discover_null_affiliations(attribution,email):
-
-    # Try a bunch of ways to match emails to attributions in the database. First it
-    # tries to match exactly. If that doesn't work, it tries to match by domain. If
-    # domain doesn't work, it strips subdomains from the email and tries again.
-
-        # First we see if there's an exact match. This will also catch malformed or
-        # intentionally mangled emails (e.g. "developer at domain.com") that have
-        # been added as an affiliation rather than an alias.
-
-        find_exact_match = s.sql.text("""SELECT ca_affiliation,ca_start_date
-            FROM contributor_affiliations 
-            WHERE ca_domain = :email 
-            AND ca_active = 1 
-            ORDER BY ca_start_date DESC""").bindparams(email=email)
-
-         
-         
-
-        matches = session.fetchall_data_from_sql_text(find_exact_match)#list(cfg.cursor)
-
-        if not matches and email.find('@') < 0:
-
-            # It's not a properly formatted email, leave it NULL and log it.
-
-            session.log_activity('Info',f"Unmatchable email: {email}")
-
-            return
-
-        if not matches:
-
-            # Now we go for a domain-level match. Try for an exact match.
-
-            domain = email[email.find('@')+1:]
-
-            find_exact_domain = s.sql.text("""SELECT ca_affiliation,ca_start_date 
-                FROM contributor_affiliations 
-                WHERE ca_domain= :domain 
-                AND ca_active = 1 
-                ORDER BY ca_start_date DESC""").bindparams(domain=domain)
-
-             
-             
-
-            matches = session.fetchall_data_from_sql_text(find_exact_domain)
-
-        if not matches:
-
-            # Then try stripping any subdomains.
-
-            find_domain = s.sql.text("""SELECT ca_affiliation,ca_start_date 
-                FROM contributor_affiliations 
-                WHERE ca_domain = :strippedDomain 
-                AND ca_active = 1 
-                ORDER BY ca_start_date DESC""").bindparams(strippedDomain=domain[domain.rfind('.',0,domain.rfind('.',0))+1:])
-
-
-            matches = session.fetchall_data_from_sql_text(find_domain)#list(cfg.cursor)
-
-        if not matches:
-
-            # One last check to see if it's an unmatched academic domain.
-
-            if domain[-4:] in '.edu':
-                matches.append({'ca_affiliation':'(Academic)','ca_start_date':'1970-01-01'})
-
-        # Done looking. Now we process any matches that were found.
-
-        if matches:
-
-            session.log_activity('Debug',f"Found domain match for {email}")
-
-            for match in matches:
-                update = s.sql.text(("UPDATE commits "
-                    f"SET cmt_{attribution}_affiliation = :affiliation "
-                    f"WHERE cmt_{attribution}_email = :email "
-                    f"AND cmt_{attribution}_affiliation IS NULL "
-                    f"AND cmt_{attribution}_date::date >= \'{match['ca_start_date']}\'::date")
-                    ).bindparams(affiliation=match['ca_affiliation'],email=email)
-
-                session.log_activity('Info', f"attr: {attribution} \nmatch:{match}\nsql: {update}")
-
-                try: 
-                    session.execute_sql(update)
-                except Exception as e: 
-                    session.log_activity('Info', f"Error encountered: {e}")
-                    session.log_activity('Info', f"Affiliation insertion failed for {email} ")
-                    session.log_activity('Info', f"Offending query: {update} ")
-
-    def discover_alias(email):
-
-    # Match aliases with their canonical email
-
-        fetch_canonical = s.sql.text("""SELECT canonical_email
-            FROM contributors_aliases
-            WHERE alias_email=:email
-            AND cntrb_active = 1""").bindparams(email=email)
-
-        canonical = session.fetchall_data_from_sql_text(fetch_canonical)#list(cfg.cursor)
-
-        if canonical:
-            for email in canonical:
-                return email['canonical_email']
-        else:
-            return email
-
-### The real function starts here ###
+# mapping or an alias is changed, the affiliation data of the emails it matches
+# has to be found again. This function fills them.
+#
+# The matches are found once per email and stored in temp tables, then applied
+# to commits with set based updates that run a batch of repos at a time, so no
+# single statement locks the whole commits table.
 
     session.update_status('Filling empty affiliations')
     session.log_activity('Info','Filling empty affiliations')
 
-    # Process any changes to the affiliations or aliases, and set any existing
-    # entries in commits to NULL so they are filled properly.
-
     # First, get the time we started fetching since we'll need it later
 
     timefetch = s.sql.text("""SELECT current_timestamp(6) as fetched""")
 
-    affiliations_fetched = session.execute_sql(timefetch).fetchone()[0] 
-    print(affiliations_fetched)
-    # Now find the last time we worked on affiliations, to figure out what's new
-
-    affiliations_processed = session.get_setting('affiliations_processed')
-
-    get_changed_affiliations = s.sql.text("""SELECT ca_domain FROM contributor_affiliations""")# WHERE "
-        #"ca_last_used >= timestamptz  %s")
-
-     
-
-    changed_affiliations = session.fetchall_data_from_sql_text(get_changed_affiliations)#list(cfg.cursor)
-
-    # Process any affiliations which changed since we last checked
-
-    for changed_affiliation in changed_affiliations:
-
-        session.log_activity('Debug',f"Resetting affiliation for {changed_affiliation['ca_domain']}")
-
-        set_author_to_null = s.sql.text("""UPDATE commits SET cmt_author_affiliation = NULL
-            WHERE cmt_author_email LIKE CONCAT('%%',:affiliation)""").bindparams(affiliation=changed_affiliation['ca_domain'])
-
-        session.execute_sql(set_author_to_null)
-
-        set_committer_to_null = s.sql.text("""UPDATE commits SET cmt_committer_affiliation = NULL
-            WHERE cmt_committer_email LIKE CONCAT('%%',:affiliation)""").bindparams(affiliation=changed_affiliation['ca_domain'])
-
-        session.execute_sql(set_committer_to_null)
-
-    # Update the last fetched date, so we know where to start next time.
-
-    update_affiliations_date = s.sql.text("""UPDATE settings SET value=:affiliations
-        WHERE setting = 'affiliations_processed'""").bindparams(affiliations=affiliations_fetched)
-
-    session.execute_sql(update_affiliations_date)
-
-    # On to the aliases, now
-
-    # First, get the time we started fetching since we'll need it later
-
-    get_time = s.sql.text("""SELECT current_timestamp(6) as fetched""")
-
-    aliases_fetched = session.execute_sql(get_time).fetchone()[0]#['fetched']
+    fetched = session.execute_sql(timefetch).fetchone()[0]
 
     # Now find the last time we worked on aliases, to figure out what's new
 
     aliases_processed = session.get_setting('aliases_processed')
 
-    get_changed_aliases = s.sql.text("""SELECT alias_email FROM contributors_aliases WHERE
-        cntrb_last_modified >= :aliases""").bindparams(aliases=aliases_processed)
-
-    changed_aliases = session.fetchall_data_from_sql_text(get_changed_aliases)#list(cfg.cursor)
-
-    # Process any aliases which changed since we last checked
-
-    for changed_alias in changed_aliases:
-
-        session.log_activity('Debug',f"Resetting affiliation for {changed_alias['alias_email']}")
-
-        set_author_to_null = s.sql.text("""UPDATE commits SET cmt_author_affiliation = NULL
-            WHERE cmt_author_raw_email LIKE CONCAT('%%',:alias)""").bindparams(alias=changed_alias['alias_email'])
-
-        session.insert_or_update_data(set_author_to_null)
-
-        set_committer_to_null = s.sql.text("""UPDATE commits SET cmt_committer_affiliation = NULL 
-            WHERE cmt_committer_raw_email LIKE CONCAT('%%',:alias_email)""").bindparams(alias_email=changed_alias['alias_email'])
-
-        session.insert_or_update_data(set_committer_to_null)
-
-        reset_author = s.sql.text("""UPDATE commits
-            SET cmt_author_email = :author_email 
-            WHERE cmt_author_raw_email = :raw_author_email
-            """).bindparams(author_email=discover_alias(changed_alias['alias_email']),raw_author_email=changed_alias['alias_email'])
-
-        session.insert_or_update_data(reset_author)
-
-        reset_committer = s.sql.text("""UPDATE commits
-            SET cmt_committer_email = :author_email 
-            WHERE cmt_committer_raw_email = :raw_author_email
-            """).bindparams(author_email=discover_alias(changed_alias['alias_email']), raw_author_email=changed_alias['alias_email'])
-
-        session.insert_or_update_data(reset_committer)
-        
-    # Update the last fetched date, so we know where to start next time.
-
-    update_aliases_date = s.sql.text("""UPDATE settings SET value=:aliases
-        WHERE setting = 'aliases_processed'""").bindparams(aliases=aliases_fetched)
-
-    session.execute_sql(update_aliases_date)
-
-    # Now rebuild the affiliation data
+    # A run of the old per email code may have been interrupted part way through an author
 
     working_author = session.get_setting('working_author')
 
@@ -287,87 +111,205 @@ def fill_empty_affiliations(session):
         session.log_activity('Error',f"Trimming author data in affiliations: {working_author}")
         trim_author(session, working_author)
 
-    # Figure out which projects have NULL affiliations so they can be recached
-
-    set_recache = s.sql.text("""UPDATE repo_groups 
-                SET rg_recache=1  
-                FROM repo_groups x, repo y, commits z 
-                where x.repo_group_id = y.repo_group_id 
-                and
-                y."repo_id" = z.repo_id
-                and 
-        (z.cmt_author_affiliation IS NULL OR 
-        z.cmt_committer_affiliation IS NULL)""")
-
-    # ("UPDATE repo_groups p "
-    #   "JOIN repo r ON p.repo_group_id = r.repo_group_id "
-    #   "JOIN commits a ON r.repo_id = a.repo_id "
-    #   "SET rg_recache=TRUE WHERE "
-    #   "author_affiliation IS NULL OR "
-    #   "committer_affiliation IS NULL")
-    session.execute_sql(set_recache)
+    get_repo_ids = s.sql.text("""SELECT repo_id FROM repo ORDER BY repo_id""")
 
-    # Find any authors with NULL affiliations and fill them
+    repo_ids = [repo['repo_id'] for repo in session.fetchall_data_from_sql_text(get_repo_ids)]
 
-    find_null_authors = s.sql.text("""SELECT DISTINCT cmt_author_email AS email,
-        MIN(cmt_author_date) AS earliest 
-        FROM commits 
-        WHERE cmt_author_affiliation IS NULL 
-        GROUP BY cmt_author_email""")
+    repo_batches = [repo_ids[i:i + AFFILIATION_REPO_BATCH_SIZE] for i in range(0, len(repo_ids), AFFILIATION_REPO_BATCH_SIZE)]
 
-    null_authors = session.fetchall_data_from_sql_text(find_null_authors)
+    # Temp tables only exist on the connection that made them, so every statement runs on this one
 
-    session.log_activity('Debug',f"Found {len(null_authors)} authors with NULL affiliation")
+    with session.engine.connect() as connection:
 
-    for null_author in null_authors:
+        try:
+            changed_alias_count = build_changed_aliases_table(connection, aliases_processed)
 
-        email = null_author['email']
+            # Make sure the changed aliases are not resolved with a cache that was loaded before they changed
+            if changed_alias_count:
+                get_alias_cache(session).invalidate()
 
-        store_working_author(session, email)
+            session.log_activity('Debug',f"Found {changed_alias_count} changed aliases")
 
-        discover_null_affiliations('author',email)
-
-    store_working_author(session, 'done')
+            if changed_alias_count:
+                for repo_batch in repo_batches:
+                    for attribution in ('author','committer'):
+                        connection.execute(reset_aliases_sql(attribution).bindparams(repo_ids=repo_batch))
+                    connection.commit()
 
-    # Find any committers with NULL affiliations and fill them
+            # The aliases are reset before the matches are found, so the canonical emails are matched
 
-    find_null_committers = s.sql.text("""SELECT DISTINCT cmt_committer_email AS email, 
-        MIN(cmt_committer_date) AS earliest 
-        FROM commits 
-        WHERE cmt_committer_affiliation IS NULL
-        GROUP BY cmt_committer_email""")
+            build_affiliation_match_tables(connection)
 
-    null_committers = session.fetchall_data_from_sql_text(find_null_committers)
+            for repo_batch in repo_batches:
+                for attribution in ('author','committer'):
+                    connection.execute(fill_affiliations_sql(attribution).bindparams(repo_ids=repo_batch))
+                connection.commit()
 
-    session.log_activity('Debug',f"Found {len(null_committers)} committers with NULL affiliation")
+                session.log_activity('Debug',f"Filled affiliations of repos {repo_batch[0]} to {repo_batch[-1]}")
 
-    for null_committer in null_committers:
+        finally:
+            # the connection goes back to the pool, so the temp tables are dropped instead of waiting for it to close
+            connection.rollback()
+            connection.execute(s.sql.text("""DROP TABLE IF EXISTS facade_changed_aliases,
+                facade_affiliation_emails, facade_affiliation_matches, facade_reset_emails"""))
+            connection.commit()
 
-        email = null_committer['email']
+    # Update the last fetched dates, so we know where to start next time.
 
-        store_working_author(session, email)
-
-        discover_null_affiliations('committer',email)
-
-    # Now that we've matched as much as possible, fill the rest as (Unknown)
-
-    fill_unknown_author = s.sql.text("""UPDATE commits
-        SET cmt_author_affiliation = '(Unknown)'
-        WHERE cmt_author_affiliation IS NULL""")
+    update_affiliations_date = s.sql.text("""UPDATE settings SET value=:affiliations
+        WHERE setting = 'affiliations_processed'""").bindparams(affiliations=fetched)
 
-    session.execute_sql(fill_unknown_author)
+    session.execute_sql(update_affiliations_date)
 
-    fill_unknown_committer = s.sql.text("""UPDATE commits
-        SET cmt_committer_affiliation = '(Unknown)'
-        WHERE cmt_committer_affiliation IS NULL""")
+    update_aliases_date = s.sql.text("""UPDATE settings SET value=:aliases
+        WHERE setting = 'aliases_processed'""").bindparams(aliases=fetched)
 
-    session.execute_sql(fill_unknown_committer)
-    
+    session.execute_sql(update_aliases_date)
 
     store_working_author(session, 'done')
 
     session.log_activity('Info','Filling empty affiliations (complete)')
 
+def build_changed_aliases_table(connection, aliases_processed):
+
+# Store the aliases that changed since they were last processed, with the email
+# their commits should now use. That is the canonical email of the active alias,
+# or the alias email itself if it is no longer active.
+
+    connection.execute(s.sql.text("""DROP TABLE IF EXISTS facade_changed_aliases"""))
+
+    connection.execute(s.sql.text("""CREATE TEMP TABLE facade_changed_aliases AS
+        SELECT DISTINCT ON (changed.alias_email) changed.alias_email,
+            COALESCE(active.canonical_email, changed.alias_email) AS canonical_email
+        FROM contributors_aliases changed
+        LEFT JOIN contributors_aliases active
+            ON active.alias_email = changed.alias_email AND active.cntrb_active = 1
+        WHERE changed.cntrb_last_modified >= :aliases_processed
+        ORDER BY changed.alias_email""").bindparams(aliases_processed=aliases_processed))
+
+    connection.execute(s.sql.text("""CREATE INDEX ON facade_changed_aliases (alias_email)"""))
+    connection.execute(s.sql.text("""ANALYZE facade_changed_aliases"""))
+    connection.commit()
+
+    return connection.execute(s.sql.text("""SELECT COUNT(*) FROM facade_changed_aliases""")).scalar()
+
+def reset_aliases_sql(attribution):
+
+# Set the email of a batch of repos' commits by changed aliases to the email
+# the alias now resolves to, and clear their affiliation so it is found again.
+
+    return s.sql.text(f"""UPDATE commits c
+        SET cmt_{attribution}_email = a.canonical_email,
+            cmt_{attribution}_affiliation = NULL
+        FROM facade_changed_aliases a
+        WHERE c.cmt_{attribution}_raw_email = a.alias_email
+        AND c.repo_id = ANY(:repo_ids)""")
+
+def build_affiliation_match_tables(connection):
+
+# Match every email in commits to the affiliations it gets, the way they used to
+# be matched one email at a time. An exact email match is used first. If the
+# email has none, the domain of the email is matched, then the domain without
+# its subdomains, and finally unmatched academic domains get (Academic). Every
+# affiliation of the first level that matches is stored, since each one applies
+# to the commits after its start date.
+
+    connection.execute(s.sql.text("""DROP TABLE IF EXISTS facade_affiliation_emails,
+        facade_affiliation_matches, facade_reset_emails"""))
+
+    connection.execute(s.sql.text("""CREATE TEMP TABLE facade_affiliation_emails AS
+        SELECT email,
+            POSITION('@' IN email) > 0 AS has_domain,
+            domain,
+            REGEXP_REPLACE(domain, '^.*\\.([^.]*\\.[^.]*)$', '\\1') AS stripped_domain
+        FROM (
+            SELECT email, SUBSTRING(email FROM POSITION('@' IN email) + 1) AS domain
+            FROM (
+                SELECT cmt_author_email AS email FROM commits
+                UNION
+                SELECT cmt_committer_email AS email FROM commits
+            ) commit_emails
+        ) email_domains"""))
+
+    connection.execute(s.sql.text("""CREATE TEMP TABLE facade_affiliation_matches AS
+        SELECT email, ca_affiliation, ca_start_date
+        FROM (
+            SELECT e.email, ca.ca_affiliation,
+                COALESCE(ca.ca_start_date, DATE '1970-01-01') AS ca_start_date,
+                m.level,
+                MIN(m.level) OVER (PARTITION BY e.email) AS best_level
+            FROM facade_affiliation_emails e
+            CROSS JOIN LATERAL (VALUES (1, e.email), (2, e.domain), (3, e.stripped_domain)) m(level, ca_domain)
+            JOIN contributor_affiliations ca
+                ON ca.ca_domain = m.ca_domain
+                AND ca.ca_active = 1
+            WHERE m.level = 1 OR e.has_domain
+        ) matches
+        WHERE level = best_level
+        UNION ALL
+        SELECT e.email, '(Academic)', DATE '1970-01-01'
+        FROM facade_affiliation_emails e
+        WHERE e.has_domain
+        AND POSITION(RIGHT(e.domain, 4) IN '.edu') > 0
+        AND NOT EXISTS (
+            SELECT 1 FROM contributor_affiliations ca
+            WHERE ca.ca_active = 1
+            AND ca.ca_domain IN (e.email, e.domain, e.stripped_domain)
+        )"""))
+
+    # An affiliation change can move emails that already have an affiliation, so
+    # every email that ends with an affiliation domain has its affiliation found again
+
+    connection.execute(s.sql.text("""CREATE TEMP TABLE facade_reset_emails AS
+        SELECT e.email
+        FROM facade_affiliation_emails e
+        WHERE EXISTS (
+            SELECT 1 FROM contributor_affiliations ca
+            WHERE e.email LIKE CONCAT('%%', ca.ca_domain)
+        )"""))
+
+    connection.execute(s.sql.text("""CREATE INDEX ON facade_affiliation_matches (email, ca_start_date)"""))
+    connection.execute(s.sql.text("""CREATE INDEX ON facade_reset_emails (email)"""))
+    connection.execute(s.sql.text("""ANALYZE facade_affiliation_matches"""))
+    connection.execute(s.sql.text("""ANALYZE facade_reset_emails"""))
+    connection.commit()
+
+def fill_affiliations_sql(attribution):
+
+# Set the affiliation of a batch of repos' commits that have none, or whose email
+# was reset, to the latest matched affiliation that started before the commit.
+# Commits without one are (Unknown). Only the rows whose affiliation changes are
+# written, and the repo groups of the repos that changed are marked to be recached.
+
+    return s.sql.text(f"""WITH new_affiliations AS (
+            SELECT c.cmt_id,
+                COALESCE((
+                    SELECT m.ca_affiliation
+                    FROM facade_affiliation_matches m
+                    WHERE m.email = c.cmt_{attribution}_email
+                    AND m.ca_start_date <= c.cmt_{attribution}_date::date
+                    ORDER BY m.ca_start_date DESC
+                    LIMIT 1
+                ), '(Unknown)') AS affiliation
+            FROM commits c
+            WHERE c.repo_id = ANY(:repo_ids)
+            AND (c.cmt_{attribution}_affiliation IS NULL
+                OR c.cmt_{attribution}_email IN (SELECT email FROM facade_reset_emails))
+        ), updated AS (
+            UPDATE commits c
+            SET cmt_{attribution}_affiliation = n.affiliation
+            FROM new_affiliations n
+            WHERE c.cmt_id = n.cmt_id
+            AND c.cmt_{attribution}_affiliation IS DISTINCT FROM n.affiliation
+            RETURNING c.repo_id
+        )
+        UPDATE repo_groups
+        SET rg_recache = 1
+        WHERE repo_group_id IN (
+            SELECT repo_group_id FROM repo
+            WHERE repo_id IN (SELECT repo_id FROM updated)
+        )""")
+
 def invalidate_caches(session):
 
 # Invalidate all caches
@@ -386,6 +328,10 @@ def rebuild_unknown_affiliation_and_web_caches(session):
 # pretty expensive. Instead, we crunch the data based upon the user's preferred
 # statistics (author or committer) and store them. We also store all records
 # with an (Unknown) affiliation for display to the user.
+#
+# Repo groups marked with rg_recache are rebuilt in full. For every other repo
+# that facade analyzed since its caches were last refreshed, only the years
+# with newly analyzed commits are recomputed.
 
     session.update_status('Caching data for display')
     session.log_activity('Info','Caching unknown affiliations and web data for display')
@@ -393,6 +339,18 @@ def rebuild_unknown_affiliation_and_web_caches(session):
     report_date = session.get_setting('report_date')
     report_attribution = session.get_setting('report_attribution')
 
+    # The watermarks of the repos that are rebuilt in full are read before they are rebuilt,
+    # so commits that are added while they are rebuilt are refreshed again next time
+
+    get_recache_repos = s.sql.text("""SELECT r.repo_id,
+        (SELECT MAX(date_attempted) FROM analysis_log l WHERE l.repos_id = r.repo_id AND l.status = 'Complete') AS last_analyzed,
+        (SELECT MAX(a.data_collection_date) FROM commits a WHERE a.repo_id = r.repo_id) AS refreshed_through
+        FROM repo r
+        JOIN repo_groups p ON p.repo_group_id = r.repo_group_id
+        WHERE p.rg_recache = 1""")
+
+    recache_repos = session.fetchall_data_from_sql_text(get_recache_repos)
+
     # Clear stale caches
 
     clear_dm_repo_group_weekly = s.sql.text("""
@@ -504,246 +462,186 @@ def rebuild_unknown_affiliation_and_web_caches(session):
 
     session.log_activity('Verbose','Caching unknown authors and committers')
 
-    # Cache the unknown authors
+    # Cache the unknown authors and committers
 
-    unknown_authors = s.sql.text("""
-        INSERT INTO unknown_cache (type, repo_group_id, email, domain, added, tool_source, tool_version, data_source)
-        SELECT 'author', 
-        r.repo_group_id, 
-        a.cmt_author_email, 
-        SPLIT_PART(a.cmt_author_email,'@',2), 
-        SUM(a.cmt_added),
-        info.a AS tool_source, info.b AS tool_version, info.c AS data_source
-        FROM (VALUES(:tool_source,:tool_version,:data_source)) info(a,b,c), 
-        commits a 
-        JOIN repo r ON r.repo_id = a.repo_id 
-        JOIN repo_groups p ON p.repo_group_id = r.repo_group_id 
-        WHERE a.cmt_author_affiliation = '(Unknown)' 
-        AND p.rg_recache = 1 
-        GROUP BY r.repo_group_id,a.cmt_author_email, info.a, info.b, info.c
+    for attribution in ('author','committer'):
+        session.execute_sql(build_unknown_cache_sql(session, attribution, "p.rg_recache = 1"))
 
-        """).bindparams(tool_source=session.tool_source,tool_version=session.tool_version,data_source=session.data_source)
+    # Start caching by project
 
-    session.execute_sql(unknown_authors)
+    session.log_activity('Verbose','Caching projects')
 
-    # Cache the unknown committers
+    for period in CACHE_PERIODS:
+        session.execute_sql(build_dm_cache_sql(session, 'repo_group', period, report_attribution, report_date, "p.rg_recache = 1"))
 
-    unknown_committers = s.sql.text("""INSERT INTO unknown_cache (type, repo_group_id, email, domain, added, tool_source, tool_version, data_source)
-        SELECT 'committer', 
-        r.repo_group_id, 
-        a.cmt_committer_email, 
-        SPLIT_PART(a.cmt_committer_email,'@',2), 
-        SUM(a.cmt_added),
-        info.a AS tool_source, info.b AS tool_version, info.c AS data_source
-        FROM (VALUES(:tool_source,:tool_version,:data_source)) info(a,b,c), 
-        commits a 
-        JOIN repo r ON r.repo_id = a.repo_id 
-        JOIN repo_groups p ON p.repo_group_id = r.repo_group_id 
-        WHERE a.cmt_committer_affiliation = '(Unknown)' 
-        AND p.rg_recache = 1 
-        GROUP BY r.repo_group_id,a.cmt_committer_email, info.a, info.b, info.c 
-        """).bindparams(tool_source=session.tool_source,tool_version=session.tool_version,data_source=session.data_source)
+    # Start caching by repo
 
-    session.execute_sql(unknown_committers)
+    session.log_activity('Verbose','Caching repos')
 
-    # Start caching by project
+    for period in CACHE_PERIODS:
+        session.execute_sql(build_dm_cache_sql(session, 'repo', period, report_attribution, report_date, "p.rg_recache = 1"))
 
-    session.log_activity('Verbose','Caching projects')
+    # Only recompute the years of newly analyzed commits for the rest of the repos
 
-    cache_projects_by_week = s.sql.text((
-        "INSERT INTO dm_repo_group_weekly (repo_group_id, email, affiliation, week, year, added, removed, whitespace, files, patches, tool_source, tool_version, data_source)"
-        "SELECT r.repo_group_id AS repo_group_id," 
-        f"a.cmt_{report_attribution}_email AS email, "
-        f"a.cmt_{report_attribution}_affiliation AS affiliation," 
-        f"date_part('week', TO_TIMESTAMP(a.cmt_{report_date}_date, 'YYYY-MM-DD')) AS week," 
-        f"date_part('year', TO_TIMESTAMP(a.cmt_{report_date}_date, 'YYYY-MM-DD')) AS year, "
-        "SUM(a.cmt_added) AS added, "
-        "SUM(a.cmt_removed) AS removed," 
-        "SUM(a.cmt_whitespace) AS whitespace, "
-        "COUNT(DISTINCT a.cmt_filename) AS files," 
-        "COUNT(DISTINCT a.cmt_commit_hash) AS patches,"
-        "info.a AS tool_source, info.b AS tool_version, info.c AS data_source "
-        "FROM (VALUES(:tool_source,:tool_version,:data_source)) info(a,b,c), "
-        "commits a "
-        "JOIN repo r ON r.repo_id = a.repo_id "
-        "JOIN repo_groups p ON p.repo_group_id = r.repo_group_id "
-        "LEFT JOIN exclude e ON "
-        "    (a.cmt_author_email = e.email "
-        "        AND (e.projects_id = r.repo_group_id "
-        "            OR e.projects_id = 0)) "
-        "    OR (a.cmt_author_email LIKE CONCAT('%%',e.domain) "
-        "        AND (e.projects_id = r.repo_group_id "
-        "        OR e.projects_id = 0)) "
-        "WHERE e.email IS NULL " 
-        "AND e.domain IS NULL " 
-        "AND p.rg_recache = 1 "
-        "GROUP BY week, "
-        "year, "
-        "affiliation, "
-        f"a.cmt_{report_attribution}_email, "
-        "r.repo_group_id, info.a, info.b, info.c")
-        ).bindparams(tool_source=session.tool_source,tool_version=session.tool_version,data_source=session.data_source)
+    session.log_activity('Verbose','Refreshing caches of analyzed repos')
 
-    session.execute_sql(cache_projects_by_week)
+    refreshed_repos = refresh_analyzed_repo_caches(session, report_attribution, report_date)
 
-    cache_projects_by_month = s.sql.text(
-        ("INSERT INTO dm_repo_group_monthly (repo_group_id, email, affiliation, month, year, added, removed, whitespace, files, patches, tool_source, tool_version, data_source) "
-        "SELECT r.repo_group_id AS repo_group_id, "
-        f"a.cmt_{report_attribution}_email AS email, "
-        f"a.cmt_{report_attribution}_affiliation AS affiliation, "
-        f"date_part('month', TO_TIMESTAMP(a.cmt_{report_date}_date, 'YYYY-MM-DD')) AS month, "
-        f"date_part('year', TO_TIMESTAMP(a.cmt_{report_date}_date, 'YYYY-MM-DD')) AS year, "
-        "SUM(a.cmt_added) AS added, "
-        "SUM(a.cmt_removed) AS removed, "
-        "SUM(a.cmt_whitespace) AS whitespace, "
-        "COUNT(DISTINCT a.cmt_filename) AS files, "
-        "COUNT(DISTINCT a.cmt_commit_hash) AS patches,"
-        "info.a AS tool_source, info.b AS tool_version, info.c AS data_source "
-        "FROM (VALUES(:tool_source,:tool_version,:data_source)) info(a,b,c), "
-        "commits a "
-        "JOIN repo r ON r.repo_id = a.repo_id "
-        "JOIN repo_groups p ON p.repo_group_id = r.repo_group_id "
-        "LEFT JOIN exclude e ON "
-        "    (a.cmt_author_email = e.email "
-        "        AND (e.projects_id = r.repo_group_id "
-        "            OR e.projects_id = 0)) "
-        "    OR (a.cmt_author_email LIKE CONCAT('%%',e.domain) "
-        "        AND (e.projects_id = r.repo_group_id "
-        "        OR e.projects_id = 0)) "
-        "WHERE e.email IS NULL "
-        "AND e.domain IS NULL "
-        "AND p.rg_recache = 1 "
-        "GROUP BY month, "
-        "year, "
-        "affiliation, "
-        f"a.cmt_{report_attribution}_email,"
-        "r.repo_group_id, info.a, info.b, info.c"
-        )).bindparams(tool_source=session.tool_source,tool_version=session.tool_version,data_source=session.data_source)
+    # Record which analysis and which commits were refreshed for each repo, so the next refresh starts from there.
+    # These are the dates of the rows that were read, so no commit is missed because of the clock or a late transaction
 
-    session.execute_sql(cache_projects_by_month)
+    mark_refreshed = s.sql.text("""INSERT INTO analysis_log (repos_id, status, date_attempted)
+        SELECT repo_id, :status, date_attempted
+        FROM UNNEST(CAST(:repo_ids AS INTEGER[]), CAST(:dates AS TIMESTAMP[])) AS refreshed(repo_id, date_attempted)""")
 
-    cache_projects_by_year = s.sql.text((
-        "INSERT INTO dm_repo_group_annual (repo_group_id, email, affiliation, year, added, removed, whitespace, files, patches, tool_source, tool_version, data_source) "
-        "SELECT r.repo_group_id AS repo_group_id, "
-        f"a.cmt_{report_attribution}_email AS email, "
-        f"a.cmt_{report_attribution}_affiliation AS affiliation, "
-        f"date_part('year', TO_TIMESTAMP(a.cmt_{report_date}_date, 'YYYY-MM-DD')) AS year, "
-        "SUM(a.cmt_added) AS added, "
-        "SUM(a.cmt_removed) AS removed, "
-        "SUM(a.cmt_whitespace) AS whitespace, "
-        "COUNT(DISTINCT a.cmt_filename) AS files, "
-        "COUNT(DISTINCT a.cmt_commit_hash) AS patches,"
-        "info.a AS tool_source, info.b AS tool_version, info.c AS data_source "
-        "FROM (VALUES(:tool_source,:tool_version,:data_source)) info(a,b,c), "
-        "commits a "
-        "JOIN repo r ON r.repo_id = a.repo_id "
-        "JOIN repo_groups p ON p.repo_group_id = r.repo_group_id "
-        "LEFT JOIN exclude e ON "
-        "    (a.cmt_author_email = e.email "
-        "        AND (e.projects_id = r.repo_group_id "
-        "            OR e.projects_id = 0)) "
-        "    OR (a.cmt_author_email LIKE CONCAT('%%',e.domain) "
-        "        AND (e.projects_id = r.repo_group_id "
-        "        OR e.projects_id = 0)) "
-        "WHERE e.email IS NULL "
-        "AND e.domain IS NULL "
-        "AND p.rg_recache = 1 "
-        "GROUP BY year, "
-        "affiliation, "
-        f"a.cmt_{report_attribution}_email,"
-        "r.repo_group_id, info.a, info.b, info.c"
+    for status, date_key in ((CACHE_REFRESHED_STATUS, 'last_analyzed'), (CACHE_WATERMARK_STATUS, 'refreshed_through')):
 
-        
-        
-        )).bindparams(tool_source=session.tool_source,tool_version=session.tool_version,data_source=session.data_source)
+        marked_repos = [repo for repo in recache_repos + refreshed_repos if repo[date_key] is not None]
 
-     
-     
+        session.execute_sql(mark_refreshed.bindparams(status=status,
+            repo_ids=[repo['repo_id'] for repo in marked_repos], dates=[repo[date_key] for repo in marked_repos]))
 
-    session.execute_sql(cache_projects_by_year)
-    # Start caching by repo
+    # Reset cache flags
 
-    session.log_activity('Verbose','Caching repos')
+    reset_recache = s.sql.text("UPDATE repo_groups SET rg_recache = 0")
+    session.execute_sql(reset_recache)
 
-    cache_repos_by_week = s.sql.text(
-        (
-        "INSERT INTO dm_repo_weekly (repo_id, email, affiliation, week, year, added, removed, whitespace, files, patches, tool_source, tool_version, data_source) "
-        "SELECT a.repo_id AS repo_id, "
-        f"a.cmt_{report_attribution}_email AS email, "
-        f"a.cmt_{report_attribution}_affiliation AS affiliation, "
-        f"date_part('week', TO_TIMESTAMP(a.cmt_{report_date}_date, 'YYYY-MM-DD')) AS week, "
-        f"date_part('year', TO_TIMESTAMP(a.cmt_{report_date}_date, 'YYYY-MM-DD')) AS year, "
-        "SUM(a.cmt_added) AS added, "
-        "SUM(a.cmt_removed) AS removed, "
-        "SUM(a.cmt_whitespace) AS whitespace, "
-        "COUNT(DISTINCT a.cmt_filename) AS files, "
-        "COUNT(DISTINCT a.cmt_commit_hash) AS patches,"
-        "info.a AS tool_source, info.b AS tool_version, info.c AS data_source "
-        "FROM (VALUES(:tool_source,:tool_version,:data_source)) info(a,b,c), "
-        "commits a "
-        "JOIN repo r ON r.repo_id = a.repo_id "
-        "JOIN repo_groups p ON p.repo_group_id = r.repo_group_id "
-        "LEFT JOIN exclude e ON "
-        "    (a.cmt_author_email = e.email "
-        "        AND (e.projects_id = r.repo_group_id "
-        "            OR e.projects_id = 0)) "
-        "    OR (a.cmt_author_email LIKE CONCAT('%%',e.domain) "
-        "        AND (e.projects_id = r.repo_group_id "
-        "        OR e.projects_id = 0)) "
-        "WHERE e.email IS NULL "
-        "AND e.domain IS NULL "
-        "AND p.rg_recache = 1 "
-        "GROUP BY week, "
-        "year, "
-        "affiliation, "
-        f"a.cmt_{report_attribution}_email,"
-        "a.repo_id, info.a, info.b, info.c"
-        )).bindparams(tool_source=session.tool_source,tool_version=session.tool_version,data_source=session.data_source)
+    # The cached metric responses are read from these caches, so they are stale once the caches are refreshed
 
-    session.execute_sql(cache_repos_by_week)
+    invalidate_all_metric_cache()
 
-    cache_repos_by_month = s.sql.text((
-        "INSERT INTO dm_repo_monthly (repo_id, email, affiliation, month, year, added, removed, whitespace, files, patches, tool_source, tool_version, data_source)"
-        "SELECT a.repo_id AS repo_id, "
-        f"a.cmt_{report_attribution}_email AS email, "
-        f"a.cmt_{report_attribution}_affiliation AS affiliation, "
-        f"date_part('month', TO_TIMESTAMP(a.cmt_{report_date}_date, 'YYYY-MM-DD')) AS month, "
-        f"date_part('year', TO_TIMESTAMP(a.cmt_{report_date}_date, 'YYYY-MM-DD')) AS year, "
-        "SUM(a.cmt_added) AS added, "
-        "SUM(a.cmt_removed) AS removed, "
-        "SUM(a.cmt_whitespace) AS whitespace, "
-        "COUNT(DISTINCT a.cmt_filename) AS files, "
-        "COUNT(DISTINCT a.cmt_commit_hash) AS patches, "
-        "info.a AS tool_source, info.b AS tool_version, info.c AS data_source "
-        "FROM (VALUES(:tool_source,:tool_version,:data_source)) info(a,b,c), "
-        "commits a "
-        "JOIN repo r ON r.repo_id = a.repo_id "
-        "JOIN repo_groups p ON p.repo_group_id = r.repo_group_id "
-        "LEFT JOIN exclude e ON "
-        "    (a.cmt_author_email = e.email "
-        "        AND (e.projects_id = r.repo_group_id "
-        "            OR e.projects_id = 0)) "
-        "    OR (a.cmt_author_email LIKE CONCAT('%%',e.domain) "
-        "        AND (e.projects_id = r.repo_group_id "
-        "        OR e.projects_id = 0)) "
-        "WHERE e.email IS NULL "
-        "AND e.domain IS NULL "
-        "AND p.rg_recache = 1 "
-        "GROUP BY month, "
-        "year, "
-        "affiliation, "
-        f"a.cmt_{report_attribution}_email,"
-        "a.repo_id, info.a, info.b, info.c"
-        )).bindparams(tool_source=session.tool_source,tool_version=session.tool_version,data_source=session.data_source)
+    session.log_activity('Info','Caching unknown affiliations and web data for display (complete)')
+
+def refresh_analyzed_repo_caches(session, report_attribution, report_date):
+
+# Recompute the caches of the repos that facade analyzed since their caches were
+# last refreshed, which is tracked in the analysis log. Only the years that
+# have commits added since then are recomputed, for the repo and its repo group.
+# Each repo and repo group is replaced in its own transaction, so the caches are
+# never seen partly deleted. Returns the repos that were refreshed, with the date
+# of the analysis and the newest data_collection_date of the commits that were refreshed.
+
+    get_analyzed_repos = s.sql.text("""SELECT r.repo_id, r.repo_group_id, l.last_analyzed, l.refreshed_through
+        FROM repo r
+        JOIN repo_groups p ON p.repo_group_id = r.repo_group_id
+        JOIN (
+            SELECT repos_id,
+                MAX(date_attempted) FILTER (WHERE status = 'Complete') AS last_analyzed,
+                MAX(date_attempted) FILTER (WHERE status = :status) AS last_refreshed,
+                MAX(date_attempted) FILTER (WHERE status = :watermark_status) AS refreshed_through
+            FROM analysis_log
+            GROUP BY repos_id
+        ) l ON l.repos_id = r.repo_id
+        WHERE p.rg_recache = 0
+        AND l.last_analyzed IS NOT NULL
+        AND (l.last_refreshed IS NULL OR l.last_analyzed > l.last_refreshed)""").bindparams(
+        status=CACHE_REFRESHED_STATUS, watermark_status=CACHE_WATERMARK_STATUS)
+
+    analyzed_repos = session.fetchall_data_from_sql_text(get_analyzed_repos)
+
+    session.log_activity('Debug',f"Refreshing caches of {len(analyzed_repos)} analyzed repos")
+
+    report_year = f"date_part('year', TO_TIMESTAMP(a.cmt_{report_date}_date, 'YYYY-MM-DD'))"
+    in_years = f"{report_year} = ANY(CAST(:years AS DOUBLE PRECISION[]))"
+
+    repo_group_years = {}
+
+    for repo in analyzed_repos:
+
+        # A repo that was never refreshed gets all of its years recomputed. The commits that were
+        # collected in the same second as the watermark are included again, since recomputing a year is idempotent
+        get_years = s.sql.text(f"""SELECT {report_year} AS year, MAX(a.data_collection_date) AS collected
+            FROM commits a
+            WHERE a.repo_id = :repo_id
+            AND (CAST(:since AS TIMESTAMP) IS NULL OR a.data_collection_date >= :since)
+            GROUP BY 1""").bindparams(repo_id=repo['repo_id'], since=repo['refreshed_through'])
+
+        year_rows = session.fetchall_data_from_sql_text(get_years)
+
+        years = [int(row['year']) for row in year_rows if row['year'] is not None]
+
+        if year_rows:
+            repo['refreshed_through'] = max(row['collected'] for row in year_rows)
+
+        if not years:
+            continue
+
+        repo_group_years.setdefault(repo['repo_group_id'], set()).update(years)
+
+        with session.engine.begin() as connection:
+
+            for period in CACHE_PERIODS:
+
+                connection.execute(s.sql.text(f"""DELETE FROM dm_repo_{period}
+                    WHERE repo_id = :repo_id
+                    AND year = ANY(CAST(:years AS INTEGER[]))""").bindparams(repo_id=repo['repo_id'], years=years))
+
+                connection.execute(build_dm_cache_sql(session, 'repo', period, report_attribution, report_date,
+                    f"a.repo_id = :repo_id AND {in_years}").bindparams(repo_id=repo['repo_id'], years=years))
 
-    session.execute_sql(cache_repos_by_month)
+    for repo_group_id, years in repo_group_years.items():
 
-    cache_repos_by_year = s.sql.text((
-        "INSERT INTO dm_repo_annual (repo_id, email, affiliation, year, added, removed, whitespace, files, patches, tool_source, tool_version, data_source)"
-        "SELECT a.repo_id AS repo_id, "
+        years = sorted(years)
+
+        with session.engine.begin() as connection:
+
+            for period in CACHE_PERIODS:
+
+                connection.execute(s.sql.text(f"""DELETE FROM dm_repo_group_{period}
+                    WHERE repo_group_id = :repo_group_id
+                    AND year = ANY(CAST(:years AS INTEGER[]))""").bindparams(repo_group_id=repo_group_id, years=years))
+
+                connection.execute(build_dm_cache_sql(session, 'repo_group', period, report_attribution, report_date,
+                    f"r.repo_group_id = :repo_group_id AND {in_years}").bindparams(repo_group_id=repo_group_id, years=years))
+
+            # The unknown cache is not split by period, so the whole repo group is recomputed
+
+            connection.execute(s.sql.text("""DELETE FROM unknown_cache
+                WHERE repo_group_id = :repo_group_id""").bindparams(repo_group_id=repo_group_id))
+
+            for attribution in ('author','committer'):
+                connection.execute(build_unknown_cache_sql(session, attribution,
+                    "r.repo_group_id = :repo_group_id").bindparams(repo_group_id=repo_group_id))
+
+    return analyzed_repos
+
+def build_unknown_cache_sql(session, attribution, scope):
+
+# Build the insert of the emails with an (Unknown) affiliation of the commits that scope selects
+
+    return s.sql.text(f"""INSERT INTO unknown_cache (type, repo_group_id, email, domain, added, tool_source, tool_version, data_source)
+        SELECT '{attribution}', 
+        r.repo_group_id, 
+        a.cmt_{attribution}_email, 
+        SPLIT_PART(a.cmt_{attribution}_email,'@',2), 
+        SUM(a.cmt_added),
+        info.a AS tool_source, info.b AS tool_version, info.c AS data_source
+        FROM (VALUES(:tool_source,:tool_version,:data_source)) info(a,b,c), 
+        commits a 
+        JOIN repo r ON r.repo_id = a.repo_id 
+        JOIN repo_groups p ON p.repo_group_id = r.repo_group_id 
+        WHERE a.cmt_{attribution}_affiliation = '(Unknown)' 
+        AND {scope} 
+        GROUP BY r.repo_group_id,a.cmt_{attribution}_email, info.a, info.b, info.c
+        """).bindparams(tool_source=session.tool_source,tool_version=session.tool_version,data_source=session.data_source)
+
+def build_dm_cache_sql(session, level, period, report_attribution, report_date, scope):
+
+# Build the insert of the dm_repo_* or dm_repo_group_* cache of a period for the
+# commits that scope selects. level is either repo or repo_group.
+
+    period_columns = CACHE_PERIODS[period]
+
+    level_id = "a.repo_id" if level == 'repo' else "r.repo_group_id"
+
+    period_select = "".join(f"date_part('{column}', TO_TIMESTAMP(a.cmt_{report_date}_date, 'YYYY-MM-DD')) AS {column}, " for column in period_columns)
+
+    return s.sql.text((
+        f"INSERT INTO dm_{level}_{period} ({level}_id, email, affiliation, {', '.join(period_columns)}, added, removed, whitespace, files, patches, tool_source, tool_version, data_source) "
+        f"SELECT {level_id} AS {level}_id, "
         f"a.cmt_{report_attribution}_email AS email, "
         f"a.cmt_{report_attribution}_affiliation AS affiliation, "
-        f"date_part('year', TO_TIMESTAMP(a.cmt_{report_date}_date, 'YYYY-MM-DD')) AS year, "
+        f"{period_select}"
         "SUM(a.cmt_added) AS added, "
         "SUM(a.cmt_removed) AS removed, "
         "SUM(a.cmt_whitespace) AS whitespace, "
@@ -763,19 +661,9 @@ def rebuild_unknown_affiliation_and_web_caches(session):
         "        OR e.projects_id = 0)) "
         "WHERE e.email IS NULL "
         "AND e.domain IS NULL "
-        "AND p.rg_recache = 1 "
-        "GROUP BY year, "
+        f"AND {scope} "
+        f"GROUP BY {', '.join(period_columns)}, "
         "affiliation, "
-        f"a.cmt_{report_attribution}_email,"
-        "a.repo_id, info.a, info.b, info.c"
+        f"a.cmt_{report_attribution}_email, "
+        f"{level_id}, info.a, info.b, info.c"
         )).bindparams(tool_source=session.tool_source,tool_version=session.tool_version,data_source=session.data_source)
-
-    session.execute_sql(cache_repos_by_year)
-
-    # Reset cache flags
-
-    reset_recache = s.sql.text("UPDATE repo_groups SET rg_recache = 0")
-    session.execute_sql(reset_recache)
-
-    session.log_activity('Info','Caching unknown affiliations and web data for display (complete)')
-
@@ -38,17 +38,39 @@ import xlsxwriter
 import configparser
 import pathlib
 import sqlalchemy as s
-from .utilitymethods import update_repo_log, trim_commits, store_working_author, trim_author, get_absolute_repo_path
+from .utilitymethods import update_repo_log, trim_commits, store_working_author, trim_author, get_absolute_repo_path, get_head_commit
 from augur.application.db.models.augur_data import *
 from augur.application.db.models.augur_operations import CollectionStatus
 from augur.application.db.util import execute_session_query, convert_orm_list_to_dict_list
 
+# seconds to wait for the remote HEAD before falling back to a pull
+LS_REMOTE_TIMEOUT = 60
+
 class GitCloneError(Exception):
     pass
 
+def get_git_object_bytes(repo_path):
+
+    # Get the size of the objects in a repo, which is about the number of bytes
+    # its clone fetched. Returns None if git can't count them.
+
+    count_objects = subprocess.run(["git", "-C", repo_path, "count-objects", "-v"], capture_output=True, text=True)
+
+    if count_objects.returncode != 0:
+        return None
+
+    object_kib = 0
+    for line in count_objects.stdout.splitlines():
+        name, _, value = line.partition(":")
+        if name in ("size", "size-pack"):
+            object_kib += int(value)
+
+    return object_kib * 1024
+
 def git_repo_initialize(session, repo_git):
 
-    # Select any new git repos so we can set up their locations and git clone
+    # Select any new git repos so we can set up their locations and git clone.
+    # Returns the clone duration and fetched bytes when the repo was cloned.
 
     session.update_status('Fetching non-cloned repos')
     session.log_activity('Info', 'Fetching non-cloned repos')
@@ -154,8 +176,21 @@ def git_repo_initialize(session, repo_git):
 
         session.log_activity('Verbose', f"Cloning: {git}")
 
-        cmd = f"git -C {repo_path} clone '{git}' {repo_name}"
-        return_code = subprocess.Popen([cmd], shell=True).wait()
+        clone_options = []
+        if session.partial_clone and session.run_analysis:
+            # git log -p in the commit analysis needs the files of every past commit, which a partial
+            # clone fetches lazily one commit at a time (and fails to fetch offline), so it is only used without analysis
+            session.log_activity('Info', f"Not using a partial clone for {git}, because its commits are analyzed")
+
+        elif session.partial_clone:
+            # Only the files of the checked out commit are fetched, which is all scc and dependency analysis need
+            clone_options.append("--filter=blob:none")
+
+        clone_start = time.monotonic()
+
+        return_code = subprocess.Popen(["git", "-C", repo_path, "clone", *clone_options, git, repo_name]).wait()
+
+        clone_duration = time.monotonic() - clone_start
 
         if (return_code == 0):
             # If cloning succeeded, repo is ready for analysis
@@ -164,6 +199,16 @@ def git_repo_initialize(session, repo_git):
             update_repo_log(session, row.repo_id, 'Up-to-date')
             session.log_activity('Info', f"Cloned {git}")
 
+            clone_metrics = {
+                "repo_id": row.repo_id,
+                "duration": clone_duration,
+                "fetched_bytes": get_git_object_bytes(f"{repo_path}/{repo_name}")
+            }
+
+            session.logger.info(f"Cloned {git} in {clone_duration:.1f} seconds, fetched {clone_metrics['fetched_bytes']} bytes")
+
+            return clone_metrics
+
         else:
             # If cloning failed, log it and set the status back to new
             update_repo_log(session, row.repo_id, f"Failed ({return_code})")
@@ -281,6 +326,23 @@ def force_repo_analysis(session, repo_git):
     session.log_activity('Info', 'Forcing repos to be analyzed (complete)')
 
 
+def get_remote_head(absolute_path):
+
+    # Get the hash of the remote HEAD without fetching anything.
+    # Returns None if the remote can't be reached, so the repo is pulled.
+    # Git is not allowed to prompt for credentials, which would hang the check.
+
+    try:
+        ls_remote = subprocess.run(["git", "-C", absolute_path, "ls-remote", "origin", "HEAD"], capture_output=True,
+            text=True, timeout=LS_REMOTE_TIMEOUT, env={**os.environ, "GIT_TERMINAL_PROMPT": "0"})
+    except (subprocess.TimeoutExpired, OSError):
+        return None
+
+    if ls_remote.returncode != 0 or not ls_remote.stdout.strip():
+        return None
+
+    return ls_remote.stdout.split()[0]
+
 def git_repo_updates(session, repo_git):
 
     # Update existing repos
@@ -320,6 +382,16 @@ def git_repo_updates(session, repo_git):
     absolute_path = get_absolute_repo_path(
         session.repo_base_directory, row["repo_id"], row['repo_path'],row['repo_name'])
 
+    # Asking the remote for its HEAD is much cheaper than a pull, so repos
+    # that have not changed since the last update are skipped
+    remote_head = get_remote_head(absolute_path)
+
+    if remote_head and remote_head == get_head_commit(f"{absolute_path}/.git"):
+
+        update_repo_log(session, row['repo_id'], 'Up-to-date')
+        session.log_activity('Verbose', f"{row['repo_git']} has not changed since the last update")
+        return
+
     while attempt < 2:
 
         try:
@@ -43,8 +43,12 @@ from .config import get_database_args_from_env
 from augur.application.db.models import *
 from .config import FacadeSession as FacadeSession
 from augur.tasks.util.worker_util import calculate_date_weight_from_timestamps
+from .commitset import CommitHashSet
 #from augur.tasks.git.util.facade_worker.facade
 
+# rows fetched from the server at a time when streaming the existing commits of a repo
+EXISTING_COMMITS_BATCH_SIZE = 10000
+
 def update_repo_log(session, repos_id,status):
 
 # Log a repo's fetch status
@@ -80,10 +84,50 @@ def trim_commits(session, repo_id,commits):
 		
 		session.execute_sql(remove_commit)
 
+		# The caches can't be refreshed incrementally once commits are removed,
+		# so the repo group is rebuilt in full
+		recache_repo_group = s.sql.text("""UPDATE repo_groups SET rg_recache = 1
+			WHERE repo_group_id = (SELECT repo_group_id FROM repo WHERE repo_id = :repo_id)
+			""").bindparams(repo_id=repo_id)
+
+		session.execute_sql(recache_repo_group)
+
 	for commit in commits:
 		session.log_activity('Debug',f"Trimmed commit: {commit}")
 		session.log_activity('Debug',f"Removed working commit: {commit}")
 
+def store_working_commits(session, repo_id, commits):
+
+# Stash a batch of commits before their records are inserted, so they can be
+# backed out by trim_commits if the insert is interrupted.
+
+	if not len(commits):
+		return
+
+	store_commits = s.sql.text("""INSERT INTO working_commits (repos_id,working_commit)
+		SELECT :repo_id, UNNEST(CAST(:hashes AS VARCHAR[]))
+		""").bindparams(repo_id=repo_id,hashes=list(commits))
+
+	session.execute_sql(store_commits)
+
+	session.log_activity('Debug',f"Stored {len(commits)} working commits")
+
+def remove_working_commits(session, repo_id, commits):
+
+# Remove a batch of working commits once all of their records are inserted.
+
+	if not len(commits):
+		return
+
+	remove_commits = s.sql.text("""DELETE FROM working_commits
+		WHERE repos_id = :repo_id
+		AND working_commit = ANY(CAST(:hashes AS VARCHAR[]))
+		""").bindparams(repo_id=repo_id,hashes=list(commits))
+
+	session.execute_sql(remove_commits)
+
+	session.log_activity('Debug',f"Removed {len(commits)} working commits")
+
 def store_working_author(session, email):
 
 # Store the working author during affiliation discovery, in case it is
@@ -144,14 +188,123 @@ def get_parent_commits_set(absolute_repo_path, start_date):
 	return parent_commits
 
 
-def get_existing_commits_set(session, repo_id):
+def get_head_commit(absolute_repo_path):
+
+# Get the hash of HEAD, or None if the repo has no commits.
+
+	head = subprocess.run(["git", "--git-dir", absolute_repo_path, "rev-parse", "--verify", "--quiet", "HEAD"],
+		capture_output=True, text=True)
+
+	if head.returncode != 0:
+		return None
+
+	return head.stdout.strip()
+
+def is_ancestor_commit(absolute_repo_path, ancestor, commit):
+
+# Check whether HEAD only moved forward since ancestor, so the commits between
+# them are all that changed. This is false when ancestor was rewritten away by
+# a force push or is no longer in the repo.
+
+	is_ancestor = subprocess.run(["git", "--git-dir", absolute_repo_path, "merge-base", "--is-ancestor", ancestor, commit],
+		capture_output=True)
+
+	return is_ancestor.returncode == 0
+
+def get_new_commits_set(absolute_repo_path, last_commit, start_date):
+
+# Get the commits that were added since last_commit, instead of every parent of HEAD.
+
+	new_commits = subprocess.run(["git", "--git-dir", absolute_repo_path, "log", "--pretty=format:%H",
+		f"--since={start_date}", f"{last_commit}..HEAD"], capture_output=True)
+
+	new_commits = set(new_commits.stdout.decode("utf-8",errors="ignore").split(os.linesep))
+
+	if '' in new_commits:
+		new_commits.remove('')
+
+	return new_commits
+
+def get_last_analyzed_commit(session, repo_id):
+
+	query = s.select(CollectionStatus.facade_last_analyzed_sha).where(CollectionStatus.repo_id == repo_id)
+
+	return session.execute(query).scalar()
+
+def update_last_analyzed_commit(session, repo_id, commit):
+
+	update_query = (
+		s.update(CollectionStatus)
+		.where(CollectionStatus.repo_id == repo_id)
+		.values(facade_last_analyzed_sha=commit)
+	)
+
+	session.execute(update_query)
+	session.commit()
+
+	session.log_activity('Debug',f"Stored last analyzed commit of repo {repo_id}: {commit}")
+
+def get_missing_commits_set(session, repo_id, absolute_repo_path, start_date, since_commit=None, shard=None, shard_count=1):
+
+# Get the commits of a repo that are not in the database yet. If since_commit
+# is passed, only the commits added after it are looked at, since HEAD only
+# moved forward from it. If shard is passed, only the commits get_commit_shard
+# gives to it are returned.
+
+	if since_commit:
+		commits = get_new_commits_set(absolute_repo_path, since_commit, start_date)
+	else:
+		commits = get_parent_commits_set(absolute_repo_path, start_date)
+
+	if shard is not None:
+		commits = {commit for commit in commits if get_commit_shard(commit, shard_count) == shard}
+
+	# The whole history of a repo is compared to all of its stored commits,
+	# instead of looking up every hash in it
+	if not since_commit:
+		return commits - get_existing_commits_set(session, repo_id)
+
+	return commits - get_existing_commits_set(session, repo_id, commits)
+
+def get_commit_shard(commit, shard_count):
+
+# Get which of shard_count shards a commit is analyzed by. It only depends on
+# the hash, so each shard task can recompute its own commits instead of being
+# sent them, and the shards get about the same number of commits.
+
+	return int(commit[:8], 16) % shard_count
+
+def get_existing_commits_set(session, repo_id, commits=None):
+
+# Get the commits of a repo that are in the database. If commits is passed,
+# only those commits are looked up instead of the repo's whole history.
+
+	if commits is not None:
+
+		if not len(commits):
+			return set()
+
+		find_existing = s.sql.text("""SELECT DISTINCT cmt_commit_hash FROM commits WHERE repo_id=:repo_id
+			AND cmt_commit_hash IN :hashes""").bindparams(repo_id=repo_id,hashes=tuple(commits))
+
+	else:
+
+		find_existing = s.sql.text("""SELECT DISTINCT cmt_commit_hash FROM commits WHERE repo_id=:repo_id
+			""").bindparams(repo_id=repo_id)
+
+	# The hashes are streamed from a server side cursor into a set that stores them
+	# as bytes, so the repo's rows are never all in memory as dicts at once.
+	# The query is an index only scan of the repo_id,commit index.
+	existing_commits = CommitHashSet()
+
+	with session.engine.connect() as connection:
 
-	find_existing = s.sql.text("""SELECT DISTINCT cmt_commit_hash FROM commits WHERE repo_id=:repo_id
-		""").bindparams(repo_id=repo_id)
+		result = connection.execution_options(stream_results=True, yield_per=EXISTING_COMMITS_BATCH_SIZE).execute(find_existing)
 
-	existing_commits = [commit['cmt_commit_hash'] for commit in session.fetchall_data_from_sql_text(find_existing)]
+		for commit_hash in result.scalars():
+			existing_commits.add(commit_hash)
 
-	return set(existing_commits)
+	return existing_commits
 
 
 def count_branches(git_dir):
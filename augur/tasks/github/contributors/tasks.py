@@ -71,7 +71,7 @@ def retrieve_dict_data(url: str, key_auth, logger):
     num_attempts = 0
     while num_attempts <= 10:
 
-        response = hit_api(key_auth, url, logger)
+        response = hit_api(key_auth, url, logger, use_etag_cache=True)
 
         # increment attempts
         if response is None:
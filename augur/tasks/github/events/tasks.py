@@ -2,22 +2,23 @@ import time
 import logging
 import traceback
 import sqlalchemy as s
+from typing import Generator, List
 
 from augur.tasks.init.celery_app import celery_app as celery
 from augur.tasks.init.celery_app import AugurCoreRepoCollectionTask
 from augur.application.db.data_parse import *
-from augur.tasks.github.util.github_paginator import GithubPaginator, hit_api
+from augur.tasks.github.util.github_paginator import GithubPaginator, hit_api, DEFAULT_PAGE_BATCH_SIZE
 from augur.tasks.github.util.github_task_session import GithubTaskManifest
 from augur.application.db.session import DatabaseSession
-from augur.tasks.github.util.util import get_owner_repo
+from augur.tasks.github.util.util import get_owner_repo, parse_github_timestamp, get_newest_timestamp
 from augur.tasks.util.worker_util import remove_duplicate_dicts
-from augur.application.db.models import PullRequest, Message, PullRequestReview, PullRequestLabel, PullRequestReviewer, PullRequestEvent, PullRequestMeta, PullRequestAssignee, PullRequestReviewMessageRef, Issue, IssueEvent, IssueLabel, IssueAssignee, PullRequestMessageRef, IssueMessageRef, Contributor, Repo
+from augur.application.db.models import PullRequest, Message, PullRequestReview, PullRequestLabel, PullRequestReviewer, PullRequestEvent, PullRequestMeta, PullRequestAssignee, PullRequestReviewMessageRef, Issue, IssueEvent, IssueLabel, IssueAssignee, PullRequestMessageRef, IssueMessageRef, Contributor, Repo, CollectionStatus
 from augur.application.db.util import execute_session_query
 
 platform_id = 1
 
 @celery.task(base=AugurCoreRepoCollectionTask)
-def collect_events(repo_git: str):
+def collect_events(repo_git: str, full_collection: bool = False):
 
     logger = logging.getLogger(collect_events.__name__)
     
@@ -37,19 +38,43 @@ def collect_events(repo_git: str):
 
             url = f"https://api.github.com/repos/{owner}/{repo}/issues/events"
 
-            event_data = retrieve_all_event_data(repo_git, logger, manifest.key_auth)
+            # only events created since the last run are collected unless a full collection is requested
+            since = None
+            if not full_collection:
+                since = CollectionStatus.get_last_collected(augur_db.session, repo_id, "event_last_collected")
 
-            if event_data:
+            # the events are inserted a batch of pages at a time, so memory use does not grow with the size of the repo
+            event_count = 0
+            skipped_count = 0
+            newest_event = None
+            for event_data in retrieve_all_event_data(repo_git, logger, manifest.key_auth, since):
             
-                process_events(event_data, f"{owner}/{repo}: Event task", repo_id, logger, manifest.augur_db)
+                skipped_count += process_events(event_data, f"{owner}/{repo}: Event task", repo_id, logger, manifest.augur_db)
+
+                event_count += len(event_data)
+                batch_newest = get_newest_timestamp(event_data, "created_at")
+                if batch_newest and (newest_event is None or batch_newest > newest_event):
+                    newest_event = batch_newest
+
+            # the mark is only moved once every batch is inserted, so a failed run is collected again
+            if event_count:
+
+                update_issue_closed_cntrbs_from_events(augur_db.engine, repo_id)
+
+                # events are skipped when their issue or pr is not collected yet, so they are collected again next run
+                if skipped_count:
+                    logger.info(f"{owner}/{repo}: {skipped_count} events were skipped, so the last collected date is not updated")
+                else:
+                    CollectionStatus.update_last_collected(augur_db.session, repo_id, "event_last_collected", newest_event)
 
             else:
-                logger.info(f"{owner}/{repo} has no events")
+                logger.info(f"{owner}/{repo} has no new events")
         except Exception as e:
             logger.error(f"Could not collect events for {repo_git}\n Reason: {e} \n Traceback: {''.join(traceback.format_exception(None, e, e.__traceback__))}")
 
 
-def retrieve_all_event_data(repo_git: str, logger, key_auth):
+def retrieve_all_event_data(repo_git: str, logger, key_auth, since=None, batch_size=DEFAULT_PAGE_BATCH_SIZE) -> Generator[List[dict], None, None]:
+    """Yields the issue and pr events of a repo in batches of batch_size pages."""
 
     owner, repo = get_owner_repo(repo_git)
 
@@ -58,29 +83,57 @@ def retrieve_all_event_data(repo_git: str, logger, key_auth):
     url = f"https://api.github.com/repos/{owner}/{repo}/issues/events"
         
     # returns an iterable of all issues at this url (this essentially means you can treat the issues variable as a list of the issues)
-    events = GithubPaginator(url, key_auth, logger)
+    # when collecting incrementally only the newest pages are requested, so unchanged ones are answered with a 304
+    events = GithubPaginator(url, key_auth, logger, use_etag_cache=bool(since))
 
 
     num_pages = events.get_num_pages()
-    all_data = []
-    for page_data, page in events.iter_pages():
+
+    # the events endpoint has no since param, but it returns the newest events first. 
+    # So only the next page is fetched ahead and we stop at the first event older than since
+    if since:
+        logger.info(f"Collecting Github events for {owner}/{repo} created since {since}")
+        pages = events.iter_pages_concurrently(concurrency=1, num_pages=num_pages)
+    else:
+        pages = events.iter_pages_concurrently(num_pages=num_pages)
+
+    batch = []
+    batch_pages = 0
+    for page_data, page in pages:
 
         if page_data is None:
-            return all_data
+            break
             
         elif len(page_data) == 0:
             logger.debug(f"{repo.capitalize()} Events Page {page} contains no data...returning")
             logger.info(f"Events Page {page} of {num_pages}")
-            return all_data
+            break
 
         logger.info(f"{repo} Events Page {page} of {num_pages}")
 
-        all_data += page_data
+        if since:
+            new_events = [event for event in page_data if parse_github_timestamp(event["created_at"]) >= since]
+            batch += new_events
 
-    return all_data        
+            if len(new_events) < len(page_data):
+                logger.info(f"{repo}: Reached events that were created before {since}")
+                break
+        else:
+            batch += page_data
+
+        batch_pages += 1
+
+        if batch_pages >= batch_size:
+            yield batch
+            batch = []
+            batch_pages = 0
+
+    if batch:
+        yield batch
+
+def process_events(events, task_name, repo_id, logger, augur_db) -> int:
+    """Insert a batch of events and return the number that were skipped because their issue or pr was not found."""
 
-def process_events(events, task_name, repo_id, logger, augur_db):
-    
     tool_source = "Github events task"
     tool_version = "2.0"
     data_source = "Github API"
@@ -90,19 +143,35 @@ def process_events(events, task_name, repo_id, logger, augur_db):
     contributors = []
 
 
+    # only the issues and prs the events belong to are looked up, so the maps are the size of the batch and not the repo
+    related_issue_urls = set()
+    related_pr_urls = set()
+    for event in events:
+
+        event_mapping_data = event["issue"]
+        if event_mapping_data is None:
+            continue
+
+        pull_request = event_mapping_data.get('pull_request', None)
+        if pull_request:
+            related_pr_urls.add(pull_request["url"])
+        else:
+            related_issue_urls.add(event_mapping_data["url"])
+
     # create mapping from issue url to issue id of current issues
     issue_url_to_id_map = {}
-    issues = augur_db.session.query(Issue).filter(Issue.repo_id == repo_id).all()
+    issues = augur_db.session.query(Issue.issue_url, Issue.issue_id).filter(Issue.repo_id == repo_id, Issue.issue_url.in_(related_issue_urls)).all()
     for issue in issues:
         issue_url_to_id_map[issue.issue_url] = issue.issue_id
 
     # create mapping from pr url to pr id of current pull requests
     pr_url_to_id_map = {}
-    prs = augur_db.session.query(PullRequest).filter(PullRequest.repo_id == repo_id).all()
+    prs = augur_db.session.query(PullRequest.pr_url, PullRequest.pull_request_id).filter(PullRequest.repo_id == repo_id, PullRequest.pr_url.in_(related_pr_urls)).all()
     for pr in prs:
         pr_url_to_id_map[pr.pr_url] = pr.pull_request_id
 
     not_mapable_event_count = 0
+    skipped_count = 0
     event_len = len(events)
     for event in events:
 
@@ -128,6 +197,7 @@ def process_events(events, task_name, repo_id, logger, augur_db):
                 logger.info(f"{task_name}: Could not find related pr")
                 logger.info(f"{task_name}: We were searching for: {pr_url}")
                 logger.info(f"{task_name}: Skipping")
+                skipped_count += 1
                 continue
 
             pr_event_dicts.append(
@@ -146,6 +216,7 @@ def process_events(events, task_name, repo_id, logger, augur_db):
                 logger.info(f"{task_name}: Could not find related pr")
                 logger.info(f"{task_name}: We were searching for: {issue_url}")
                 logger.info(f"{task_name}: Skipping")
+                skipped_count += 1
                 continue
 
             issue_event_dicts.append(
@@ -181,7 +252,7 @@ def process_events(events, task_name, repo_id, logger, augur_db):
     issue_event_natural_keys = ["issue_id", "issue_event_src_id"]
     augur_db.insert_data(issue_event_dicts, IssueEvent, issue_event_natural_keys)
 
-    update_issue_closed_cntrbs_from_events(augur_db.engine, repo_id)
+    return skipped_count
 
 # TODO: Should we skip an event if there is no contributor to resolve it o
 def process_github_event_contributors(logger, event, tool_source, tool_version, data_source):
@@ -18,6 +18,8 @@ from augur.tasks.github.util.github_paginator import GithubPaginator, hit_api, p
 import traceback
 from augur.tasks.github.util.github_paginator import GithubApiResult
 from augur.application.db.util import execute_session_query
+from augur.tasks.github.util.gh_graphql_entities import request_graphql_dict
+from augur.tasks.github.util.util import get_owner_repo
 
 ##TODO: maybe have a TaskSession class that holds information about the database, logger, config, etc.
 
@@ -60,7 +62,7 @@ def request_dict_from_endpoint(session, url, timeout_wait=10):
             response_data = json.loads(json.dumps(response.text))
 
         if type(response_data) == dict:
-            err = process_dict_response(session.logger,response,response_data)
+            err = process_dict_response(session.logger,response,response_data,session.oauths)
 
             
             #If we get an error message that's not None
@@ -87,7 +89,7 @@ def request_dict_from_endpoint(session, url, timeout_wait=10):
                     # Sometimes raw text can be converted to a dict
                     response_data = json.loads(response_data)
 
-                    err = process_dict_response(session.logger,response,response_data)
+                    err = process_dict_response(session.logger,response,response_data,session.oauths)
 
                     #If we get an error message that's not None
                     if err and err != GithubApiResult.SUCCESS:
@@ -205,6 +207,41 @@ def insert_alias(logger,db, contributor, email):
     db.insert_data(alias, ContributorsAlias, ['alias_email'])
     
 
+    return
+
+# Bulk version of insert_alias that inserts the aliases of many contributors at once
+#   \param contributors_and_emails list of (contributor, email) tuples
+def insert_aliases(logger,db, contributors_and_emails):
+
+    if not contributors_and_emails:
+        return
+
+    gh_user_ids = {contributor["gh_user_id"] for contributor, _ in contributors_and_emails}
+
+    # One query gets the cntrb_id of every contributor instead of one query per alias
+    query = db.query(Contributor.gh_user_id, Contributor.cntrb_id).filter(Contributor.gh_user_id.in_(gh_user_ids))
+    contributor_table_data = execute_session_query(query, 'all')
+
+    cntrb_ids = {}
+    for row in contributor_table_data:
+        # the first contributor is used when there is more than one, like insert_alias does
+        cntrb_ids.setdefault(row.gh_user_id, row.cntrb_id)
+
+    aliases = []
+    for contributor, email in contributors_and_emails:
+
+        if contributor["gh_user_id"] not in cntrb_ids:
+            logger.error("Couldn't find contributor in database. Something has gone very wrong. Augur ran into a contributor whose login can be found in the contributor's table, but cannot be retrieved via the user_id that was gotten using the same login.")
+            raise LookupError
+
+        aliases.append({
+            "cntrb_id": cntrb_ids[contributor["gh_user_id"]],
+            "alias_email": email,
+            "canonical_email": contributor['cntrb_canonical'] if 'cntrb_canonical' in contributor and contributor['cntrb_canonical'] is not None else email,
+        })
+
+    db.insert_data(aliases, ContributorsAlias, ['alias_email'])
+
     return
 
 # Takes the user data from the endpoint as arg
@@ -398,6 +435,72 @@ def get_login_with_commit_hash(logger,db,auth, commit_data, repo_id):
 
     return match
 
+# max number of commits that are looked up in one graphql request
+COMMIT_LOGIN_BATCH_SIZE = 100
+
+def get_logins_with_commit_hashes(logger,db,auth, commit_hashes, repo_id):
+    """Get the github logins of the authors of many commits with batched graphql requests
+
+    Args:
+        commit_hashes: hashes of the commits to look up
+        repo_id: id of the repo the commits are from
+
+    Returns:
+        dict that maps each commit hash whose author has a github account to the login
+    """
+    query = db.query(Repo).filter_by(repo_id=repo_id)
+    result = execute_session_query(query, 'one')
+
+    owner, repo = get_owner_repo(result.repo_git)
+
+    url = 'https://api.github.com/graphql'
+
+    commit_hashes = list(commit_hashes)
+    logins = {}
+
+    for start in range(0, len(commit_hashes), COMMIT_LOGIN_BATCH_SIZE):
+
+        batch = commit_hashes[start:start + COMMIT_LOGIN_BATCH_SIZE]
+
+        # each commit gets an alias, so every commit of the batch is looked up in one request
+        commit_queries = "\n".join(
+            f'c{index}: object(oid: "{commit_hash}") {{ ... on Commit {{ author {{ user {{ login }} }} }} }}'
+            for index, commit_hash in enumerate(batch)
+        )
+
+        query = """
+            {
+                repository(owner:"%s", name:"%s"){
+                    %s
+                }
+            }
+        """ % (owner, repo, commit_queries)
+
+        data = request_graphql_dict(auth, logger, url, query)
+
+        try:
+            repository = data['data']['repository']
+        except (KeyError, TypeError):
+            logger.info(f"Commit author query returned no data for {len(batch)} commits. Data: {data}")
+            continue
+
+        if not repository:
+            continue
+
+        for index, commit_hash in enumerate(batch):
+
+            try:
+                login = repository[f"c{index}"]['author']['user']['login']
+            except (KeyError, TypeError):
+                login = None
+
+            if login:
+                logins[commit_hash] = login
+
+    logger.info(f"Found the logins of {len(logins)} of {len(commit_hashes)} commit authors")
+
+    return logins
+
 
 
 def create_endpoint_from_repo_id(logger,db, repo_id):
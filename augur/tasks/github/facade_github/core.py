@@ -40,7 +40,7 @@ def query_github_contributors(manifest, github_url):
     duplicate_col_map = {'cntrb_login': 'login'}
 
     #list to hold contributors needing insertion or update
-    contributor_list = GithubPaginator(contributors_url, manifest.key_auth,manifest.logger)#paginate(contributors_url, duplicate_col_map, update_col_map, table, table_pkey)
+    contributor_list = GithubPaginator(contributors_url, manifest.key_auth,manifest.logger, use_etag_cache=True)#paginate(contributors_url, duplicate_col_map, update_col_map, table, table_pkey)
 
     len_contributor_list = len(contributor_list)
 
@@ -61,7 +61,7 @@ def query_github_contributors(manifest, github_url):
             #r = hit_api(session.oauths, cntrb_url, session.logger)
             #contributor = r.json()
 
-            contributor, result = retrieve_dict_from_endpoint(manifest.logger,manifest.key_auth, cntrb_url)
+            contributor, result = retrieve_dict_from_endpoint(manifest.logger,manifest.key_auth, cntrb_url, use_etag_cache=True)
 
             #manifest.logger.info(f"Contributor: {contributor} \n")
             company = None
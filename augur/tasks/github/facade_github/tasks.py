@@ -8,75 +8,126 @@ from augur.tasks.github.util.github_paginator import GithubPaginator, hit_api, r
 from augur.tasks.github.util.github_task_session import GithubTaskSession, GithubTaskManifest
 from augur.tasks.github.util.util import get_owner_repo
 from augur.tasks.util.worker_util import remove_duplicate_dicts
-from augur.application.db.models import PullRequest, Message, PullRequestReview, PullRequestLabel, PullRequestReviewer, PullRequestEvent, PullRequestMeta, PullRequestAssignee, PullRequestReviewMessageRef, Issue, IssueEvent, IssueLabel, IssueAssignee, PullRequestMessageRef, IssueMessageRef, Contributor, Repo
+from augur.application.db.models import PullRequest, Message, PullRequestReview, PullRequestLabel, PullRequestReviewer, PullRequestEvent, PullRequestMeta, PullRequestAssignee, PullRequestReviewMessageRef, Issue, IssueEvent, IssueLabel, IssueAssignee, PullRequestMessageRef, IssueMessageRef, Contributor, Repo, Commit, ContributorsAlias, UnresolvedCommitEmail
 from augur.tasks.github.facade_github.core import *
 from augur.tasks.util.worker_util import create_grouped_task_load
 from celery.result import allow_join_result
 from augur.application.db.util import execute_session_query
 from augur.tasks.git.util.facade_worker.facade_worker.facade00mainprogram import *
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.dialects.postgresql import UUID
+
+
+# max number of emails or names that are looked up in one query
+CONTRIBUTOR_LOOKUP_BATCH_SIZE = 1000
+
+
+def get_known_commit_metadata(db, emails, names):
+    """Look up what is already known about the emails and names of commits in a few queries
+
+    Returns:
+        set of emails that are resolved, set of names that were unresolved in the past and dict that maps names to logins
+    """
+    emails = [email for email in emails if email is not None]
+    names = [name for name in names if name is not None]
+
+    resolved_emails = set()
+    for start in range(0, len(emails), CONTRIBUTOR_LOOKUP_BATCH_SIZE):
+
+        query = db.query(ContributorsAlias.alias_email).filter(ContributorsAlias.alias_email.in_(emails[start:start + CONTRIBUTOR_LOOKUP_BATCH_SIZE]))
+        resolved_emails.update(row.alias_email for row in execute_session_query(query, 'all'))
+
+    unresolved_names = set()
+    name_logins = {}
+    for start in range(0, len(names), CONTRIBUTOR_LOOKUP_BATCH_SIZE):
+
+        batch = names[start:start + CONTRIBUTOR_LOOKUP_BATCH_SIZE]
+
+        query = db.query(UnresolvedCommitEmail.name).filter(UnresolvedCommitEmail.name.in_(batch))
+        unresolved_names.update(row.name for row in execute_session_query(query, 'all'))
+
+        query = db.query(Contributor.cntrb_full_name, Contributor.gh_login).filter(Contributor.cntrb_full_name.in_(batch))
+        for row in execute_session_query(query, 'all'):
+            # the first contributor with the name is used, like the single name lookup did
+            name_logins.setdefault(row.cntrb_full_name, row.gh_login)
+
+    return resolved_emails, unresolved_names, name_logins
 
 
 def process_commit_metadata(logger,db,auth,contributorQueue,repo_id,platform_id):
 
+    # The queue has a row for every commit, so each email is resolved once with its first commit
+    contributors_by_email = {}
     for contributor in contributorQueue:
         # Get the email from the commit data
         email = contributor['email_raw'] if 'email_raw' in contributor else contributor['email']
-    
-        name = contributor['name']
+        contributors_by_email.setdefault(email, contributor)
+
+    if not contributors_by_email:
+        return
+
+    names = {contributor['name'] for contributor in contributors_by_email.values()}
+    resolved_emails, unresolved_names, name_logins = get_known_commit_metadata(db, contributors_by_email.keys(), names)
+
+    logins = {}
+    for email, contributor in contributors_by_email.items():
 
         # check the email to see if it already exists in contributor_aliases
-        
-        # Look up email to see if resolved
-        query = db.query(ContributorsAlias).filter_by(alias_email=email)
-        alias_table_data = execute_session_query(query, 'all')
-        if len(alias_table_data) >= 1:
+        if email in resolved_emails:
             # Move on if email resolved
             logger.info(
                 f"Email {email} has been resolved earlier.")
-
             continue
-        
-        #Check the unresolved_commits table to avoid hitting endpoints that we know don't have relevant data needlessly
-        
-            
-        query = db.query(UnresolvedCommitEmail).filter_by(name=name)
-        unresolved_query_result = execute_session_query(query, 'all')
-
-        if len(unresolved_query_result) >= 1:
 
+        #Check the unresolved_commits table to avoid hitting endpoints that we know don't have relevant data needlessly
+        if contributor['name'] in unresolved_names:
             logger.info(f"Commit data with email {email} has been unresolved in the past, skipping...")
             continue
 
-        login = None
-    
         #Check the contributors table for a login for the given name
+        login = name_logins.get(contributor['name'])
+        if not login:
+            logger.debug("Failed local login lookup")
 
-        query = db.query(Contributor).filter_by(cntrb_full_name=name)
-        contributors_with_matching_name = execute_session_query(query, 'first')
+        logins[email] = login
 
-        if not contributors_with_matching_name:
-            logger.debug("Failed local login lookup")
-        else:
-            login = contributors_with_matching_name.gh_login
-        
+    # Try to get the logins from the commit shas, with one request for many commits
+    emails_by_hash = {contributors_by_email[email]['hash']: email for email, login in logins.items() if not login}
+    if emails_by_hash:
+        commit_logins = get_logins_with_commit_hashes(logger, db, auth, emails_by_hash.keys(), repo_id)
+
+        for commit_hash, login in commit_logins.items():
+            logins[emails_by_hash[commit_hash]] = login
+
+    user_data_by_login = {}
+    new_contributors = []
+    for email, login in logins.items():
+
+        contributor = contributors_by_email[email]
 
-        # Try to get the login from the commit sha
-        if login == None or login == "":
-            login = get_login_with_commit_hash(logger,db,auth,contributor, repo_id)
-    
         if login == None or login == "":
+
+            # the name may have become unresolved when an earlier email with it was searched for
+            if contributor['name'] in unresolved_names:
+                logger.info(f"Commit data with email {email} has been unresolved in the past, skipping...")
+                continue
+
             logger.info("Failed to get login from commit hash")
             # Try to get the login from supplemental data if not found with the commit hash
             login = get_login_with_supplemental_data(logger, db, auth,contributor)
-    
+
         if login == None or login == "":
             logger.error("Failed to get login from supplemental data!")
+            unresolved_names.add(contributor['name'])
             continue
 
-        url = ("https://api.github.com/users/" + login)
+        # emails of the same user only get the user data once
+        if login not in user_data_by_login:
+            url = ("https://api.github.com/users/" + login)
+
+            user_data_by_login[login], _ = retrieve_dict_from_endpoint(logger, auth, url)
 
-        user_data, _ = retrieve_dict_from_endpoint(logger, auth, url)
+        user_data = user_data_by_login[login]
 
         if user_data == None:
             logger.warning(
@@ -84,7 +135,7 @@ def process_commit_metadata(logger,db,auth,contributorQueue,repo_id,platform_id)
             continue
 
         # Use the email found in the commit data if api data is NULL
-        emailFromCommitData = contributor['email_raw'] if 'email_raw' in contributor else contributor['email']
+        emailFromCommitData = email
 
 
         # Get name from commit if not found by GitHub
@@ -131,69 +182,83 @@ def process_commit_metadata(logger,db,auth,contributorQueue,repo_id,platform_id)
             #"data_source": interface.data_source
         }
 
+        new_contributors.append((cntrb, email))
 
-        
-        #Executes an upsert with sqlalchemy 
-        cntrb_natural_keys = ['cntrb_id']
-        
-        db.insert_data(cntrb,Contributor,cntrb_natural_keys)
+    if not new_contributors:
+        return
 
+    #Executes an upsert with sqlalchemy 
+    cntrb_natural_keys = ['cntrb_id']
+    
+    db.insert_data([cntrb for cntrb, _ in new_contributors], Contributor, cntrb_natural_keys)
+
+
+    try:
+        # Update aliases after insertion. Insertion needs to happen first so we can get the autoincrementkey
+        insert_aliases(logger, db, new_contributors)
+    except LookupError as e:
+        logger.info(
+            ''.join(traceback.format_exception(None, e, e.__traceback__)))
+        logger.info(
+            f"Contributor id not able to be found in database despite the user_id existing. Something very wrong is happening. Error: {e}")
+        return 
+    
 
-        try:
-            # Update alias after insertion. Insertion needs to happen first so we can get the autoincrementkey
-            insert_alias(logger, db,cntrb, emailFromCommitData)
-        except LookupError as e:
-            logger.info(
-                ''.join(traceback.format_exception(None, e, e.__traceback__)))
-            logger.info(
-                f"Contributor id not able to be found in database despite the user_id existing. Something very wrong is happening. Error: {e}")
-            return 
-        
+    resolved = [email for _, email in new_contributors]
+
+    # Resolve any unresolved emails if we get to this point.
+    # They will get added to the alias table later
+    # Do this last to absolutely make sure that the emails were resolved before we remove them from the unresolved table.
+    query = s.sql.text("""
+        DELETE FROM unresolved_commit_emails
+        WHERE email = ANY(CAST(:emails AS VARCHAR[]))
+    """).bindparams(emails=resolved)
+
+    logger.info(f"Updating {len(resolved)} now resolved emails")
+
+    try:
+        db.execute_sql(query)
+    except Exception as e:
+        logger.info(
+            f"Deleting now resolved emails failed with error: {e}")
+        raise e
 
-        #Replace each instance of a single or double quote with escape characters 
-        #for postgres
-        escapedEmail = email.replace('"',r'\"')
-        escapedEmail = escapedEmail.replace("'",r'\'')
-        # Resolve any unresolved emails if we get to this point.
-        # They will get added to the alias table later
-        # Do this last to absolutely make sure that the email was resolved before we remove it from the unresolved table.
-        query = s.sql.text("""
-            DELETE FROM unresolved_commit_emails
-            WHERE email='{}'
-        """.format(escapedEmail))
-
-        logger.info(f"Updating now resolved email {email}")
-
-        try:
-            db.execute_sql(query)
-        except Exception as e:
-            logger.info(
-                f"Deleting now resolved email failed with error: {e}")
-            raise e
     
-        
     return
 
 
 def link_commits_to_contributor(session,contributorQueue):
 
-    # # iterate through all the commits with emails that appear in contributors and give them the relevant cntrb_id.
+    # the first cntrb_id of an email is used, like the commits updated one contributor at a time did
+    cntrb_ids = {}
     for cntrb in contributorQueue:
         session.logger.debug(
             f"These are the emails and cntrb_id's  returned: {cntrb}")
 
-        query = s.sql.text("""
-                UPDATE commits 
-                SET cmt_ght_author_id=:cntrb_id
-                WHERE 
-                (cmt_author_raw_email=:cntrb_email
-                OR cmt_author_email=:cntrb_email)
-                AND cmt_ght_author_id is NULL
-        """).bindparams(cntrb_id=cntrb["cntrb_id"],cntrb_email=cntrb["email"])
-
-        #engine.execute(query, **data)
-        session.insert_or_update_data(query)          
-        
+        cntrb_ids.setdefault(cntrb["email"], cntrb["cntrb_id"])
+
+    if not cntrb_ids:
+        return
+
+    # iterate through all the commits with emails that appear in contributors and give them the relevant cntrb_id
+    # with a single update that joins the commits to every email
+    new_values = s.values(
+        s.column("cntrb_email", s.String),
+        s.column("cntrb_id", UUID(as_uuid=True)),
+        name="new_values"
+    ).data(list(cntrb_ids.items()))
+
+    query = (
+        s.update(Commit)
+        .where(
+            s.or_(Commit.cmt_author_raw_email == new_values.c.cntrb_email, Commit.cmt_author_email == new_values.c.cntrb_email),
+            Commit.cmt_ght_author_id.is_(None)
+        )
+        .values(cmt_ght_author_id=new_values.c.cntrb_id)
+        .execution_options(synchronize_session=False)
+    )
+
+    session.insert_or_update_data(query)
     
     return
 
@@ -2,7 +2,9 @@ import time
 import logging
 import traceback
 import re
+from typing import Generator, List
 
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
 
 from augur.tasks.github.util.github_api_key_handler import GithubApiKeyHandler
@@ -10,19 +12,19 @@ from augur.tasks.github.util.github_api_key_handler import GithubApiKeyHandler
 from augur.tasks.init.celery_app import celery_app as celery
 from augur.tasks.init.celery_app import AugurCoreRepoCollectionTask
 from augur.application.db.data_parse import *
-from augur.tasks.github.util.github_paginator import GithubPaginator, hit_api
+from augur.tasks.github.util.github_paginator import GithubPaginator, hit_api, DEFAULT_PAGE_BATCH_SIZE
 from augur.tasks.github.util.github_task_session import GithubTaskManifest
 from augur.application.db.session import DatabaseSession
-from augur.tasks.github.util.util import add_key_value_pair_to_dicts, get_owner_repo
+from augur.tasks.github.util.util import add_key_value_pair_to_dicts, get_owner_repo, format_github_timestamp, get_collection_start_timestamp
 from augur.tasks.util.worker_util import remove_duplicate_dicts
-from augur.application.db.models import PullRequest, Message, PullRequestReview, PullRequestLabel, PullRequestReviewer, PullRequestEvent, PullRequestMeta, PullRequestAssignee, PullRequestReviewMessageRef, Issue, IssueEvent, IssueLabel, IssueAssignee, PullRequestMessageRef, IssueMessageRef, Contributor, Repo
+from augur.application.db.models import PullRequest, Message, PullRequestReview, PullRequestLabel, PullRequestReviewer, PullRequestEvent, PullRequestMeta, PullRequestAssignee, PullRequestReviewMessageRef, Issue, IssueEvent, IssueLabel, IssueAssignee, PullRequestMessageRef, IssueMessageRef, Contributor, Repo, CollectionStatus
 from augur.application.config import get_development_flag
 from augur.application.db.util import execute_session_query
 
 development = get_development_flag()
 
 @celery.task(base=AugurCoreRepoCollectionTask)
-def collect_issues(repo_git : str) -> int:
+def collect_issues(repo_git : str, full_collection: bool = False) -> int:
 
 
     logger = logging.getLogger(collect_issues.__name__) 
@@ -50,25 +52,39 @@ def collect_issues(repo_git : str) -> int:
             #     pass 
 
             owner, repo = get_owner_repo(repo_git)
+
+            # only issues updated since the last run are collected unless a full collection is requested
+            since = None
+            if not full_collection:
+                since = CollectionStatus.get_last_collected(augur_db.session, repo_id, "issue_last_collected")
         
-            issue_data = retrieve_all_issue_data(repo_git, logger, manifest.key_auth)
-            #issue_data = retrieve_all_issue_data(repo_git, logger, the_key)
+            # the issues are inserted a batch of pages at a time, so memory use does not grow with the size of the repo
+            issue_count = 0
+            # items that are updated while the pages are fetched can move to pages that were already fetched,
+            # so the next run starts from when this one started and not from the newest updated_at it saw
+            collection_started = get_collection_start_timestamp()
+            for issue_data in retrieve_all_issue_data(repo_git, logger, manifest.key_auth, since):
 
-            if issue_data:
-                total_issues = len(issue_data)
                 process_issues(issue_data, f"{owner}/{repo}: Issue task", repo_id, logger, augur_db)
 
-                return total_issues
+                issue_count += len(issue_data)
+
+            # the mark is only moved once every batch is inserted, so a failed run is collected again
+            if issue_count:
+                CollectionStatus.update_last_collected(augur_db.session, repo_id, "issue_last_collected", collection_started)
             else:
-                logger.info(f"{owner}/{repo} has no issues")
-                return 0
+                logger.info(f"{owner}/{repo} has no new issues")
+
+            # the count is used for the collection weight, so it has to be the total and not just what this run collected
+            return augur_db.session.query(func.count(Issue.issue_id)).filter(Issue.repo_id == repo_id).scalar()  # pylint: disable=not-callable
         except Exception as e:
             logger.error(f"Could not collect issues for repo {repo_git}\n Reason: {e} \n Traceback: {''.join(traceback.format_exception(None, e, e.__traceback__))}")
             return -1
 
 
 
-def retrieve_all_issue_data(repo_git, logger, key_auth) -> None:
+def retrieve_all_issue_data(repo_git, logger, key_auth, since=None, batch_size=DEFAULT_PAGE_BATCH_SIZE) -> Generator[List[dict], None, None]:
+    """Yields the issues of a repo in batches of batch_size pages."""
 
     owner, repo = get_owner_repo(repo_git)
 
@@ -76,32 +92,41 @@ def retrieve_all_issue_data(repo_git, logger, key_auth) -> None:
 
     url = f"https://api.github.com/repos/{owner}/{repo}/issues?state=all"
 
+    # github filters the issues by their updated_at when since is passed
+    if since:
+        logger.info(f"Collecting issues for {owner}/{repo} updated since {since}")
+        url += f"&since={format_github_timestamp(since)}"
+
     # returns an iterable of all issues at this url (this essentially means you can treat the issues variable as a list of the issues)
     # Reference the code documenation for GithubPaginator for more details
     issues = GithubPaginator(url, key_auth, logger)
 
-    # this is defined so we can decrement it each time 
-    # we come across a pr, so at the end we can log how 
-    # many issues were collected
-    # loop through the issues 
-    all_data = []
+    batch = []
+    batch_pages = 0
     num_pages = issues.get_num_pages()
-    for page_data, page in issues.iter_pages():
+    for page_data, page in issues.iter_pages_concurrently(num_pages=num_pages):
 
         if page_data is None:
-            return all_data
+            break
 
         if len(page_data) == 0:
             logger.debug(
                 f"{owner}/{repo}: Issues Page {page} contains no data...returning")
             logger.info(f"{owner}/{repo}: Issues Page {page} of {num_pages}")
-            return all_data
+            break
 
         logger.info(f"{owner}/{repo}: Issues Page {page} of {num_pages}")
 
-        all_data += page_data
+        batch += page_data
+        batch_pages += 1
+
+        if batch_pages >= batch_size:
+            yield batch
+            batch = []
+            batch_pages = 0
 
-    return all_data
+    if batch:
+        yield batch
     
 def process_issues(issues, task_name, repo_id, logger, augur_db) -> None:
     
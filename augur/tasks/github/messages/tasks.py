@@ -2,16 +2,17 @@ import time
 import logging
 
 import traceback
+from typing import Generator, List
 
 from augur.tasks.init.celery_app import celery_app as celery
 from augur.tasks.init.celery_app import AugurCoreRepoCollectionTask
 from augur.application.db.data_parse import *
-from augur.tasks.github.util.github_paginator import GithubPaginator, hit_api
+from augur.tasks.github.util.github_paginator import GithubPaginator, hit_api, DEFAULT_PAGE_BATCH_SIZE
 from augur.tasks.github.util.github_task_session import GithubTaskManifest
 from augur.application.db.session import DatabaseSession
 from augur.tasks.util.worker_util import remove_duplicate_dicts
-from augur.tasks.github.util.util import get_owner_repo
-from augur.application.db.models import PullRequest, Message, PullRequestReview, PullRequestLabel, PullRequestReviewer, PullRequestEvent, PullRequestMeta, PullRequestAssignee, PullRequestReviewMessageRef, Issue, IssueEvent, IssueLabel, IssueAssignee, PullRequestMessageRef, IssueMessageRef, Contributor, Repo
+from augur.tasks.github.util.util import get_owner_repo, format_github_timestamp, get_collection_start_timestamp
+from augur.application.db.models import PullRequest, Message, PullRequestReview, PullRequestLabel, PullRequestReviewer, PullRequestEvent, PullRequestMeta, PullRequestAssignee, PullRequestReviewMessageRef, Issue, IssueEvent, IssueLabel, IssueAssignee, PullRequestMessageRef, IssueMessageRef, Contributor, Repo, CollectionStatus
 from augur.application.db.util import execute_session_query
 
 
@@ -20,7 +21,7 @@ platform_id = 1
 
 
 @celery.task(base=AugurCoreRepoCollectionTask)
-def collect_github_messages(repo_git: str) -> None:
+def collect_github_messages(repo_git: str, full_collection: bool = False) -> None:
 
     logger = logging.getLogger(collect_github_messages.__name__)
 
@@ -31,20 +32,41 @@ def collect_github_messages(repo_git: str) -> None:
         repo_id = augur_db.session.query(Repo).filter(
             Repo.repo_git == repo_git).one().repo_id
 
+        # only messages updated since the last run are collected unless a full collection is requested
+        since = None
+        if not full_collection:
+            since = CollectionStatus.get_last_collected(augur_db.session, repo_id, "message_last_collected")
+
         owner, repo = get_owner_repo(repo_git)
         task_name = f"{owner}/{repo}: Message Task"
-        message_data = retrieve_all_pr_and_issue_messages(repo_git, logger, manifest.key_auth, task_name)
-        
-        if message_data:
-        
-            process_messages(message_data, task_name, repo_id, logger, augur_db)
+
+        # the messages are inserted a batch of pages at a time, so memory use does not grow with the size of the repo
+        message_count = 0
+        skipped_count = 0
+        # items that are updated while the pages are fetched can move to pages that were already fetched,
+        # so the next run starts from when this one started and not from the newest updated_at it saw
+        collection_started = get_collection_start_timestamp()
+        for message_data in retrieve_all_pr_and_issue_messages(repo_git, logger, manifest.key_auth, task_name, since):
+
+            skipped_count += process_messages(message_data, task_name, repo_id, logger, augur_db)
+
+            message_count += len(message_data)
+
+        # the mark is only moved once every batch is inserted, so a failed run is collected again.
+        # Messages are skipped when their issue or pr is not collected yet, so they are collected again next run
+        if skipped_count:
+            logger.info(f"{task_name}: {skipped_count} messages were skipped, so the last collected date is not updated")
+
+        elif message_count:
+            CollectionStatus.update_last_collected(augur_db.session, repo_id, "message_last_collected", collection_started)
 
         else:
-            logger.info(f"{owner}/{repo} has no messages")
+            logger.info(f"{owner}/{repo} has no new messages")
 
 
 
-def retrieve_all_pr_and_issue_messages(repo_git: str, logger, key_auth, task_name) -> None:
+def retrieve_all_pr_and_issue_messages(repo_git: str, logger, key_auth, task_name, since=None, batch_size=DEFAULT_PAGE_BATCH_SIZE) -> Generator[List[dict], None, None]:
+    """Yields the issue and pr comments of a repo in batches of batch_size pages."""
 
     owner, repo = get_owner_repo(repo_git)
 
@@ -57,33 +79,46 @@ def retrieve_all_pr_and_issue_messages(repo_git: str, logger, key_auth, task_nam
     # url to get issue and pull request comments
     url = f"https://api.github.com/repos/{owner}/{repo}/issues/comments"
 
+    # github filters the comments by their updated_at when since is passed
+    if since:
+        logger.info(f"{task_name}: Collecting comments updated since {since}")
+        url += f"?since={format_github_timestamp(since)}"
+
     # define database task session, that also holds authentication keys the GithubPaginator needs
     
     # returns an iterable of all issues at this url (this essentially means you can treat the issues variable as a list of the issues)
     messages = GithubPaginator(url, key_auth, logger)
 
     num_pages = messages.get_num_pages()
-    all_data = []
-    for page_data, page in messages.iter_pages():
+    batch = []
+    batch_pages = 0
+    for page_data, page in messages.iter_pages_concurrently(num_pages=num_pages):
 
         if page_data is None:
-            return all_data
+            break
 
         elif len(page_data) == 0:
             logger.debug(f"{repo.capitalize()} Messages Page {page} contains no data...returning")
             logger.info(
                 f"{task_name}: Page {page} of {num_pages}")
-            return all_data
+            break
 
         logger.info(f"{task_name}: Page {page} of {num_pages}")
 
-        all_data += page_data
-        
+        batch += page_data
+        batch_pages += 1
+
+        if batch_pages >= batch_size:
+            yield batch
+            batch = []
+            batch_pages = 0
 
-    return all_data
+    if batch:
+        yield batch
     
 
-def process_messages(messages, task_name, repo_id, logger, augur_db):
+def process_messages(messages, task_name, repo_id, logger, augur_db) -> int:
+    """Insert a batch of messages and return the number that were skipped because their issue or pr was not found."""
 
     tool_source = "Pr comment task"
     tool_version = "2.0"
@@ -95,24 +130,28 @@ def process_messages(messages, task_name, repo_id, logger, augur_db):
 
     if messages is None:
         logger.debug(f"{task_name}: Messages was Nonetype...exiting")
-        return
+        return 0
 
     if len(messages) == 0:
         logger.info(f"{task_name}: No messages to process")
 
+    # only the issues and prs the messages belong to are looked up, so the maps are the size of the batch and not the repo
+    related_urls = {message["issue_url"] for message in messages}
+
     # create mapping from issue url to issue id of current issues
     issue_url_to_id_map = {}
-    issues = augur_db.session.query(Issue).filter(Issue.repo_id == repo_id).all()
+    issues = augur_db.session.query(Issue.issue_url, Issue.issue_id).filter(Issue.repo_id == repo_id, Issue.issue_url.in_(related_urls)).all()
     for issue in issues:
         issue_url_to_id_map[issue.issue_url] = issue.issue_id
 
     # create mapping from pr url to pr id of current pull requests
     pr_issue_url_to_id_map = {}
-    prs = augur_db.session.query(PullRequest).filter(PullRequest.repo_id == repo_id).all()
+    prs = augur_db.session.query(PullRequest.pr_issue_url, PullRequest.pull_request_id).filter(PullRequest.repo_id == repo_id, PullRequest.pr_issue_url.in_(related_urls)).all()
     for pr in prs:
         pr_issue_url_to_id_map[pr.pr_issue_url] = pr.pull_request_id
 
 
+    skipped_count = 0
     message_len = len(messages)
     for index, message in enumerate(messages):
 
@@ -138,6 +177,7 @@ def process_messages(messages, task_name, repo_id, logger, augur_db):
                 logger.info(f"{task_name}: Could not find related pr")
                 logger.info(f"{task_name}: We were searching for: {message['id']}")
                 logger.info(f"{task_name}: Skipping")
+                skipped_count += 1
                 continue
 
             issue_message_ref_data = extract_needed_issue_message_ref_data(message, issue_id, repo_id, tool_source, tool_version, data_source)
@@ -156,6 +196,7 @@ def process_messages(messages, task_name, repo_id, logger, augur_db):
                 logger.info(f"{task_name}: Could not find related pr")
                 logger.info(f"{task_name}: We were searching for: {message['issue_url']}")
                 logger.info(f"{task_name}: Skipping")
+                skipped_count += 1
                 continue
 
             pr_message_ref_data = extract_needed_pr_message_ref_data(message, pull_request_id, repo_id, tool_source, tool_version, data_source)
@@ -188,7 +229,7 @@ def process_messages(messages, task_name, repo_id, logger, augur_db):
     message_return_data = augur_db.insert_data(message_dicts, Message, message_natural_keys, 
                                                 return_columns=message_return_columns, string_fields=message_string_fields)
     if message_return_data is None:
-        return
+        return skipped_count
 
     pr_message_ref_dicts = []
     issue_message_ref_dicts = []
@@ -216,6 +257,8 @@ def process_messages(messages, task_name, repo_id, logger, augur_db):
 
     logger.info(f"{task_name}: Inserted {len(message_dicts)} messages. {len(issue_message_ref_dicts)} from issues and {len(pr_message_ref_dicts)} from prs")
 
+    return skipped_count
+
 
 def is_issue_message(html_url):
 
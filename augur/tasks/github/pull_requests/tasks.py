@@ -1,17 +1,20 @@
 import time
 import logging
 import traceback
+from typing import Generator, List
+
+from sqlalchemy import func
 
 from augur.tasks.github.pull_requests.core import extract_data_from_pr_list
 from augur.tasks.init.celery_app import celery_app as celery
 from augur.tasks.init.celery_app import AugurCoreRepoCollectionTask, AugurSecondaryRepoCollectionTask
 from augur.application.db.data_parse import *
-from augur.tasks.github.util.github_paginator import GithubPaginator, hit_api
+from augur.tasks.github.util.github_paginator import GithubPaginator, hit_api, DEFAULT_PAGE_BATCH_SIZE, DEFAULT_PAGE_CONCURRENCY
 from augur.tasks.github.util.github_task_session import GithubTaskManifest
 from augur.application.db.session import DatabaseSession
 from augur.tasks.util.worker_util import remove_duplicate_dicts
-from augur.tasks.github.util.util import add_key_value_pair_to_dicts, get_owner_repo
-from augur.application.db.models import PullRequest, Message, PullRequestReview, PullRequestLabel, PullRequestReviewer, PullRequestEvent, PullRequestMeta, PullRequestAssignee, PullRequestReviewMessageRef, PullRequestMessageRef, Contributor, Repo
+from augur.tasks.github.util.util import add_key_value_pair_to_dicts, get_owner_repo, parse_github_timestamp, get_collection_start_timestamp
+from augur.application.db.models import PullRequest, Message, PullRequestReview, PullRequestLabel, PullRequestReviewer, PullRequestEvent, PullRequestMeta, PullRequestAssignee, PullRequestReviewMessageRef, PullRequestMessageRef, Contributor, Repo, CollectionStatus
 from augur.application.db.util import execute_session_query
 from ..messages.tasks import process_github_comment_contributors
 
@@ -20,7 +23,7 @@ platform_id = 1
 
 
 @celery.task(base=AugurCoreRepoCollectionTask)
-def collect_pull_requests(repo_git: str) -> int:
+def collect_pull_requests(repo_git: str, full_collection: bool = False) -> int:
 
     logger = logging.getLogger(collect_pull_requests.__name__)
 
@@ -31,48 +34,91 @@ def collect_pull_requests(repo_git: str) -> int:
         repo_id = augur_db.session.query(Repo).filter(
         Repo.repo_git == repo_git).one().repo_id
 
+        # only prs updated since the last run are collected unless a full collection is requested
+        since = None
+        if not full_collection:
+            since = CollectionStatus.get_last_collected(augur_db.session, repo_id, "pr_last_collected")
+
         owner, repo = get_owner_repo(repo_git)
-        pr_data = retrieve_all_pr_data(repo_git, logger, manifest.key_auth)
 
-        if pr_data:
+        # the prs are inserted a batch of pages at a time, so memory use does not grow with the size of the repo
+        pr_count = 0
+        # items that are updated while the pages are fetched can move to pages that were already fetched,
+        # so the next run starts from when this one started and not from the newest updated_at it saw
+        collection_started = get_collection_start_timestamp()
+        for pr_data in retrieve_all_pr_data(repo_git, logger, manifest.key_auth, since):
+
             process_pull_requests(pr_data, f"{owner}/{repo}: Pr task", repo_id, logger, augur_db)
 
-            return len(pr_data)
+            pr_count += len(pr_data)
+
+        # the mark is only moved once every batch is inserted, so a failed run is collected again
+        if pr_count:
+            CollectionStatus.update_last_collected(augur_db.session, repo_id, "pr_last_collected", collection_started)
         else:
-            logger.info(f"{owner}/{repo} has no pull requests")
-            return 0
+            logger.info(f"{owner}/{repo} has no new pull requests")
+
+        # the count is used for the collection weight, so it has to be the total and not just what this run collected
+        return augur_db.session.query(func.count(PullRequest.pull_request_id)).filter(PullRequest.repo_id == repo_id).scalar()  # pylint: disable=not-callable
         
     
 # TODO: Rename pull_request_reviewers table to pull_request_requested_reviewers
 # TODO: Fix column names in pull request labels table
-def retrieve_all_pr_data(repo_git: str, logger, key_auth) -> None:
+def retrieve_all_pr_data(repo_git: str, logger, key_auth, since=None, batch_size=DEFAULT_PAGE_BATCH_SIZE) -> Generator[List[dict], None, None]:
+    """Yields the prs of a repo in batches of batch_size pages."""
 
     owner, repo = get_owner_repo(repo_git)
 
     logger.info(f"Collecting pull requests for {owner}/{repo}")
 
     url = f"https://api.github.com/repos/{owner}/{repo}/pulls?state=all&direction=desc"
+
+    # the pulls endpoint has no since param, so sort by updated and stop at the first pr older than since
+    if since:
+        logger.info(f"Collecting pull requests for {owner}/{repo} updated since {since}")
+        url += "&sort=updated"
+
     # returns an iterable of all prs at this url (this essentially means you can treat the prs variable as a list of the prs)
-    prs = GithubPaginator(url, key_auth, logger)
+    # when collecting incrementally the url is the same every run, so unchanged pages are answered with a 304
+    prs = GithubPaginator(url, key_auth, logger, use_etag_cache=bool(since))
 
-    all_data = []
+    batch = []
+    batch_pages = 0
     num_pages = prs.get_num_pages()
-    for page_data, page in prs.iter_pages():
+    # when collecting incrementally only the next page is fetched ahead, since we stop at the first pr older than since
+    pages = prs.iter_pages_concurrently(concurrency=1 if since else DEFAULT_PAGE_CONCURRENCY, num_pages=num_pages)
+    for page_data, page in pages:
 
         if page_data is None:
-            return all_data
+            break
 
         if len(page_data) == 0:
             logger.debug(
                 f"{owner}/{repo} Prs Page {page} contains no data...returning")
             logger.info(f"{owner}/{repo} Prs Page {page} of {num_pages}")
-            return all_data
+            break
 
         logger.info(f"{owner}/{repo} Prs Page {page} of {num_pages}")
 
-        all_data += page_data
+        if since:
+            new_prs = [pr for pr in page_data if parse_github_timestamp(pr["updated_at"]) >= since]
+            batch += new_prs
+
+            if len(new_prs) < len(page_data):
+                logger.info(f"{owner}/{repo}: Reached prs that were not updated since {since}")
+                break
+        else:
+            batch += page_data
+
+        batch_pages += 1
+
+        if batch_pages >= batch_size:
+            yield batch
+            batch = []
+            batch_pages = 0
 
-    return all_data
+    if batch:
+        yield batch
 
 
 def process_pull_requests(pull_requests, task_name, repo_id, logger, augur_db):
@@ -235,7 +281,7 @@ def collect_pull_request_review_comments(repo_git: str) -> None:
         num_pages = pr_review_messages.get_num_pages()
 
         all_raw_pr_review_messages = []
-        for page_data, page in pr_review_messages.iter_pages():
+        for page_data, page in pr_review_messages.iter_pages_concurrently(num_pages=num_pages):
 
             if page_data is None:
                 break
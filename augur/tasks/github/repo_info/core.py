@@ -20,7 +20,7 @@ def query_committers_count(key_auth, logger, owner, repo):
     logger.info('Querying committers count\n')
     url = f'https://api.github.com/repos/{owner}/{repo}/contributors?per_page=100'
 
-    contributors = GithubPaginator(url, key_auth, logger)
+    contributors = GithubPaginator(url, key_auth, logger, use_etag_cache=True)
     
     return len(contributors)
 
@@ -47,7 +47,7 @@ def is_forked(key_auth, logger, owner, repo): #/repos/:owner/:repo parent
     logger.info('Querying parent info to verify if the repo is forked\n')
     url = f'https://api.github.com/repos/{owner}/{repo}'
 
-    r = hit_api(key_auth, url, logger)#requests.get(url, headers=self.headers)
+    r = hit_api(key_auth, url, logger, use_etag_cache=True)#requests.get(url, headers=self.headers)
 
     data = get_repo_data(logger, url, r)
 
@@ -62,7 +62,7 @@ def is_archived(key_auth, logger, owner, repo):
     logger.info('Querying committers count\n')
     url = f'https://api.github.com/repos/{owner}/{repo}'
 
-    r = hit_api(key_auth, url, logger)#requests.get(url, headers=self.headers)
+    r = hit_api(key_auth, url, logger, use_etag_cache=True)#requests.get(url, headers=self.headers)
     #self.update_gh_rate_limit(r)
 
     data = get_repo_data(logger, url, r)
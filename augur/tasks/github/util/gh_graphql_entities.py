@@ -9,6 +9,7 @@ import collections
 import time
 import traceback
 from augur.tasks.github.util.github_paginator import GithubApiResult, process_dict_response
+from augur.tasks.util.http_client import get_http_client
 
 """
     Should be designed on a per entity basis that has attributes that call 
@@ -27,43 +28,43 @@ def hit_api_graphql(keyAuth,url,logger,query,variables={},timeout=40):
     logger.debug(f"Sending query {query}  to github graphql")
 
     response = None
-    with httpx.Client() as client:
+    client = get_http_client()
 
-        try:
-            json_dict = {
-                'query' : query
-            }
+    try:
+        json_dict = {
+            'query' : query
+        }
 
-            #If there are bind variables bind them to the query here.
-            if variables:
+        #If there are bind variables bind them to the query here.
+        if variables:
 
-                json_dict['variables'] = variables
-                #Get rid of values tuple used to extract results so its not used in actual request.
-                json_dict['variables'].pop("values",None)
-                json_dict['variables'] = json_dict['variables']
-                #print(json_dict['variables'])
-            
-            #print(json.dumps(json_dict))
-            response = client.post(
-                url=url,auth=keyAuth,json=json_dict, timeout=timeout
-                )
+            json_dict['variables'] = variables
+            #Get rid of values tuple used to extract results so its not used in actual request.
+            json_dict['variables'].pop("values",None)
+            json_dict['variables'] = json_dict['variables']
+            #print(json_dict['variables'])
         
-        except TimeoutError:
-            logger.info("Request timed out. Sleeping 10 seconds and trying again...\n")
-            time.sleep(10)
-            return None
-        except httpx.TimeoutException:
-            logger.info("httpx.ReadTimeout. Sleeping 10 seconds and trying again...\n")
-            time.sleep(10)
-            return None
-        except httpx.NetworkError:
-            logger.info(f"Network Error. Sleeping {round(timeout)} seconds and trying again...\n")
-            time.sleep(round(timeout))
-            return None
-        except httpx.ProtocolError:
-            logger.info(f"Protocol Error. Sleeping {round(timeout*1.5)} seconds and trying again...\n")
-            time.sleep(round(timeout*1.5))
-            return None
+        #print(json.dumps(json_dict))
+        response = client.post(
+            url=url,auth=keyAuth,json=json_dict, timeout=timeout
+            )
+    
+    except TimeoutError:
+        logger.info("Request timed out. Sleeping 10 seconds and trying again...\n")
+        time.sleep(10)
+        return None
+    except httpx.TimeoutException:
+        logger.info("httpx.ReadTimeout. Sleeping 10 seconds and trying again...\n")
+        time.sleep(10)
+        return None
+    except httpx.NetworkError:
+        logger.info(f"Network Error. Sleeping {round(timeout)} seconds and trying again...\n")
+        time.sleep(round(timeout))
+        return None
+    except httpx.ProtocolError:
+        logger.info(f"Protocol Error. Sleeping {round(timeout*1.5)} seconds and trying again...\n")
+        time.sleep(round(timeout*1.5))
+        return None
     
     return response
 
@@ -94,7 +95,7 @@ def request_graphql_dict(key_auth, logger, url,query,variables={},timeout_wait=1
         #self.logger.info(f"api return: {response_data}")
 
         if type(response_data) == dict:
-            err = process_dict_response(logger, result, response_data)
+            err = process_dict_response(logger, result, response_data, key_auth)
 
             if err and err != GithubApiResult.SUCCESS:
                 attempts += 1
@@ -199,7 +200,7 @@ class GraphQlPageCollection(collections.abc.Sequence):
             #self.logger.info(f"api return: {response_data}")
 
             if type(response_data) == dict:
-                err = process_dict_response(self.logger, result, response_data)
+                err = process_dict_response(self.logger, result, response_data, self.keyAuth)
                 
                 if err == GithubApiResult.REPO_NOT_FOUND:
                     self.logger.error(f"Repo not found! \n response_data: {response_data}")
@@ -0,0 +1,37 @@
+"""Defines the GithubApiKeyScheduler class"""
+from typing import List, Optional
+
+from httpx import Request, Response
+
+from augur.tasks.util.api_key_scheduler import ApiKeyScheduler
+
+
+class GithubApiKeyScheduler(ApiKeyScheduler):
+    """Defines a github specific ApiKeyScheduler.
+
+    Github keeps a separate rate limit per key for the rest, graphql and search apis, 
+    so the state of the keys is stored per api.
+    """
+
+    def __init__(self, list_of_keys: List[str], logger):
+
+        super().__init__("github_api_key_rate_limits", list_of_keys, logger, "X-RateLimit-Remaining", "X-RateLimit-Reset")
+
+    def get_resource(self, request: Request, response: Optional[Response] = None) -> str:
+        """Get the github rate limit bucket a request counts against.
+
+        Returns:
+            The X-RateLimit-Resource of the response if there is one, otherwise the bucket determined from the url
+        """
+        if response is not None and "X-RateLimit-Resource" in response.headers:
+            return response.headers["X-RateLimit-Resource"]
+
+        path = request.url.path
+
+        if path.endswith("/graphql"):
+            return "graphql"
+
+        if path.startswith("/search/"):
+            return "search"
+
+        return "core"
@@ -0,0 +1,118 @@
+"""Defines the cache that lets github rest requests be sent as conditional requests.
+
+Github does not count 304 Not Modified responses against the rate limit. So the ETag and
+Last-Modified headers of a response are stored in redis with the body, then sent back as
+If-None-Match and If-Modified-Since on the next request of the url. On a 304 the cached
+body is returned as if github had sent it.
+"""
+import base64
+import logging
+import zlib
+from typing import Optional
+
+import httpx
+from redis import exceptions
+
+from augur.tasks.init.redis_connection import redis_connection as redis
+from augur import instance_id
+
+logger = logging.getLogger(__name__)
+
+# long enough to cover the weekly re-collection of a repo
+ETAG_CACHE_EXPIRE_SECONDS = 14 * 24 * 60 * 60
+
+# response headers that are kept with the body, so paginating a cached page still works
+CACHED_HEADERS = ["Link", "Content-Type"]
+
+
+def get_etag_cache_key(url: str) -> str:
+
+    return f"{instance_id}_github_etag_{url}"
+
+
+def get_conditional_headers(url: str) -> dict:
+    """Get the headers that make the request for a url conditional.
+
+    Args:
+        url: the url that is being requested
+
+    Returns:
+        If-None-Match and/or If-Modified-Since if the url was cached, otherwise an empty dict
+    """
+    try:
+        cached = redis.hmget(get_etag_cache_key(url), ["etag", "last_modified"])
+    except exceptions.RedisError as e:
+        logger.error(f"Unable to get etag from redis. Error: {e}")
+        return {}
+
+    etag, last_modified = cached
+
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    return headers
+
+
+def process_conditional_response(url: str, response: httpx.Response) -> httpx.Response:
+    """Store the body of a response or replace a 304 with the cached body.
+
+    Args:
+        url: the url that was requested
+        response: the response from github
+
+    Returns:
+        The response, or a 200 response with the cached body if github returned 304
+    """
+    cache_key = get_etag_cache_key(url)
+
+    if response.status_code == 304:
+
+        try:
+            cached = redis.hgetall(cache_key)
+        except exceptions.RedisError as e:
+            logger.error(f"Unable to get cached response from redis. Error: {e}")
+            cached = None
+
+        if not cached or "body" not in cached:
+            # the entry expired between sending the request and getting the response
+            return response
+
+        headers = {name: cached[name] for name in CACHED_HEADERS if name in cached}
+        content = zlib.decompress(base64.b64decode(cached["body"]))
+
+        return httpx.Response(200, headers=headers, content=content, request=response.request)
+
+    if response.status_code != 200:
+        return response
+
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+
+    if not etag and not last_modified:
+        return response
+
+    entry = {
+        "body": base64.b64encode(zlib.compress(response.content)).decode("ascii")
+    }
+    if etag:
+        entry["etag"] = etag
+    if last_modified:
+        entry["last_modified"] = last_modified
+
+    for name in CACHED_HEADERS:
+        if name in response.headers:
+            entry[name] = response.headers[name]
+
+    try:
+        pipeline = redis.pipeline()
+        pipeline.delete(cache_key)
+        pipeline.hset(cache_key, mapping=entry)
+        pipeline.expire(cache_key, ETAG_CACHE_EXPIRE_SECONDS)
+        pipeline.execute()
+    except exceptions.RedisError as e:
+        logger.error(f"Unable to store response in the etag cache. Error: {e}")
+
+    return response
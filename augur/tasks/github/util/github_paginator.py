@@ -1,10 +1,10 @@
 """Logic to paginate the Github API."""
 
 import collections
+from concurrent.futures import ThreadPoolExecutor
 import httpx
 import time
 import json
-import asyncio
 import datetime
 import logging
 
@@ -16,49 +16,102 @@ from enum import Enum
 
 from augur.tasks.github.util.github_random_key_auth import GithubRandomKeyAuth
 from augur.tasks.github.util.util import parse_json_response
+from augur.tasks.util.http_client import get_http_client
+from augur.tasks.github.util.github_etag_cache import get_conditional_headers, process_conditional_response
+
+
+# number of pages fetched at the same time by GithubPaginator.iter_pages_concurrently
+DEFAULT_PAGE_CONCURRENCY = 8
+
+# number of pages the collectors parse and insert at a time, so a whole repo is never held in memory
+DEFAULT_PAGE_BATCH_SIZE = 10
 
  
-def hit_api(key_manager, url: str, logger: logging.Logger, timeout: float = 10, method: str = 'GET', ) -> Optional[httpx.Response]:
+def hit_api(key_manager, url: str, logger: logging.Logger, timeout: float = 10, method: str = 'GET', use_etag_cache: bool = False) -> Optional[httpx.Response]:
     """Ping the api and get the data back for the page.
 
+    Args:
+        use_etag_cache: send a conditional request and return the cached body if github says it is not modified
+
     Returns:
         A httpx response that contains the data. None if a timeout occurs
     """
     # self.logger.info(f"Hitting endpoint with {method} request: {url}...\n")
 
-    with httpx.Client() as client:
+    client = get_http_client()
 
-        try:
-            response = client.request(
-                method=method, url=url, auth=key_manager, timeout=timeout, follow_redirects=True)
+    use_etag_cache = use_etag_cache and method == 'GET'
 
-        except TimeoutError:
-            logger.info(f"Request timed out. Sleeping {round(timeout)} seconds and trying again...\n")
-            time.sleep(round(timeout))
-            return None
-        except httpx.TimeoutException:
-            logger.info(f"Request timed out. Sleeping {round(timeout)} seconds and trying again...\n")
-            time.sleep(round(timeout))
-            return None
-        except httpx.NetworkError:
-            logger.info(f"Network Error. Sleeping {round(timeout)} seconds and trying again...\n")
-            time.sleep(round(timeout))
-            return None
-        except httpx.ProtocolError:
-            logger.info(f"Protocol Error. Sleeping {round(timeout*1.5)} seconds and trying again...\n")
-            time.sleep(round(timeout*1.5))
-            return None
+    headers = get_conditional_headers(url) if use_etag_cache else None
+
+    try:
+        response = client.request(
+            method=method, url=url, auth=key_manager, timeout=timeout, follow_redirects=True, headers=headers)
+
+    except TimeoutError:
+        logger.info(f"Request timed out. Sleeping {round(timeout)} seconds and trying again...\n")
+        time.sleep(round(timeout))
+        return None
+    except httpx.TimeoutException:
+        logger.info(f"Request timed out. Sleeping {round(timeout)} seconds and trying again...\n")
+        time.sleep(round(timeout))
+        return None
+    except httpx.NetworkError:
+        logger.info(f"Network Error. Sleeping {round(timeout)} seconds and trying again...\n")
+        time.sleep(round(timeout))
+        return None
+    except httpx.ProtocolError:
+        logger.info(f"Protocol Error. Sleeping {round(timeout*1.5)} seconds and trying again...\n")
+        time.sleep(round(timeout*1.5))
+        return None
+
+    if use_etag_cache:
+        response = process_conditional_response(url, response)
 
     return response 
 
 
-def process_dict_response(logger: logging.Logger, response: httpx.Response, page_data: dict) -> Optional[str]:
+def wait_for_rate_limit_reset(logger: logging.Logger, response: httpx.Response, key_manager=None) -> None:
+    """Handle a response that says the rate limit of the key was exceeded.
+
+    Note:
+        If the key manager has a key scheduler the key is taken out of rotation and 
+        we only sleep when every key is exhausted. Otherwise we sleep until the key resets.
+
+    Args:
+        logger: handles logging
+        response: the rate limited response
+        key_manager: the auth class that set the key on the request
+    """
+    key_reset_time = None
+    if key_manager is not None and hasattr(key_manager, "handle_rate_limit_exceeded"):
+        key_reset_time = key_manager.handle_rate_limit_exceeded(response)
+
+    if key_reset_time is None:
+        current_epoch = int(time.time())
+        epoch_when_key_resets = int(response.headers["X-RateLimit-Reset"])
+        key_reset_time =  epoch_when_key_resets - current_epoch
+        
+        if key_reset_time < 0:
+            logger.error(f"Key reset time was less than 0 setting it to 0.\nThe current epoch is {current_epoch} and the epoch that the key resets at is {epoch_when_key_resets}")
+            key_reset_time = 0
+
+    elif key_reset_time == 0:
+        logger.info("API rate limit exceeded for key. Retrying with another key")
+        return
+        
+    logger.info(f"\n\n\nAPI rate limit exceeded. Sleeping until the key resets ({key_reset_time} seconds)")
+    time.sleep(key_reset_time)
+
+
+def process_dict_response(logger: logging.Logger, response: httpx.Response, page_data: dict, key_manager=None) -> Optional[str]:
     """Process dict response from the api and return the status.
 
     Args:
         logger: handles logging
         response: used to access the url of the request and the headers
         page_data: dict response from the api
+        key_manager: auth class of the request, used to rotate away from rate limited keys
 
     Returns:
         A string explaining what happened is returned if what happened is determined, otherwise None is returned.
@@ -91,16 +144,7 @@ def process_dict_response(logger: logging.Logger, response: httpx.Response, page
     
     if message and "API rate limit exceeded for user" in message:
 
-        current_epoch = int(time.time())
-        epoch_when_key_resets = int(response.headers["X-RateLimit-Reset"])
-        key_reset_time =  epoch_when_key_resets - current_epoch
-        
-        if key_reset_time < 0:
-            logger.error(f"Key reset time was less than 0 setting it to 0.\nThe current epoch is {current_epoch} and the epoch that the key resets at is {epoch_when_key_resets}")
-            key_reset_time = 0
-            
-        logger.info(f"\n\n\nAPI rate limit exceeded. Sleeping until the key resets ({key_reset_time} seconds)")
-        time.sleep(key_reset_time)
+        wait_for_rate_limit_reset(logger, response, key_manager)
 
         return GithubApiResult.RATE_LIMIT_EXCEEDED
 
@@ -123,16 +167,7 @@ def process_dict_response(logger: logging.Logger, response: httpx.Response, page
     if errors:
         for error in errors:
             if "API rate limit exceeded for user" in error['message']:
-                current_epoch = int(time.time())
-                epoch_when_key_resets = int(response.headers["X-RateLimit-Reset"])
-                key_reset_time =  epoch_when_key_resets - current_epoch
-                
-                if key_reset_time < 0:
-                    logger.error(f"Key reset time was less than 0 setting it to 0.\nThe current epoch is {current_epoch} and the epoch that the key resets at is {epoch_when_key_resets}")
-                    key_reset_time = 0
-                    
-                logger.info(f"\n\n\nAPI rate limit exceeded. Sleeping until the key resets ({key_reset_time} seconds)")
-                time.sleep(key_reset_time)
+                wait_for_rate_limit_reset(logger, response, key_manager)
                 return GithubApiResult.RATE_LIMIT_EXCEEDED
             
             err_type = error.get('type')
@@ -161,6 +196,17 @@ class GithubApiResult(Enum):
     EMPTY_STRING = 9
  
 
+class GithubPaginationError(Exception):
+    """Raised when a page after the first can not be retrieved, so the pages that were yielded are incomplete."""
+
+    def __init__(self, url: str, result: GithubApiResult):
+
+        super().__init__(f"Failed to retrieve the data even though 10 attempts were given. Url: {url}. Result: {result}")
+
+        self.url = url
+        self.result = result
+
+
 class GithubPaginator(collections.abc.Sequence):
     """This class is a sequence that handles paginating through data on the Github API.
 
@@ -172,7 +218,7 @@ class GithubPaginator(collections.abc.Sequence):
         logger (logging.Logger): Logger that handler printing information to files and stdout
     """
 
-    def __init__(self, url: str, key_manager: GithubRandomKeyAuth, logger: logging.Logger, from_datetime=None, to_datetime=None):
+    def __init__(self, url: str, key_manager: GithubRandomKeyAuth, logger: logging.Logger, from_datetime=None, to_datetime=None, use_etag_cache: bool = False):
         """Initialize the class GithubPaginator.
 
         Args:
@@ -181,6 +227,8 @@ class GithubPaginator(collections.abc.Sequence):
             logger: handles logging
             from_datetime: collects data after this datatime (not yet implemented)
             to_datetime: collects data before this datatime (not yet implemented)
+            use_etag_cache: send conditional requests so pages that did not change do not count against the rate limit. 
+                Only worth it for urls that are requested again with the same params, since every page is cached
         """
         remove_fields = ["per_page", "page"]
         url = clean_url(url, remove_fields)
@@ -201,6 +249,8 @@ class GithubPaginator(collections.abc.Sequence):
         self.from_datetime = from_datetime
         self.to_datetime = to_datetime
 
+        self.use_etag_cache = use_etag_cache
+
     def __getitem__(self, index: int) -> Optional[dict]:
         """Get the value at index of the Github API data returned from the url.
 
@@ -362,6 +412,86 @@ class GithubPaginator(collections.abc.Sequence):
             # yield the data from the page and its number
             yield data_list, page_number
 
+    def iter_pages_concurrently(self, concurrency: int = DEFAULT_PAGE_CONCURRENCY, num_pages: Optional[int] = None) -> Generator[Tuple[Optional[List[dict]], int], None, None]:
+        """Provide data from Github API a page at a time, fetching several pages at once.
+
+        Note:
+            The page urls are built from the last page number in the Link header, and up to 
+            concurrency of them are fetched ahead by a thread pool over the shared http client. 
+            The pool keeps fetching while the caller processes the page it was given, and pages are 
+            still yielded in order. If the number of pages is unknown the links are followed from the first page.
+
+        Args:
+            concurrency: max number of pages that are requested at the same time
+            num_pages: number of pages at the url if the caller already retrieved it with get_num_pages
+
+        Yields:
+            A page of data from the Github API at the specified url and its page number. 
+            None, None if the first page can not be retrieved
+
+        Raises:
+            GithubPaginationError: a page after the first could not be retrieved, so the data is incomplete
+        """
+        if num_pages is None:
+            num_pages = self.get_num_pages()
+
+        first_page = get_url_page_number(self.url)
+        last_page = max(num_pages or first_page, first_page)
+        pages = iter(range(first_page, last_page + 1))
+
+        executor = ThreadPoolExecutor(max_workers=max(concurrency, 1))
+        in_flight = collections.deque()
+        last_response = None
+
+        try:
+            for page_number in pages:
+                in_flight.append((page_number, executor.submit(self.retrieve_data, self._page_url(page_number))))
+                if len(in_flight) >= concurrency:
+                    break
+
+            while in_flight:
+
+                page_number, future = in_flight.popleft()
+
+                data_list, response, result = future.result()
+
+                if result != GithubApiResult.SUCCESS:
+                    if page_number == first_page:
+                        self.logger.debug(f"Failed to retrieve the data for even though 10 attempts were given. Url: {self._page_url(page_number)}")
+                        yield None, None
+                        return
+
+                    raise GithubPaginationError(self._page_url(page_number), result)
+
+                last_response = response
+
+                # keep the window full before handing the page to the caller, so the pool fetches while it is processed
+                next_page_number = next(pages, None)
+                if next_page_number is not None:
+                    in_flight.append((next_page_number, executor.submit(self.retrieve_data, self._page_url(next_page_number))))
+
+                yield data_list, page_number
+
+        finally:
+            # the requests that already started are left to finish in the background
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        # pages may have been added since the number of pages was retrieved, so follow the links from the last page
+        while last_response is not None and 'next' in last_response.links.keys():
+
+            next_page = last_response.links['next']['url']
+
+            data_list, last_response, result = self.retrieve_data(next_page)
+
+            if result != GithubApiResult.SUCCESS or data_list is None:
+                raise GithubPaginationError(next_page, result)
+
+            yield data_list, get_url_page_number(next_page)
+
+    def _page_url(self, page_number: int) -> str:
+
+        return add_query_params(self.url, {"page": page_number})
+
     def retrieve_data(self, url: str) -> Tuple[Optional[List[dict]], Optional[httpx.Response]]:
         """Attempt to retrieve data at given url.
 
@@ -376,9 +506,10 @@ class GithubPaginator(collections.abc.Sequence):
         num_attempts = 1
         while num_attempts <= 10:
 
-            response = hit_api(self.key_manager, url, self.logger, timeout)
+            response = hit_api(self.key_manager, url, self.logger, timeout, use_etag_cache=self.use_etag_cache)
 
             if response is None:
+                timeout_count += 1
                 if timeout_count == 10:
                     self.logger.error(f"Request timed out 10 times for {url}")
                     return None, None, GithubApiResult.TIMEOUT
@@ -401,7 +532,7 @@ class GithubPaginator(collections.abc.Sequence):
 
             # if the data is a dict then call process_dict_response, and 
             if isinstance(page_data, dict) is True:
-                dict_processing_result = process_dict_response(self.logger, response, page_data)
+                dict_processing_result = process_dict_response(self.logger, response, page_data, self.key_manager)
 
                 if dict_processing_result == GithubApiResult.NEW_RESULT:
                     self.logger.info(f"Encountered new dict response from api on url: {url}. Response: {page_data}")
@@ -565,14 +696,14 @@ def get_url_page_number(url: str) -> int:
     return page_number
 
 
-def retrieve_dict_from_endpoint(logger, key_auth, url, timeout_wait=10) -> Tuple[Optional[dict], GithubApiResult]:
+def retrieve_dict_from_endpoint(logger, key_auth, url, timeout_wait=10, use_etag_cache=False) -> Tuple[Optional[dict], GithubApiResult]:
     timeout = timeout_wait
     timeout_count = 0
     num_attempts = 1
 
     while num_attempts <= 10:
 
-        response = hit_api(key_auth, url, logger, timeout)
+        response = hit_api(key_auth, url, logger, timeout, use_etag_cache=use_etag_cache)
 
         if response is None:
             if timeout_count == 10:
@@ -603,7 +734,7 @@ def retrieve_dict_from_endpoint(logger, key_auth, url, timeout_wait=10) -> Tuple
 
         # if the data is a dict then call process_dict_response, and 
         elif isinstance(page_data, dict):
-            dict_processing_result = process_dict_response(logger, response, page_data)
+            dict_processing_result = process_dict_response(logger, response, page_data, key_auth)
 
             if dict_processing_result == GithubApiResult.SUCCESS:
                 return page_data, dict_processing_result
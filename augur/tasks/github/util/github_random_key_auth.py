@@ -2,13 +2,15 @@
 
 from augur.tasks.util.random_key_auth import RandomKeyAuth
 from augur.tasks.github.util.github_api_key_handler import GithubApiKeyHandler
+from augur.tasks.github.util.github_api_key_scheduler import GithubApiKeyScheduler
 from augur.application.db.session import DatabaseSession
 import random 
 
 
 class GithubRandomKeyAuth(RandomKeyAuth):
     """Defines a github specific RandomKeyAuth class so 
-    github collections can have a class randomly selects an api key for each request    
+    github collections can have a class that selects an api key for each request.
+    The key with the most remaining rate limit is used    
     """
 
     def __init__(self, session: DatabaseSession, logger):
@@ -26,4 +28,6 @@ class GithubRandomKeyAuth(RandomKeyAuth):
         header_name = "Authorization"
         key_format = "token {0}"
 
-        super().__init__(github_api_keys, header_name, session.logger, key_format)
\ No newline at end of file
+        key_scheduler = GithubApiKeyScheduler(github_api_keys, session.logger)
+
+        super().__init__(github_api_keys, header_name, session.logger, key_format, key_scheduler)
@@ -1,5 +1,6 @@
 """Utility functions that are useful for several Github tasks"""
-from typing import Any, List, Tuple
+from typing import Any, List, Tuple, Optional
+from datetime import datetime, timedelta
 from httpx import Response
 import logging
 import json
@@ -49,6 +50,66 @@ def get_owner_repo(git_url: str) -> Tuple[str, str]:
     return owner, repo
 
 
+def parse_github_timestamp(timestamp: str) -> datetime:
+    """Parses a timestamp returned by the github api
+
+    Args:
+        timestamp: timestamp in the form 2011-04-22T13:33:48Z
+
+    Returns:
+        naive datetime in utc
+    """
+    return datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")
+
+
+def format_github_timestamp(timestamp: datetime) -> str:
+    """Formats a naive utc datetime the way the github api expects it in the since param
+
+    Args:
+        timestamp: naive datetime in utc
+
+    Returns:
+        timestamp in the form 2011-04-22T13:33:48Z
+    """
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+# subtracted from the start of a collection, so records github stamped a little before our clock are not skipped
+COLLECTION_START_SAFETY_MARGIN = timedelta(minutes=5)
+
+
+def get_collection_start_timestamp() -> datetime:
+    """Gets the mark to store for a collection of records that can be updated, taken before the first request
+
+    Note:
+        The newest updated_at of the collected records can not be used, since a record that was
+        updated while the pages were fetched can be on a page that was already fetched
+
+    Returns:
+        naive datetime in utc
+    """
+    return datetime.utcnow() - COLLECTION_START_SAFETY_MARGIN
+
+
+def get_newest_timestamp(data: List[dict], key: str) -> Optional[datetime]:
+    """Gets the newest timestamp of a field in a list of github api dicts
+
+    Args:
+        data: list of dicts from the github api
+        key: field that has the timestamp, like updated_at
+
+    Returns:
+        the newest timestamp or None if no dict has the field
+    """
+    timestamps = [item[key] for item in data if item.get(key)]
+
+    if not timestamps:
+        return None
+
+    # the timestamps all have the same format so they sort as strings
+    return parse_github_timestamp(max(timestamps))
+
+
 def parse_json_response(logger: logging.Logger, response: httpx.Response) -> dict:
     # try to get json from response
     try:
@@ -12,6 +12,7 @@ from enum import Enum
 
 from augur.tasks.gitlab.gitlab_random_key_auth import GitlabRandomKeyAuth
 from augur.tasks.github.util.util import parse_json_response
+from augur.tasks.util.http_client import get_http_client
 
 class GitlabApiResult(Enum):
     """All the different results of querying the Gitlab API."""
@@ -191,13 +192,21 @@ class GitlabApiHandler():
 
             if response.status_code == 429:
 
-                current_epoch = int(time.time())
-                epoch_when_key_resets = int(response.headers["ratelimit-reset"])
-                key_reset_time =  epoch_when_key_resets - current_epoch
-                
-                if key_reset_time < 0:
-                    self.logger.error(f"Key reset time was less than 0 setting it to 0.\nThe current epoch is {current_epoch} and the epoch that the key resets at is {epoch_when_key_resets}")
-                    key_reset_time = 0
+                # takes the key out of rotation, so we only need to sleep if every key is exhausted
+                key_reset_time = self.key_manager.handle_rate_limit_exceeded(response)
+
+                if key_reset_time == 0:
+                    self.logger.info("Gitlab API rate limit exceeded for key. Retrying with another key")
+                    continue
+
+                if key_reset_time is None:
+                    current_epoch = int(time.time())
+                    epoch_when_key_resets = int(response.headers["ratelimit-reset"])
+                    key_reset_time =  epoch_when_key_resets - current_epoch
+                    
+                    if key_reset_time < 0:
+                        self.logger.error(f"Key reset time was less than 0 setting it to 0.\nThe current epoch is {current_epoch} and the epoch that the key resets at is {epoch_when_key_resets}")
+                        key_reset_time = 0
                     
                 self.logger.info(f"\n\n\nGitlab API rate limit exceeded. Sleeping until the key resets ({key_reset_time} seconds)")
                 time.sleep(key_reset_time)
@@ -360,27 +369,27 @@ def hit_api(key_manager, url: str, logger: logging.Logger, timeout: float = 10,
     """
     # self.logger.info(f"Hitting endpoint with {method} request: {url}...\n")
 
-    with httpx.Client() as client:
-
-        try:
-            response = client.request(
-                method=method, url=url, auth=key_manager, timeout=timeout, follow_redirects=True)
+    client = get_http_client()
 
-        except TimeoutError:
-            logger.info(f"Request timed out. Sleeping {round(timeout)} seconds and trying again...\n")
-            time.sleep(round(timeout))
-            return None
-        except httpx.TimeoutException:
-            logger.info(f"Request timed out. Sleeping {round(timeout)} seconds and trying again...\n")
-            time.sleep(round(timeout))
-            return None
-        except httpx.NetworkError:
-            logger.info(f"Network Error. Sleeping {round(timeout)} seconds and trying again...\n")
-            time.sleep(round(timeout))
-            return None
-        except httpx.ProtocolError:
-            logger.info(f"Protocol Error. Sleeping {round(timeout*1.5)} seconds and trying again...\n")
-            time.sleep(round(timeout*1.5))
-            return None
+    try:
+        response = client.request(
+            method=method, url=url, auth=key_manager, timeout=timeout, follow_redirects=True)
+
+    except TimeoutError:
+        logger.info(f"Request timed out. Sleeping {round(timeout)} seconds and trying again...\n")
+        time.sleep(round(timeout))
+        return None
+    except httpx.TimeoutException:
+        logger.info(f"Request timed out. Sleeping {round(timeout)} seconds and trying again...\n")
+        time.sleep(round(timeout))
+        return None
+    except httpx.NetworkError:
+        logger.info(f"Network Error. Sleeping {round(timeout)} seconds and trying again...\n")
+        time.sleep(round(timeout))
+        return None
+    except httpx.ProtocolError:
+        logger.info(f"Protocol Error. Sleeping {round(timeout*1.5)} seconds and trying again...\n")
+        time.sleep(round(timeout*1.5))
+        return None
 
     return response 
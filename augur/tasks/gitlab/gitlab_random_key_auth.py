@@ -2,6 +2,7 @@
 
 from augur.tasks.util.random_key_auth import RandomKeyAuth
 from augur.tasks.gitlab.gitlab_api_key_handler import GitlabApiKeyHandler
+from augur.tasks.util.api_key_scheduler import ApiKeyScheduler
 from augur.application.db.session import DatabaseSession
 
 
@@ -23,4 +24,8 @@ class GitlabRandomKeyAuth(RandomKeyAuth):
         header_name = "Authorization"
         key_format = "Bearer {0}"
 
-        super().__init__(gitlab_api_keys, header_name, session.logger, key_format)
\ No newline at end of file
+        # gitlab.com allows 2000 requests per minute for a key
+        key_scheduler = ApiKeyScheduler("gitlab_api_key_rate_limits", gitlab_api_keys, session.logger,
+                                        "RateLimit-Remaining", "RateLimit-Reset", default_remaining=2000)
+
+        super().__init__(gitlab_api_keys, header_name, session.logger, key_format, key_scheduler)
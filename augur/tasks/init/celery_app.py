@@ -1,5 +1,5 @@
 """Defines the Celery app."""
-from celery.signals import worker_process_init, worker_process_shutdown, eventlet_pool_started, eventlet_pool_preshutdown, eventlet_pool_postshutdown
+from celery.signals import worker_process_init, worker_process_shutdown, task_postrun, eventlet_pool_started, eventlet_pool_preshutdown, eventlet_pool_postshutdown
 import logging
 from typing import List, Dict
 import os
@@ -14,13 +14,14 @@ from sqlalchemy import create_engine, event, or_, and_
 
 
 from augur.application.logs import TaskLogConfig, AugurLogger
-from augur.application.db.session import DatabaseSession
+from augur.application.db.session import DatabaseSession, get_insert_metrics
 from augur.application.db.engine import DatabaseEngine
 from augur.application.config import AugurConfig
 from augur.application.db.engine import get_database_string
 from augur.tasks.init import get_redis_conn_values, get_rabbitmq_conn_string
 from augur.application.db.models import CollectionStatus, Repo
 from augur.tasks.util.collection_state import CollectionState
+from augur.tasks.util.http_client import init_http_client, close_http_client, get_http_client_stats, publish_http_client_stats
 
 logger = logging.getLogger(__name__)
 
@@ -256,6 +257,18 @@ def init_worker(**kwargs):
 
     engine = DatabaseEngine(poolclass=StaticPool).engine
 
+    # one keep-alive http client per worker process that all the collectors share
+    init_http_client()
+
+
+@task_postrun.connect
+def publish_worker_http_stats(**kwargs):
+    """Publish the http connection reuse stats of the worker process after each task."""
+
+    from augur.tasks.init.redis_connection import redis_connection
+
+    publish_http_client_stats(redis_connection)
+
 
 @worker_process_shutdown.connect
 def shutdown_worker(**kwargs):
@@ -264,4 +277,9 @@ def shutdown_worker(**kwargs):
         logger.info('Closing database connectionn for worker')
         engine.dispose()
 
+    logger.info(f"Insert deadlock stats for worker: {get_insert_metrics()}")
+
+    logger.info(f"Closing http client for worker. Connection stats: {get_http_client_stats()}")
+    close_http_client()
+
 
@@ -37,6 +37,7 @@ from augur.tasks.util.redis_list import RedisList
 from augur.application.db.models import CollectionStatus, Repo
 from augur.tasks.util.collection_state import CollectionState
 from augur.tasks.util.collection_util import *
+from augur.tasks.util.worker_util import get_date_weight_sql
 from augur.tasks.git.util.facade_worker.facade_worker.utilitymethods import get_facade_weight_time_factor
 
 CELERY_GROUP_TYPE = type(group())
@@ -292,41 +293,41 @@ def augur_collection_update_weights():
 
     logger.info("Updating stale collection weights")
 
-    with DatabaseSession(logger,engine) as session:
-
-        core_weight_update_repos = session.query(CollectionStatus).filter(CollectionStatus.core_weight != None).all()
-
-        for status in core_weight_update_repos:
-            repo = Repo.get_by_id(session, status.repo_id)
-
-            repo_git = repo.repo_git
-            status = repo.collection_status[0]
-            raw_count = status.issue_pr_sum
-
-            issue_pr_task_update_weight_util([int(raw_count)],repo_git=repo_git,session=session)
-    
-        facade_not_pending = CollectionStatus.facade_status != CollectionState.PENDING.value
-        facade_not_failed = CollectionStatus.facade_status != CollectionState.FAILED_CLONE.value
-        facade_weight_not_null = CollectionStatus.facade_weight != None
-
-        facade_weight_update_repos = session.query(CollectionStatus).filter(and_(facade_not_pending,facade_not_failed,facade_weight_not_null)).all()
-
-        for status in facade_weight_update_repos:
-            repo = Repo.get_by_id(session, status.repo_id)
-
-            commit_count = status.commit_sum
-            date_factor = get_facade_weight_time_factor(session, repo.repo_git)
-            weight = commit_count - date_factor
-
-            update_query = (
-                update(CollectionStatus)
-                .where(CollectionStatus.repo_id == status.repo_id)
-                .values(facade_weight=weight)
-            )
-
-            session.execute(update_query)
-            session.commit()
-            #git_update_commit_count_weight(repo_git)
+    #The weights of every repo are calculated by the database in one update per hook,
+    #instead of querying and committing each repo. 
+    #The formulas are the same as update_issue_pr_weights and get_facade_weight_time_factor
+    core_weight_query = s.sql.text(f"""
+        UPDATE augur_operations.collection_status AS status
+        SET core_weight = status.issue_pr_sum - {get_date_weight_sql("repo.repo_added", "status.core_data_last_collected")},
+            secondary_weight = status.issue_pr_sum - {get_date_weight_sql("repo.repo_added", "status.secondary_data_last_collected")},
+            ml_weight = status.issue_pr_sum - {get_date_weight_sql("repo.repo_added", "status.ml_data_last_collected")}
+        FROM augur_data.repo AS repo
+        WHERE repo.repo_id = status.repo_id
+        AND status.core_weight IS NOT NULL
+        AND status.issue_pr_sum IS NOT NULL
+    """)
+
+    #The time factor is adjusted for commits like it is in get_facade_weight_time_factor
+    facade_weight_query = s.sql.text(f"""
+        UPDATE augur_operations.collection_status AS status
+        SET facade_weight = ROUND(status.commit_sum - 1.2 * {get_date_weight_sql("repo.repo_added", "status.facade_data_last_collected")})
+        FROM augur_data.repo AS repo
+        WHERE repo.repo_id = status.repo_id
+        AND status.facade_status != '{CollectionState.PENDING.value}'
+        AND status.facade_status != '{CollectionState.FAILED_CLONE.value}'
+        AND status.facade_weight IS NOT NULL
+        AND status.commit_sum IS NOT NULL
+    """)
+
+    now = datetime.datetime.now()
+
+    with engine.begin() as connection:
+
+        result = connection.execute(core_weight_query, {"now": now})
+        logger.info(f"Updated the core, secondary and ml weights of {result.rowcount} repos")
+
+        result = connection.execute(facade_weight_query, {"now": now})
+        logger.info(f"Updated the facade weights of {result.rowcount} repos")
 
 @celery.task
 def retry_errored_repos():
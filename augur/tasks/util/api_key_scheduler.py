@@ -0,0 +1,183 @@
+"""This module defines the ApiKeyScheduler class.
+It imports the redis_connection as redis which is a connection to the redis cache
+"""
+import time
+from random import choice, choices
+from typing import List, Optional, Tuple
+
+from httpx import Request, Response
+from redis import exceptions
+
+from augur.tasks.init.redis_connection import redis_connection as redis
+from augur import instance_id
+
+
+class ApiKeyScheduler:
+    """Hands out the api key with the most remaining rate limit budget.
+
+    The remaining requests and reset time of every key are read from the rate limit headers
+    of every response and stored in a redis hash, so all the worker processes share them.
+    Exhausted keys are taken out of rotation until their reset time has passed.
+
+    Attributes:
+        list_of_keys ([str]): keys that are scheduled
+        redis_hash_key (str): key of the redis hash that stores the rate limit state of the keys
+        remaining_header (str): name of the header that has the number of remaining requests
+        reset_header (str): name of the header that has the epoch the key resets at
+        default_remaining (int): budget assumed for a key that has not been used yet
+    """
+
+    def __init__(self, scheduler_name: str, list_of_keys: List[str], logger, remaining_header: str = "X-RateLimit-Remaining", reset_header: str = "X-RateLimit-Reset", default_remaining: int = 5000):
+
+        self.redis_hash_key = f"{instance_id}_{scheduler_name}"
+        self.list_of_keys = list_of_keys
+        self.logger = logger
+        self.remaining_header = remaining_header
+        self.reset_header = reset_header
+        self.default_remaining = default_remaining
+
+    def get_resource(self, request: Request, response: Optional[Response] = None) -> str:
+        """Get the rate limit bucket a request counts against.
+
+        Note:
+            Platforms that have several rate limits for a key (like github) override this
+
+        Returns:
+            Name of the rate limit bucket
+        """
+        return "core"
+
+    def get_key(self, request: Request) -> str:
+        """Get a key for the request, picked at random weighted by the remaining budget of each key.
+
+        Note:
+            Weighting the choice spreads the processes over the keys instead of every process picking 
+            the same key with the most budget. If every key is exhausted the key that resets first is returned
+
+        Args:
+            request: the request the key is for
+
+        Returns:
+            An api key
+        """
+        resource = self.get_resource(request)
+
+        try:
+            key_states = redis.hgetall(self.redis_hash_key)
+        except exceptions.RedisError as e:
+            self.logger.error(f"Unable to get api key rate limits from redis. Choosing a random key. Error: {e}")
+            return choice(self.list_of_keys)
+
+        now = time.time()
+
+        weights = []
+        soonest_reset_key = None
+        soonest_reset = None
+        for key in self.list_of_keys:
+
+            remaining, reset = self._parse_state(key_states.get(self._field(resource, key)))
+
+            if remaining is None or reset <= now:
+                remaining = self.default_remaining
+
+            elif soonest_reset is None or reset < soonest_reset:
+                soonest_reset = reset
+                soonest_reset_key = key
+
+            weights.append(max(remaining, 0))
+
+        if sum(weights) <= 0:
+            return soonest_reset_key if soonest_reset_key is not None else choice(self.list_of_keys)
+
+        return choices(self.list_of_keys, weights=weights)[0]
+
+    def update_key(self, key: str, request: Request, response: Response) -> None:
+        """Store the rate limit state of a key from the headers of a response.
+
+        Args:
+            key: the key that was used for the request
+            request: the request that was sent
+            response: the response that has the rate limit headers
+        """
+        remaining = response.headers.get(self.remaining_header)
+        reset = response.headers.get(self.reset_header)
+
+        if remaining is None or reset is None:
+            return
+
+        try:
+            remaining = int(remaining)
+            reset = int(float(reset))
+        except ValueError:
+            return
+
+        self._set_state(self.get_resource(request, response), key, remaining, reset)
+
+    def disable_key(self, key: str, request: Request, response: Response) -> None:
+        """Take a key out of rotation until it resets.
+
+        Args:
+            key: the key that has run out of requests
+            request: the request that was rate limited
+            response: the response that says the rate limit was exceeded
+        """
+        try:
+            reset = int(float(response.headers.get(self.reset_header)))
+        except (TypeError, ValueError):
+            # github gives an hour long window when the header is missing
+            reset = int(time.time()) + 3600
+
+        self._set_state(self.get_resource(request, response), key, 0, reset)
+
+    def seconds_until_key_available(self, request: Request) -> int:
+        """Get the number of seconds until a key can be used for the request.
+
+        Returns:
+            0 if a key has remaining budget, otherwise the seconds until the first key resets
+        """
+        resource = self.get_resource(request)
+
+        try:
+            key_states = redis.hgetall(self.redis_hash_key)
+        except exceptions.RedisError:
+            return 0
+
+        now = time.time()
+
+        soonest_reset = None
+        for key in self.list_of_keys:
+
+            remaining, reset = self._parse_state(key_states.get(self._field(resource, key)))
+
+            if remaining is None or remaining > 0 or reset <= now:
+                return 0
+
+            if soonest_reset is None or reset < soonest_reset:
+                soonest_reset = reset
+
+        if soonest_reset is None:
+            return 0
+
+        return max(int(soonest_reset - now), 0)
+
+    def _set_state(self, resource: str, key: str, remaining: int, reset: int) -> None:
+
+        try:
+            redis.hset(self.redis_hash_key, self._field(resource, key), f"{remaining}:{reset}")
+        except exceptions.RedisError as e:
+            self.logger.error(f"Unable to store api key rate limit in redis. Error: {e}")
+
+    @staticmethod
+    def _field(resource: str, key: str) -> str:
+
+        return f"{resource}:{key}"
+
+    @staticmethod
+    def _parse_state(state: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+
+        if not state:
+            return None, None
+
+        remaining, reset = state.split(":")
+
+        return int(remaining), int(reset)
@@ -12,7 +12,7 @@ import datetime
 from celery import signature
 from celery import group, chain, chord, signature
 import sqlalchemy as s
-from sqlalchemy import or_, and_, update
+from sqlalchemy import or_, and_, update, func
 from augur.application.logs import AugurLogger
 from augur.tasks.init.celery_app import celery_app as celery
 from augur.application.db.models import CollectionStatus, Repo
@@ -25,6 +25,7 @@ from augur.tasks.github.util.github_task_session import GithubTaskManifest
 from augur.application.db.session import DatabaseSession
 from augur.tasks.util.worker_util import calculate_date_weight_from_timestamps
 from augur.tasks.util.collection_state import CollectionState
+from augur.tasks.util.metric_cache import invalidate_repo_metric_cache
 
 
 def get_list_of_all_users(session):
@@ -139,7 +140,7 @@ class CollectionRequest:
             self.new_status = CollectionState.UPDATE.value
 
     def get_active_repo_count(self,session):
-        return len(session.query(CollectionStatus).filter(getattr(CollectionStatus,f"{self.name}_status" ) == CollectionState.COLLECTING.value).all())
+        return session.query(func.count(CollectionStatus.repo_id)).filter(getattr(CollectionStatus,f"{self.name}_status" ) == CollectionState.COLLECTING.value).scalar()  # pylint: disable=not-callable
 
     #Get repo urls based on passed in info.
     def get_valid_repos(self,session):
@@ -326,6 +327,8 @@ def core_task_success_util(repo_git):
         #Update the values for core and secondary weight
         issue_pr_task_update_weight_util([int(raw_count)],repo_git=repo_git,session=session)
 
+        invalidate_repo_metric_cache(repo.repo_id, repo.repo_group_id)
+
 #Update the existing core and secondary weights as well as the raw sum of issues and prs
 def update_issue_pr_weights(logger,session,repo_git,raw_sum):
     repo = Repo.get_by_repo_git(session, repo_git)
@@ -393,6 +396,8 @@ def secondary_task_success_util(repo_git):
 
         issue_pr_task_update_weight_util([int(raw_count)],repo_git=repo_git,session=session)
 
+        invalidate_repo_metric_cache(repo.repo_id, repo.repo_group_id)
+
 #Get the weight for each repo for the secondary collection hook.
 def get_repo_weight_secondary(logger,repo_git):
     from augur.tasks.init.celery_app import engine
@@ -438,6 +443,8 @@ def facade_task_success_util(repo_git):
 
         session.commit()
 
+        invalidate_repo_metric_cache(repo.repo_id, repo.repo_group_id)
+
 @celery.task
 def ml_task_success_util(repo_git):
     from augur.tasks.init.celery_app import engine
@@ -460,6 +467,8 @@ def ml_task_success_util(repo_git):
 
         session.commit()
 
+        invalidate_repo_metric_cache(repo.repo_id, repo.repo_group_id)
+
 
 
 @celery.task
@@ -548,14 +557,31 @@ class AugurTaskRoutine:
         self.collection_hooks = collection_hooks
         self.session = session
 
-    def update_status_and_id(self,repo_git, task_id, name):
-        repo = self.session.query(Repo).filter(Repo.repo_git == repo_git).one()
+    def update_status_and_ids(self, name, repo_statuses):
+        """Set the status and task id of the collection hook for a list of repos in one UPDATE.
 
-        #Set status in database to collecting
-        repoStatus = repo.collection_status[0]
-        #
-        setattr(repoStatus,f"{name}_task_id",task_id)
-        setattr(repoStatus,f"{name}_status", CollectionState.COLLECTING.value)
+        Args:
+            name: name of the collection hook, like core
+            repo_statuses: list of (repo_id, task_id, status) tuples
+        """
+        if not repo_statuses:
+            return
+
+        new_values = s.values(
+            s.column("repo_id", s.BigInteger),
+            s.column("task_id", s.String),
+            s.column("status", s.String),
+            name="new_values"
+        ).data(repo_statuses)
+
+        update_query = (
+            update(CollectionStatus)
+            .where(CollectionStatus.repo_id == new_values.c.repo_id)
+            .values({f"{name}_task_id": new_values.c.task_id, f"{name}_status": new_values.c.status})
+            .execution_options(synchronize_session=False)
+        )
+
+        self.session.execute(update_query)
         self.session.commit()
 
 
@@ -568,13 +594,42 @@ class AugurTaskRoutine:
             is generalized.
         """
 
-        #Send messages starts each repo and yields its running info
-        #to concurrently update the correct field in the database.
-        for repo_git, task_id, hook_name in self.send_messages():
-            self.update_status_and_id(repo_git,task_id,hook_name)
-    
-    def send_messages(self):
-        augur_collection_list = []
+        #The task ids are known before the tasks are sent, so the status of every repo
+        #is set to collecting in one update before a task can finish and set it to success.
+        messages = list(self.prepare_messages())
+
+        for col_hook in self.collection_hooks:
+
+            hook_messages = [message for message in messages if message[3] == col_hook.name]
+
+            self.logger.info(f"Setting {col_hook.name} status to collecting for {len(hook_messages)} repos")
+            self.update_status_and_ids(col_hook.name, [(repo_id, task_id, CollectionState.COLLECTING.value) for _, repo_id, task_id, _, _, _ in hook_messages])
+
+        #Restore the previous status of the repos whose tasks could not be sent, so they are scheduled again
+        failed_messages = self.send_messages(messages)
+
+        for col_hook in self.collection_hooks:
+
+            self.update_status_and_ids(col_hook.name, [(repo_id, None, previous_status) for _, repo_id, _, hook_name, previous_status, _ in failed_messages if hook_name == col_hook.name])
+
+    def prepare_messages(self):
+        """Build the task chain of every repo of the collection hooks.
+
+            The repos of all the hooks are looked up in one query.
+
+        Yields:
+            (repo_git, repo_id, task_id, hook_name, previous_status, chain) for every repo that has phases to run
+        """
+        repo_gits = {repo_git for col_hook in self.collection_hooks for repo_git in col_hook.repo_list}
+
+        status_columns = [getattr(CollectionStatus, f"{col_hook.name}_status") for col_hook in self.collection_hooks]
+
+        repo_query = (
+            self.session.query(Repo.repo_git, Repo.repo_id, *status_columns)
+            .outerjoin(CollectionStatus, CollectionStatus.repo_id == Repo.repo_id)
+            .filter(Repo.repo_git.in_(repo_gits))
+        )
+        repos = {row.repo_git: row for row in repo_query.all()}
         
         for col_hook in self.collection_hooks:
 
@@ -582,41 +637,54 @@ class AugurTaskRoutine:
             
             for repo_git in col_hook.repo_list:
 
-                repo = self.session.query(Repo).filter(Repo.repo_git == repo_git).one()
+                repo = repos.get(repo_git)
+                if repo is None:
+                    self.logger.error(f"Could not start {col_hook.name} collection for {repo_git} because it is not in the repo table")
+                    continue
+
                 if "github" in repo.repo_git:
-                    augur_collection_sequence = []
-                    for job in col_hook.phases:
-                        #Add the phase to the sequence in order as a celery task.
-                        #The preliminary task creates the larger task chain 
-                        augur_collection_sequence.append(job(repo_git))
+                    phases = col_hook.phases
+                else:
+                    phases = col_hook.gitlab_phases
 
-                    #augur_collection_sequence.append(core_task_success_util.si(repo_git))
-                    #Link all phases in a chain and send to celery
-                    augur_collection_chain = chain(*augur_collection_sequence)
-                    task_id = augur_collection_chain.apply_async().task_id
+                if phases is None:
+                    continue
 
-                    self.logger.info(f"Setting github repo {col_hook.name} status to collecting for repo: {repo_git}")
+                augur_collection_sequence = []
+                for job in phases:
+                    #Add the phase to the sequence in order as a celery task.
+                    #The preliminary task creates the larger task chain 
+                    augur_collection_sequence.append(job(repo_git))
 
-                    #yield the value of the task_id to the calling method so that the proper collectionStatus field can be updated
-                    yield repo_git, task_id, col_hook.name
-                else:
-                    if col_hook.gitlab_phases is not None:
-                        
-                        augur_collection_sequence = []
-                        for job in col_hook.gitlab_phases:
-                            #Add the phase to the sequence in order as a celery task.
-                            #The preliminary task creates the larger task chain 
-                            augur_collection_sequence.append(job(repo_git))
-
-                        #augur_collection_sequence.append(core_task_success_util.si(repo_git))
-                        #Link all phases in a chain and send to celery
-                        augur_collection_chain = chain(*augur_collection_sequence)
-                        task_id = augur_collection_chain.apply_async().task_id
-
-                        self.logger.info(f"Setting gitlab repo {col_hook.name} status to collecting for repo: {repo_git}")
-
-                        #yield the value of the task_id to the calling method so that the proper collectionStatus field can be updated
-                        yield repo_git, task_id, col_hook.name
+                #augur_collection_sequence.append(core_task_success_util.si(repo_git))
+                #Link all phases in a chain. Freezing it assigns the task id it will be sent with
+                augur_collection_chain = chain(*augur_collection_sequence)
+                task_id = augur_collection_chain.freeze().id
+
+                yield repo_git, repo.repo_id, task_id, col_hook.name, getattr(repo, f"{col_hook.name}_status"), augur_collection_chain
+    
+    def send_messages(self, messages):
+        """Send the prepared task chains to celery.
+
+        Returns:
+            The messages that could not be sent
+        """
+        failed_messages = []
+
+        for message in messages:
+
+            repo_git, _, _, hook_name, _, augur_collection_chain = message
+
+            try:
+                augur_collection_chain.apply_async()
+            except Exception as e:
+                self.logger.error(f"Could not start {hook_name} collection for {repo_git}. Error: {e}")
+                failed_messages.append(message)
+                continue
+
+            self.logger.info(f"Started {hook_name} collection for repo: {repo_git}")
+
+        return failed_messages
 
 #def start_block_of_repos(logger,session,repo_git_identifiers,phases,repos_type,hook="core"):
 #
@@ -0,0 +1,182 @@
+"""This module defines the http client that is shared by all the api requests of a worker process.
+
+The client is created in the celery worker_process_init hook next to the database engine,
+so every page that a collector requests reuses the keep-alive connections of the process
+instead of doing a new TCP and TLS handshake.
+"""
+import logging
+import os
+import socket
+import threading
+from typing import Optional
+
+import httpx
+from redis import exceptions
+
+logger = logging.getLogger(__name__)
+
+# max connections kept open per worker process
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_EXPIRY = 60
+
+# the stats of each worker process are kept in a redis hash that expires once the process stops publishing them
+HTTP_CLIENT_STATS_PREFIX = "http_client_stats"
+HTTP_CLIENT_STATS_TTL = 24 * 60 * 60
+
+_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "new_connections": 0,
+    "tls_handshakes": 0,
+}
+
+
+def http2_available() -> bool:
+    """Determine if the optional h2 package is installed so http2 can be used.
+
+    Returns:
+        True if http2 can be enabled on the client
+    """
+    try:
+        import h2  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        return False
+
+    return True
+
+
+def _increment_stat(name: str) -> None:
+
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _trace(event_name: str, info: dict) -> None:
+    """Count the connections httpcore opens, so we can tell how many requests reused a connection."""
+
+    if event_name == "connection.connect_tcp.complete":
+        _increment_stat("new_connections")
+
+    elif event_name == "connection.start_tls.complete":
+        _increment_stat("tls_handshakes")
+
+
+def _on_request(request: httpx.Request) -> None:
+
+    _increment_stat("requests")
+    request.extensions["trace"] = _trace
+
+
+def create_http_client() -> httpx.Client:
+    """Create a keep-alive http client with a connection pool.
+
+    Returns:
+        A httpx client that uses http2 if the h2 package is installed
+    """
+    limits = httpx.Limits(max_connections=MAX_CONNECTIONS,
+                          max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                          keepalive_expiry=KEEPALIVE_EXPIRY)
+
+    return httpx.Client(http2=http2_available(), limits=limits, event_hooks={"request": [_on_request]})
+
+
+def init_http_client() -> httpx.Client:
+    """Create the http client for this process, closing the existing one if there is one.
+
+    Note:
+        This is called in the worker_process_init hook, so the client is never shared across a fork
+
+    Returns:
+        The http client of the process
+    """
+    global _client
+
+    with _client_lock:
+
+        if _client is not None:
+            _client.close()
+
+        _client = create_http_client()
+
+    return _client
+
+
+def get_http_client() -> httpx.Client:
+    """Get the http client of this process.
+
+    Note:
+        If the client was not created by the worker hook (the cli or api server for example) it is created lazily
+
+    Returns:
+        The http client of the process
+    """
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_http_client()
+
+    return _client
+
+
+def close_http_client() -> None:
+    """Close the http client of this process and its connections."""
+    global _client
+
+    with _client_lock:
+
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def get_http_client_stats() -> dict:
+    """Get the connection reuse counters of this process.
+
+    Returns:
+        Dict with the number of requests, new connections, tls handshakes and reused connections
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+
+    stats["reused_connections"] = max(stats["requests"] - stats["new_connections"], 0)
+
+    return stats
+
+
+def get_http_client_stats_key() -> str:
+    """Get the redis hash key the stats of this process are published to.
+
+    Returns:
+        Key that is unique to the host and pid of the process
+    """
+    return f"{HTTP_CLIENT_STATS_PREFIX}:{socket.gethostname()}:{os.getpid()}"
+
+
+def publish_http_client_stats(redis_connection) -> None:
+    """Publish the connection reuse counters of this process to its redis hash.
+
+    Note:
+        This is called after every task, since long lived worker processes are rarely shut down
+
+    Args:
+        redis_connection: connection to the redis cache
+    """
+    stats = get_http_client_stats()
+    key = get_http_client_stats_key()
+
+    try:
+        pipeline = redis_connection.pipeline()
+        pipeline.hset(key, mapping=stats)
+        pipeline.expire(key, HTTP_CLIENT_STATS_TTL)
+        pipeline.execute()
+    except exceptions.RedisError as e:
+        logger.error(f"Could not publish the http client stats. Error: {e}")
+        return
+
+    logger.debug(f"Http client stats of {key}: {stats}")
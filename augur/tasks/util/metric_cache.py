@@ -0,0 +1,222 @@
+"""This module defines the MetricCache class.
+The metric responses of the api are cached in redis, so every gunicorn worker and host shares them
+
+Each repo and repo group has a generation number that is part of the keys of its entries.
+When collection finishes for a repo, the numbers of the repo and its repo group are incremented,
+which invalidates all of their entries without looking for them. The old entries expire with their ttl.
+
+Every key also has the refresh generation, which is incremented when the materialized views and facade caches
+are refreshed, since those change the data of every repo at once.
+"""
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Callable, Optional, Tuple
+
+from redis import exceptions
+
+METRIC_CACHE_PREFIX = "augur_metric_cache"
+
+# seconds a metric response is cached for when the metric does not have its own ttl
+DEFAULT_METRIC_CACHE_TTL = 3600
+
+# seconds the collection validator of a repo or repo group is cached for.
+# It is also replaced when the repo is collected, so this only bounds how late new repos are noticed
+COLLECTION_VALIDATOR_TTL = 60
+
+# the ids are part of the scope of the entry, so they are not part of its params
+SCOPE_PARAMS = ("repo_id", "repo_group_id")
+
+# scope of the generation that is part of every key
+REFRESH_SCOPE = "refresh"
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_metric_params(params: dict) -> str:
+    """Normalize the parameters of a metric request, so the same request always has the same key.
+
+    Args:
+        params: the url and query parameters of the request
+
+    Returns:
+        json of the parameters that are set, sorted by name
+    """
+    normalized = {str(name): str(value) for name, value in params.items()
+                  if name not in SCOPE_PARAMS and value is not None and value != ""}
+
+    return json.dumps(normalized, sort_keys=True)
+
+
+class MetricCache:
+    """Cache of metric responses that is stored in redis.
+
+    Note:
+        When redis can not be reached, the responses are created without the cache
+
+    Attributes:
+        redis: connection to redis
+        default_ttl: seconds an entry is cached for when no ttl is given. 0 disables the cache
+    """
+
+    def __init__(self, redis_connection, default_ttl: int = DEFAULT_METRIC_CACHE_TTL):
+
+        self.redis = redis_connection
+        self.default_ttl = default_ttl
+
+    def get_or_create(self, metric: str, params: dict, createfunc: Callable[[], Any], ttl: Optional[int] = None) -> Any:
+        """Get the cached response of a metric request, or create and cache it.
+
+        Args:
+            metric: name of the metric
+            params: the url and query parameters of the request, including the repo_id or repo_group_id
+            createfunc: function that creates the response
+            ttl: seconds the response is cached for
+
+        Returns:
+            the response
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        if not ttl:
+            return createfunc()
+
+        try:
+            key = self.get_key(metric, params)
+            cached = self.redis.get(key)
+        except exceptions.RedisError as e:
+            logger.warning(f"Metric cache is not available, so {metric} is not cached. Error: {e}")
+            return createfunc()
+
+        if cached is not None:
+            return cached
+
+        response = createfunc()
+
+        # only serialized responses are cached
+        if isinstance(response, str):
+            try:
+                self.redis.set(key, response, ex=ttl)
+            except exceptions.RedisError as e:
+                logger.warning(f"Could not cache the response of {metric}. Error: {e}")
+
+        return response
+
+    def get_or_create_validator(self, params: dict, createfunc: Callable[[], Optional[dict]], ttl: int = COLLECTION_VALIDATOR_TTL) -> Optional[dict]:
+        """Get the collection validator of the repo or repo group of a request, or create and cache it.
+
+        Args:
+            params: the url parameters of the request, including the repo_id or repo_group_id
+            createfunc: function that creates the validator, which is a json serializable dict or None
+            ttl: seconds the validator is cached for
+
+        Returns:
+            the validator
+        """
+        try:
+            scope = self._get_scope(params)
+            key = f"{METRIC_CACHE_PREFIX}:validator:{scope}:{self._get_generation(scope)}"
+            cached = self.redis.get(key)
+        except exceptions.RedisError as e:
+            logger.warning(f"Metric cache is not available, so the collection validator is not cached. Error: {e}")
+            return createfunc()
+
+        if cached is not None:
+            return json.loads(cached)
+
+        validator = createfunc()
+
+        if validator is not None:
+            try:
+                self.redis.set(key, json.dumps(validator), ex=ttl)
+            except exceptions.RedisError as e:
+                logger.warning(f"Could not cache the collection validator. Error: {e}")
+
+        return validator
+
+    def get_key(self, metric: str, params: dict) -> str:
+        """Get the key of a metric request, which has the current generation of its repo or repo group."""
+
+        scope = self._get_scope(params)
+        generation = self._get_generation(scope)
+
+        params_hash = hashlib.sha1(normalize_metric_params(params).encode()).hexdigest()
+
+        return f"{METRIC_CACHE_PREFIX}:{scope}:{generation}:{metric}:{params_hash}"
+
+    def invalidate_all(self) -> None:
+        """Invalidate every cached response and collection validator, and record when that happened."""
+
+        pipeline = self.redis.pipeline()
+        pipeline.incr(self._get_generation_key(REFRESH_SCOPE))
+        pipeline.set(self._get_refreshed_at_key(), int(time.time()))
+        pipeline.execute()
+
+    def get_refresh_state(self) -> Tuple[int, Optional[int]]:
+        """Get the refresh generation and the epoch it was incremented at, which is None if it never was."""
+
+        generation, refreshed_at = self.redis.mget(self._get_generation_key(REFRESH_SCOPE), self._get_refreshed_at_key())
+
+        return int(generation or 0), int(refreshed_at) if refreshed_at is not None else None
+
+    def invalidate_repo(self, repo_id: int, repo_group_id: Optional[int] = None) -> None:
+        """Invalidate the cached responses of a repo, its repo group and the metrics that are not scoped to either."""
+
+        scopes = [f"repo:{repo_id}", "all"]
+        if repo_group_id is not None:
+            scopes.append(f"repo_group:{repo_group_id}")
+
+        pipeline = self.redis.pipeline()
+        for scope in scopes:
+            pipeline.incr(self._get_generation_key(scope))
+        pipeline.execute()
+
+    @staticmethod
+    def _get_scope(params: dict) -> str:
+
+        # a repo endpoint can also have a repo_group_id, but its data is only from the repo
+        if params.get("repo_id") is not None:
+            return f"repo:{params['repo_id']}"
+
+        if params.get("repo_group_id") is not None:
+            return f"repo_group:{params['repo_group_id']}"
+
+        return "all"
+
+    def _get_generation(self, scope: str) -> str:
+
+        refresh_generation, generation = self.redis.mget(self._get_generation_key(REFRESH_SCOPE), self._get_generation_key(scope))
+
+        return f"{refresh_generation or 0}.{generation or 0}"
+
+    @staticmethod
+    def _get_generation_key(scope: str) -> str:
+
+        return f"{METRIC_CACHE_PREFIX}:generation:{scope}"
+
+    @staticmethod
+    def _get_refreshed_at_key() -> str:
+
+        return f"{METRIC_CACHE_PREFIX}:refreshed_at"
+
+
+def invalidate_repo_metric_cache(repo_id: int, repo_group_id: Optional[int] = None) -> None:
+    """Invalidate the cached metric responses of a repo after its data is collected."""
+
+    from augur.tasks.init.redis_connection import redis_connection
+
+    try:
+        MetricCache(redis_connection).invalidate_repo(repo_id, repo_group_id)
+    except exceptions.RedisError as e:
+        logger.error(f"Could not invalidate the metric cache of repo {repo_id}. Error: {e}")
+
+
+def invalidate_all_metric_cache() -> None:
+    """Invalidate every cached metric response after the materialized views or facade caches are refreshed."""
+
+    from augur.tasks.init.redis_connection import redis_connection
+
+    try:
+        MetricCache(redis_connection).invalidate_all()
+    except exceptions.RedisError as e:
+        logger.error(f"Could not invalidate the metric cache. Error: {e}")
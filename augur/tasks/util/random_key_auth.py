@@ -1,9 +1,11 @@
 """This module defines the RandomKeyAuth class"""
-from typing import List, Optional, Generator
+from typing import List, Optional, Generator, TYPE_CHECKING
 
 from httpx import Auth, Request, Response
 from random import choice
 
+if TYPE_CHECKING:
+    from augur.tasks.util.api_key_scheduler import ApiKeyScheduler
 
 
 class RandomKeyAuth(Auth):
@@ -13,6 +15,7 @@ class RandomKeyAuth(Auth):
         list_of_keys ([str]): list of keys which are randomly selected from on each request
         header_name (str): name of header that the keys need to be set to 
         key_format (str): format string that defines the structure of the key and leaves a {} for the key to be inserted
+        key_scheduler (ApiKeyScheduler): if defined it picks the key with the most remaining rate limit instead of a random key
     """
     
     # pass a list of keys that are strings
@@ -20,19 +23,27 @@ class RandomKeyAuth(Auth):
     # Optionally pass the key_format. This is a string that contains a {} so the key can be added and applied to the header in the correct way.
     # For example on github the keys are formatted like "token asdfasfdasf" where asdfasfdasf is the key. So for github 
     # the key_format="token {0}"
-    def __init__(self, list_of_keys: List[str], header_name: str, logger, key_format: Optional[str] = None):
+    def __init__(self, list_of_keys: List[str], header_name: str, logger, key_format: Optional[str] = None, key_scheduler: Optional["ApiKeyScheduler"] = None):
         self.list_of_keys = list_of_keys
         self.header_name = header_name
         self.key_format = key_format
         self.logger = logger
+        self.key_scheduler = key_scheduler
 
     def auth_flow(self, request: Request) -> Generator[Request, Response, None]:
 
-        # the choice function is from the random library, and gets a random value from a list
-        # this gets a random key from the list
-        
+        key_value = None
+
         if self.list_of_keys:
-            key_value = choice(self.list_of_keys)
+
+            if self.key_scheduler:
+                # gets the key with the most remaining requests
+                key_value = self.key_scheduler.get_key(request)
+            else:
+                # the choice function is from the random library, and gets a random value from a list
+                # this gets a random key from the list
+                key_value = choice(self.list_of_keys)
+
             self.logger.debug(f'Key value used: {key_value}')
             # formats the key string into a format GitHub will accept
 
@@ -50,4 +61,46 @@ class RandomKeyAuth(Auth):
 
         # sends the request back with modified headers
         # basically it saves our changes to the request object
-        yield request
+        response = yield request
+
+        # record the rate limit the key has left so the scheduler can pick the next key
+        if self.key_scheduler and key_value:
+            self.key_scheduler.update_key(key_value, request, response)
+
+    def get_key_from_request(self, request: Request) -> Optional[str]:
+        """Get the api key that was set on a request.
+
+        Args:
+            request: request that was sent with this auth class
+
+        Returns:
+            The key or None if the request does not have one
+        """
+        key_string = request.headers.get(self.header_name)
+
+        if not key_string or not self.key_format:
+            return key_string
+
+        prefix, _, suffix = self.key_format.partition("{0}")
+
+        return key_string[len(prefix):len(key_string)-len(suffix)]
+
+    def handle_rate_limit_exceeded(self, response: Response) -> Optional[int]:
+        """Take the key of a rate limited response out of rotation.
+
+        Args:
+            response: the response that says the rate limit was exceeded
+
+        Returns:
+            The seconds to wait before another key can be used (0 if one can be used now),
+            or None if there is no key scheduler and the caller has to wait for the key itself
+        """
+        if not self.key_scheduler:
+            return None
+
+        key_value = self.get_key_from_request(response.request)
+
+        if key_value:
+            self.key_scheduler.disable_key(key_value, response.request, response)
+
+        return self.key_scheduler.seconds_until_key_available(response.request)
@@ -124,6 +124,30 @@ def calculate_date_weight_from_timestamps(added,last_collection,domain_start_day
             #Else increase its weight
             return -1 * factor
 
+def get_date_weight_sql(added_column, last_collection_column, domain_start_days=30):
+    """Get a sql expression that calculates calculate_date_weight_from_timestamps for every row of a query.
+
+    Note:
+        The expression uses a :now bind parameter, so the current time is the same as the python datetime.now()
+
+    Args:
+        added_column: sql name of the column that has when the repo was added
+        last_collection_column: sql name of the column that has when the repo was last collected
+        domain_start_days: days after the last collection that the weight starts to decrease
+
+    Returns:
+        String of the sql expression
+    """
+    #Whole days like timedelta.days, which are floored
+    def days_since(column):
+        return f"FLOOR(EXTRACT(EPOCH FROM (:now - {column})) / 86400)"
+
+    return f"""(CASE
+        WHEN {last_collection_column} IS NULL THEN POWER({days_since(added_column)}, 4)
+        WHEN {days_since(last_collection_column)} >= {domain_start_days} THEN POWER({days_since(last_collection_column)} - {domain_start_days}, 4)
+        ELSE -1 * POWER({days_since(last_collection_column)} - {domain_start_days}, 4)
+    END)"""
+
 def parse_json_from_subprocess_call(logger, subprocess_arr, cwd=None):
     logger.info(f"running subprocess {subprocess_arr[0]}")
     if cwd:
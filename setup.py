@@ -77,7 +77,7 @@ setup(
         "redis==4.3.3", # 4.3.4
         "XlsxWriter==1.3.7", # 3.0.3
         "celery==5.2.7", # 5.2.7
-        "httpx==0.23.0", # 0.23.0
+        "httpx[http2]==0.23.0", # 0.23.0
         "eventlet==0.33.3", 
         "flower==2.0.1",
         "tornado==6.3.3", # added because it sometimes errors when tornado is not 6.1 even though nothing we install depends on it
@@ -92,6 +92,7 @@ setup(
         "dev": [
             "tox==3.24.4", # 3.25.1
             "pytest==6.2.5", # 7.1.2
+            "fakeredis>=2.10.0", # redis for the metric cache tests
             "toml >= 0.10.2", # 0.10.2
             "ipdb==0.13.9", # 0.13.9
             "sphinx==7.2.6", #4.2.0", # 5.1.1
@@ -99,6 +100,10 @@ setup(
             "sphinxcontrib-openapi==0.8.3", # 0.7.0
             "sphinxcontrib-redoc==1.6.0", # 1.6.0
             "docutils==0.20.1" # 0.19
+        ],
+        "formats": [
+            "pyarrow>=12.0.0", # arrow and parquet metric responses
+            "brotli>=1.0.9" # brotli compressed api responses
         ]
     },
     entry_points={
@@ -0,0 +1,104 @@
+import gzip
+import io
+import json
+
+import pandas as pd
+import pytest
+from flask import Flask, Response
+
+from augur.api import response_formats
+from augur.api.response_formats import get_response_format, serialize_dataframe, compress_response, MIN_COMPRESSED_RESPONSE_SIZE
+
+app = Flask(__name__)
+
+
+@pytest.fixture
+def data():
+
+    return pd.DataFrame({"repo_id": [1, 2], "date": pd.to_datetime(["2023-01-02", "2023-01-09"]), "issues": [3, None]})
+
+
+def test_serialize_dataframe_columnar(data):
+
+    columnar = json.loads(serialize_dataframe(data, orient="columnar"))
+
+    assert columnar == {
+        "repo_id": [1, 2],
+        "date": ["2023-01-02T00:00:00.000", "2023-01-09T00:00:00.000"],
+        "issues": [3.0, None],
+    }
+
+    assert json.loads(serialize_dataframe(data))[0]["repo_id"] == 1
+
+
+def test_serialize_dataframe_arrow(data):
+
+    pyarrow = pytest.importorskip("pyarrow")
+
+    table = pyarrow.ipc.open_stream(serialize_dataframe(data, "arrow")).read_all()
+
+    assert table.column_names == ["repo_id", "date", "issues"]
+    assert table.column("repo_id").to_pylist() == [1, 2]
+
+
+def test_serialize_dataframe_parquet(data):
+
+    pytest.importorskip("pyarrow")
+
+    parquet = pd.read_parquet(io.BytesIO(serialize_dataframe(data, "parquet")))
+
+    assert parquet["repo_id"].tolist() == [1, 2]
+
+
+def test_get_response_format(monkeypatch):
+
+    monkeypatch.setattr(response_formats, "pyarrow_available", lambda: True)
+
+    assert get_response_format("parquet") == "parquet"
+    assert get_response_format("xml") is None
+
+    with app.test_request_context(headers={"Accept": "application/vnd.apache.arrow.stream"}):
+        assert get_response_format() == "arrow"
+
+    with app.test_request_context(headers={"Accept": "*/*"}):
+        assert get_response_format() == "json"
+
+    monkeypatch.setattr(response_formats, "pyarrow_available", lambda: False)
+
+    assert get_response_format("arrow") is None
+
+    with app.test_request_context(headers={"Accept": "application/vnd.apache.arrow.stream"}):
+        assert get_response_format() == "json"
+
+
+def test_compress_response(monkeypatch):
+
+    monkeypatch.setattr(response_formats, "brotli_available", lambda: False)
+
+    body = "a" * MIN_COMPRESSED_RESPONSE_SIZE
+
+    with app.test_request_context(headers={"Accept-Encoding": "br, gzip"}):
+        response = compress_response(Response(body))
+
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(response.get_data()).decode() == body
+        assert "Accept-Encoding" in response.vary
+
+        # small bodies are sent as they are
+        assert "Content-Encoding" not in compress_response(Response("a")).headers
+
+    with app.test_request_context():
+        assert "Content-Encoding" not in compress_response(Response(body)).headers
+
+
+def test_compress_response_brotli():
+
+    brotli = pytest.importorskip("brotli")
+
+    body = "a" * MIN_COMPRESSED_RESPONSE_SIZE
+
+    with app.test_request_context(headers={"Accept-Encoding": "gzip, br"}):
+        response = compress_response(Response(body))
+
+        assert response.headers["Content-Encoding"] == "br"
+        assert brotli.decompress(response.get_data()).decode() == body
@@ -0,0 +1,25 @@
+import pytest
+import sqlalchemy as s
+
+from augur.application.db.engine import CheckoutTimedQueuePool
+
+
+def test_checkout_timed_queue_pool_stats():
+
+    engine = s.create_engine("sqlite://", poolclass=CheckoutTimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.1)
+
+    connection = engine.connect()
+
+    # the only connection is checked out, so the next checkout waits and times out
+    with pytest.raises(s.exc.TimeoutError):
+        engine.connect()
+
+    stats = engine.pool.checkout_stats()
+
+    assert stats["checkouts"] == 2
+    assert stats["checkout_timeouts"] == 1
+    assert stats["max_wait_seconds"] >= 0.1
+    assert stats["checked_out"] == 1
+
+    connection.close()
+    engine.dispose()
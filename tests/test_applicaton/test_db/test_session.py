@@ -1,9 +1,10 @@
 import logging
 import pytest
 import uuid
+import datetime
 import sqlalchemy as s
 
-from augur.application.db.session import DatabaseSession
+from augur.application.db.session import DatabaseSession, format_copy_row, sort_by_natural_keys
 from augur.application.db.models import Contributor, Issue
 
 logger = logging.getLogger(__name__)
@@ -271,3 +272,39 @@ def test_session_without_passing_engine():
         assert isinstance(data, list)
 
 
+def test_format_copy_row():
+
+    row = {
+        "issue_title": "tab\there\nnew line \\ backslash",
+        "issue_body": None,
+        "created_at": datetime.datetime(2022, 8, 5, 9, 6, 39),
+        "gh_site_admin": False,
+        "data": {"key": "value"},
+        "gh_user_id": 4
+    }
+    columns = ["issue_title", "issue_body", "created_at", "gh_site_admin", "data", "gh_user_id"]
+
+    line = format_copy_row(row, columns, {"data"})
+
+    assert line == 'tab\\there\\nnew line \\\\ backslash\t\\N\t2022-08-05T09:06:39\tf\t{"key": "value"}\t4\n'
+
+
+def test_sort_by_natural_keys():
+
+    data = [
+        {"repo_id": 2, "gh_issue_id": 5},
+        {"repo_id": 1, "gh_issue_id": None},
+        {"repo_id": 1, "gh_issue_id": 3},
+    ]
+
+    sorted_data = sort_by_natural_keys(data, ["repo_id", "gh_issue_id"])
+
+    assert sorted_data == [
+        {"repo_id": 1, "gh_issue_id": 3},
+        {"repo_id": 1, "gh_issue_id": None},
+        {"repo_id": 2, "gh_issue_id": 5},
+    ]
+
+    # the order is the same no matter what order the rows are collected in
+    assert sort_by_natural_keys(list(reversed(data)), ["repo_id", "gh_issue_id"]) == sorted_data
+
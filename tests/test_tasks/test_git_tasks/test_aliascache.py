@@ -0,0 +1,64 @@
+import logging
+
+from augur.tasks.git.util.facade_worker.facade_worker.aliascache import ContributorAliasCache
+
+logger = logging.getLogger(__name__)
+
+
+class AliasSession:
+    """Session that answers the alias cache queries from a dict of aliases"""
+
+    logger = logger
+
+    def __init__(self, aliases):
+        self.aliases = aliases
+        self.queries = 0
+
+    def fetchall_data_from_sql_text(self, sql_text):
+
+        self.queries += 1
+        query = str(sql_text)
+
+        if "COUNT(*)" in query:
+            return [{"alias_count": len(self.aliases), "last_modified": None}]
+
+        if "alias_email=:alias_email" in query:
+            email = sql_text.compile().params["alias_email"]
+            return [{"canonical_email": self.aliases[email]}] if email in self.aliases else []
+
+        return [{"alias_email": alias, "canonical_email": canonical} for alias, canonical in self.aliases.items()]
+
+
+def test_alias_cache_bulk_load():
+
+    session = AliasSession({"bob@old.com": "bob@example.com"})
+    cache = ContributorAliasCache(session)
+
+    assert cache.get_canonical_email("bob@old.com") == "bob@example.com"
+    assert cache.get_canonical_email("alice@example.com") == "alice@example.com"
+
+    # the count and the aliases are loaded once, then every lookup is from memory
+    assert session.queries == 2
+
+
+def test_alias_cache_reloads_changed_aliases():
+
+    session = AliasSession({"bob@old.com": "bob@example.com"})
+    cache = ContributorAliasCache(session, refresh_interval=0)
+
+    assert cache.get_canonical_email("alice@old.com") == "alice@old.com"
+
+    session.aliases["alice@old.com"] = "alice@example.com"
+
+    assert cache.get_canonical_email("alice@old.com") == "alice@example.com"
+
+
+def test_alias_cache_bounded_size():
+
+    session = AliasSession({"bob@old.com": "bob@example.com", "alice@old.com": "alice@example.com"})
+    cache = ContributorAliasCache(session, max_size=1)
+
+    assert cache.get_canonical_email("bob@old.com") == "bob@example.com"
+    assert cache.get_canonical_email("alice@old.com") == "alice@example.com"
+
+    assert len(cache.aliases) == 1
@@ -0,0 +1,78 @@
+import logging
+import subprocess
+
+import pytest
+
+from augur.tasks.git.util.facade_worker.facade_worker.analyzecommit import parse_git_log, analyze_commits
+
+logger = logging.getLogger(__name__)
+
+
+class AliasFreeSession:
+    """Session that has no contributor aliases, so the raw emails are used"""
+
+    logger = logger
+
+    def fetchall_data_from_sql_text(self, sql_text):
+        return []
+
+
+def commit_header(commit_hash, parents):
+
+    return [
+        f"commit_hash: {commit_hash}",
+        "author_name: Bob",
+        "author_email: bob@example.com",
+        "author_date:2023-01-02 10:00:00 -0500",
+        "committer_name: Bob",
+        "committer_email: bob@example.com",
+        "committer_date: 2023-01-02 10:00:00 -0500",
+        f"parents: {parents}",
+        "EndPatch",
+    ]
+
+
+def test_parse_git_log_multiple_commits():
+
+    lines = commit_header("aaaa", "1111")
+    lines += [
+        "diff --git a/README.md b/README.md",
+        "--- a/README.md",
+        "+++ b/README.md",
+        "@@ -1,2 +1,3 @@",
+        "-hello world line",
+        "+hello world line ",
+        "+new line",
+        "+",
+        "diff --git a/old.py b/old.py",
+        "deleted file mode 100644",
+        "--- a/old.py",
+        "+++ /dev/null",
+        "-print(1)",
+    ]
+    lines += commit_header("bbbb", "1111 2222")
+
+    commits = dict(parse_git_log(AliasFreeSession(), 1, lines))
+
+    assert list(commits.keys()) == ["aaaa", "bbbb"]
+
+    readme, deleted = commits["aaaa"]
+
+    assert readme["cmt_filename"] == "README.md"
+    assert (readme["cmt_added"], readme["cmt_removed"], readme["cmt_whitespace"]) == (1, 0, 2)
+    assert readme["cmt_author_date"] == "2023-01-02"
+
+    assert deleted["cmt_filename"] == "(Deleted) old.py"
+    assert deleted["cmt_removed"] == 1
+
+    merge, = commits["bbbb"]
+
+    assert merge["cmt_filename"] == "(Merge commit)"
+    assert merge["cmt_commit_hash"] == "bbbb"
+
+
+def test_analyze_commits_raises_when_git_log_fails(tmp_path):
+
+    # the repo does not exist, so git log exits with an error before writing any commits
+    with pytest.raises(subprocess.CalledProcessError):
+        list(analyze_commits(AliasFreeSession(), 1, str(tmp_path / ".git"), ["aaaa"]))
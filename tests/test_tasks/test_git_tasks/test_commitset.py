@@ -0,0 +1,28 @@
+from augur.tasks.git.util.facade_worker.facade_worker.commitset import CommitHashSet
+
+
+def test_commit_hash_set_difference():
+
+    existing_commits = CommitHashSet(["a" * 40, "b" * 40, "not a hash"])
+    parent_commits = {"b" * 40, "c" * 40, "not a hash"}
+
+    assert len(existing_commits) == 3
+    assert "a" * 40 in existing_commits
+    assert "not a hash" in existing_commits
+
+    # missing commits are the parents that are not in the database
+    assert parent_commits - existing_commits == {"c" * 40}
+
+    # trimmed commits are in the database but are no longer parents
+    assert existing_commits - parent_commits == {"a" * 40}
+
+
+def test_commit_hash_set_uppercase_hashes():
+
+    commits = CommitHashSet(["A" * 40])
+
+    assert "a" * 40 in commits
+    assert "A" * 40 in commits
+
+    # hashes are yielded in lowercase like git writes them
+    assert list(commits) == ["a" * 40]
@@ -0,0 +1,112 @@
+import logging
+from datetime import datetime
+
+import pytest
+
+from augur.tasks.github.issues import tasks as issue_tasks
+from augur.tasks.github.pull_requests import tasks as pr_tasks
+from augur.tasks.github.messages import tasks as message_tasks
+from augur.tasks.github.events import tasks as event_tasks
+
+logger = logging.getLogger(__name__)
+
+repo_git = "https://github.com/chaoss/augur"
+
+
+class FakePaginator:
+    """Returns the given pages instead of requesting them from github."""
+
+    def __init__(self, pages):
+
+        self.pages = pages
+
+    def __call__(self, url, key_auth, logger, **kwargs):
+
+        return self
+
+    def get_num_pages(self):
+
+        return len(self.pages)
+
+    def iter_pages_concurrently(self, concurrency=None, num_pages=None):
+
+        for page, page_data in enumerate(self.pages, start=1):
+            yield page_data, page
+
+
+def create_pages(num_pages, page_size=3, timestamp="2023-01-01T00:00:00Z"):
+
+    return [[{"id": page * page_size + item, "updated_at": timestamp, "created_at": timestamp} for item in range(page_size)]
+            for page in range(num_pages)]
+
+
+def retrieve_issues(**kwargs):
+
+    return issue_tasks.retrieve_all_issue_data(repo_git, logger, None, **kwargs)
+
+
+def retrieve_prs(**kwargs):
+
+    return pr_tasks.retrieve_all_pr_data(repo_git, logger, None, **kwargs)
+
+
+def retrieve_messages(**kwargs):
+
+    return message_tasks.retrieve_all_pr_and_issue_messages(repo_git, logger, None, "Message task", **kwargs)
+
+
+def retrieve_events(**kwargs):
+
+    return event_tasks.retrieve_all_event_data(repo_git, logger, None, **kwargs)
+
+
+collectors = [
+    (issue_tasks, retrieve_issues),
+    (pr_tasks, retrieve_prs),
+    (message_tasks, retrieve_messages),
+    (event_tasks, retrieve_events),
+]
+
+
+@pytest.mark.parametrize("module, retrieve", collectors)
+def test_retrieve_yields_batches_of_pages(monkeypatch, module, retrieve):
+
+    pages = create_pages(7)
+    monkeypatch.setattr(module, "GithubPaginator", FakePaginator(pages))
+
+    batches = list(retrieve(batch_size=3))
+
+    # every batch is flushed once it has batch_size pages, and the partial batch at the end is flushed too
+    assert [len(batch) for batch in batches] == [9, 9, 3]
+    assert [item for batch in batches for item in batch] == [item for page in pages for item in page]
+
+
+@pytest.mark.parametrize("module, retrieve", collectors)
+def test_retrieve_stops_at_empty_page(monkeypatch, module, retrieve):
+
+    pages = create_pages(2) + [[]] + create_pages(2)
+    monkeypatch.setattr(module, "GithubPaginator", FakePaginator(pages))
+
+    batches = list(retrieve(batch_size=10))
+
+    assert [len(batch) for batch in batches] == [6]
+
+
+@pytest.mark.parametrize("module, retrieve", collectors)
+def test_retrieve_yields_nothing_for_no_pages(monkeypatch, module, retrieve):
+
+    monkeypatch.setattr(module, "GithubPaginator", FakePaginator([]))
+
+    assert list(retrieve(batch_size=3)) == []
+
+
+@pytest.mark.parametrize("module, retrieve", [(pr_tasks, retrieve_prs), (event_tasks, retrieve_events)])
+def test_retrieve_since_flushes_batch_at_old_item(monkeypatch, module, retrieve):
+
+    pages = create_pages(2, timestamp="2023-02-01T00:00:00Z") + create_pages(2, timestamp="2023-01-01T00:00:00Z")
+    monkeypatch.setattr(module, "GithubPaginator", FakePaginator(pages))
+
+    batches = list(retrieve(since=datetime(2023, 1, 15), batch_size=1))
+
+    # the newer pages are each their own batch and no item older than since is yielded
+    assert [len(batch) for batch in batches] == [3, 3]
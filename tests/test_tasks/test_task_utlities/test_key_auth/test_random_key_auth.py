@@ -46,6 +46,25 @@ def test_token_header():
 
             assert key == response.request.headers[header]
 
+def test_get_key_from_request():
+
+    key = "asubasdfobhaosf"
+    key_format = "token {0}"
+
+    key_auth = RandomKeyAuth([key], "Authorization", logger, key_format)
+
+    request = httpx.Request("GET", "https://api.github.com/", headers={"Authorization": key_format.format(key)})
+
+    assert key == key_auth.get_key_from_request(request)
+
+def test_handle_rate_limit_exceeded_without_scheduler():
+
+    key_auth = RandomKeyAuth(["asubasdfobhaosf"], "Authorization", logger)
+
+    response = httpx.Response(403, request=httpx.Request("GET", "https://api.github.com/"))
+
+    assert key_auth.handle_rate_limit_exceeded(response) is None
+
 # def test_if_headers_are_random():
 
 #     urls = ["https://www.google.com/", "https://www.yahoo.com/", "https://www.amazon.com/", "https://www.walmart.com/", "https://github.com/", "https://www.apple.com/", "https://www.instagram.com/", "https://www.facebook.com/"]
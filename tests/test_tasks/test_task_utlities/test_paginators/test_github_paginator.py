@@ -1,8 +1,9 @@
 import pytest
 import logging
+import threading
 import httpx
 
-from augur.tasks.github.util.github_paginator import GithubPaginator, GithubApiResult
+from augur.tasks.github.util.github_paginator import GithubPaginator, GithubApiResult, get_url_page_number
 from augur.tasks.github.util.github_random_key_auth import GithubRandomKeyAuth
 # from augur.tasks.util.random_key_auth import RandomKeyAuth
 from augur.application.db.session import DatabaseSession
@@ -106,3 +107,44 @@ def test_github_paginator_get_item(key_auth):
 
     assert contributors_list[5] is None
 
+
+
+def test_github_paginator_iter_pages_concurrently(key_auth):
+
+    url = "https://api.github.com/repos/chaoss/augur/pulls?state=all&direction=asc&per_page=100"
+
+    sequential_pages = list(GithubPaginator(url, key_auth, logger).iter_pages())
+    concurrent_pages = list(GithubPaginator(url, key_auth, logger).iter_pages_concurrently(concurrency=4))
+
+    assert len(concurrent_pages) > 1
+    assert [page for _, page in concurrent_pages] == [page for _, page in sequential_pages]
+    assert [data[0]["id"] for data, _ in concurrent_pages] == [data[0]["id"] for data, _ in sequential_pages]
+
+
+def test_github_paginator_iter_pages_concurrently_fetches_while_page_is_processed():
+
+    url = "https://api.github.com/repos/chaoss/augur/issues?state=all"
+
+    paginator = GithubPaginator(url, None, logger)
+
+    fetched = {page: threading.Event() for page in range(1, 5)}
+
+    def retrieve_data(page_url):
+
+        page = get_url_page_number(page_url)
+        fetched[page].set()
+
+        return [{"page": page}], httpx.Response(200), GithubApiResult.SUCCESS
+
+    paginator.retrieve_data = retrieve_data
+
+    pages = paginator.iter_pages_concurrently(concurrency=2, num_pages=4)
+
+    data, page = next(pages)
+    assert page == 1
+
+    # the caller is still processing the first page, so the pages after it have to be fetched in the background
+    assert fetched[2].wait(timeout=5)
+    assert fetched[3].wait(timeout=5)
+
+    assert [page for _, page in pages] == [2, 3, 4]
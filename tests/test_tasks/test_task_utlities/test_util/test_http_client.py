@@ -0,0 +1,36 @@
+import fakeredis
+import pytest
+
+from augur.tasks.util import http_client
+from augur.tasks.util.http_client import get_http_client_stats, get_http_client_stats_key, publish_http_client_stats, HTTP_CLIENT_STATS_TTL
+
+
+@pytest.fixture
+def redis_connection():
+
+    connection = fakeredis.FakeRedis(decode_responses=True)
+
+    yield connection
+
+    connection.flushall()
+
+
+def test_publish_http_client_stats(redis_connection, monkeypatch):
+
+    monkeypatch.setitem(http_client._stats, "requests", 10)
+    monkeypatch.setitem(http_client._stats, "new_connections", 2)
+    monkeypatch.setitem(http_client._stats, "tls_handshakes", 2)
+
+    publish_http_client_stats(redis_connection)
+
+    key = get_http_client_stats_key()
+
+    assert redis_connection.hgetall(key) == {name: str(value) for name, value in get_http_client_stats().items()}
+    assert redis_connection.hget(key, "reused_connections") == "8"
+    assert 0 < redis_connection.ttl(key) <= HTTP_CLIENT_STATS_TTL
+
+    # the hash is overwritten each time, so it always has the latest counters of the process
+    monkeypatch.setitem(http_client._stats, "requests", 11)
+    publish_http_client_stats(redis_connection)
+
+    assert redis_connection.hget(key, "requests") == "11"
@@ -0,0 +1,99 @@
+import fakeredis
+import pytest
+
+from augur.tasks.util.metric_cache import MetricCache, normalize_metric_params
+
+
+@pytest.fixture
+def redis_connection():
+
+    # the api and workers connect to redis with decode_responses, so the cache has to work with str values
+    connection = fakeredis.FakeRedis(decode_responses=True)
+
+    yield connection
+
+    connection.flushall()
+
+
+def test_normalize_metric_params():
+
+    params = {"repo_id": "1", "period": "week", "begin_date": "", "end_date": None, "orient": "records"}
+
+    assert normalize_metric_params(params) == normalize_metric_params({"orient": "records", "period": "week"})
+
+
+def test_metric_cache_invalidate_repo(redis_connection):
+
+    cache = MetricCache(redis_connection)
+    calls = []
+
+    def create():
+        calls.append(1)
+        return f"response {len(calls)}"
+
+    assert cache.get_or_create("issues-new", {"repo_id": "1", "period": "week"}, create) == "response 1"
+    assert cache.get_or_create("issues-new", {"period": "week", "repo_id": "1"}, create) == "response 1"
+    assert cache.get_or_create("issues-new", {"repo_group_id": "10", "period": "week"}, create) == "response 2"
+
+    cache.invalidate_repo(1, 10)
+
+    assert cache.get_or_create("issues-new", {"repo_id": "1", "period": "week"}, create) == "response 3"
+    assert cache.get_or_create("issues-new", {"repo_group_id": "10", "period": "week"}, create) == "response 4"
+
+
+def test_metric_cache_collection_validator(redis_connection):
+
+    cache = MetricCache(redis_connection)
+    validators = []
+
+    def create():
+        validators.append({"state": f"collected {len(validators)}"})
+        return validators[-1]
+
+    assert cache.get_or_create_validator({"repo_id": "1"}, create) == {"state": "collected 0"}
+    assert cache.get_or_create_validator({"repo_id": "1"}, create) == {"state": "collected 0"}
+
+    cache.invalidate_repo(1, 10)
+
+    assert cache.get_or_create_validator({"repo_id": "1"}, create) == {"state": "collected 1"}
+
+
+def test_metric_cache_invalidate_all(redis_connection):
+
+    cache = MetricCache(redis_connection)
+    calls = []
+
+    def create():
+        calls.append(1)
+        return f"response {len(calls)}"
+
+    assert cache.get_or_create("repo-groups", {}, create) == "response 1"
+    assert cache.get_or_create("issues-new", {"repo_id": "1"}, create) == "response 2"
+    assert cache.get_or_create("repo-groups", {}, create) == "response 1"
+
+    cache.invalidate_all()
+
+    assert cache.get_or_create("repo-groups", {}, create) == "response 3"
+    assert cache.get_or_create("issues-new", {"repo_id": "1"}, create) == "response 4"
+
+
+def test_metric_cache_refresh_state(redis_connection):
+
+    cache = MetricCache(redis_connection)
+    validators = []
+
+    def create():
+        validators.append({"state": f"refresh {cache.get_refresh_state()[0]}"})
+        return validators[-1]
+
+    assert cache.get_refresh_state() == (0, None)
+    assert cache.get_or_create_validator({}, create) == {"state": "refresh 0"}
+
+    cache.invalidate_all()
+
+    generation, refreshed_at = cache.get_refresh_state()
+    assert generation == 1
+    assert refreshed_at is not None
+
+    # the validators are created again after a refresh, so their state has the new generation
+    assert cache.get_or_create_validator({}, create) == {"state": "refresh 1"}